@@ -1,4 +1,5 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
@@ -7,8 +8,10 @@ from django.utils import timezone
 from .models import (
     UserProfile, Wallet, Transaction, ReferralProgram, ReferralCode, Referral,
     MerchantApplication, Product, ProductImage, ProductSubmission, MarketplaceSettings,
-    Purchase, Review, Notification, Wishlist, UserActivity, SystemSettings
+    Purchase, Review, Notification, Wishlist, UserActivity, SystemSettings,
+    LedgerAccount, LedgerEntry, TransactionArchive, UserActivityArchive
 )
+from . import ledger
 
 # Inline admin descriptor for UserProfile model
 class UserProfileInline(admin.StackedInline):
@@ -77,12 +80,49 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 
 # Wallet and Transaction Admin
+class WalletAdminForm(forms.ModelForm):
+    """Wallet form with a balance correction posted through the ledger"""
+
+    adjustment_currency = forms.ChoiceField(choices=[('', '---------')] + Wallet.CURRENCY_CHOICES, required=False)
+    adjustment_amount = forms.DecimalField(
+        max_digits=15, decimal_places=8, required=False,
+        help_text='Credited to the balance; negative to debit. Posted as a ledger adjustment.'
+    )
+    adjustment_memo = forms.CharField(max_length=100, required=False, help_text='Reason, kept on the ledger entries')
+
+    class Meta:
+        model = Wallet
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('adjustment_amount'):
+            if not cleaned_data.get('adjustment_currency'):
+                self.add_error('adjustment_currency', 'Choose the balance to adjust.')
+            if not cleaned_data.get('adjustment_memo'):
+                self.add_error('adjustment_memo', 'Give a reason for the adjustment.')
+        return cleaned_data
+
+
+def save_form_fields(obj, form):
+    """
+    Save only the model fields the admin form edits.
+
+    A full save() would write back balances and statuses read when the
+    form was opened, undoing whatever the ledger has posted since.
+    """
+    names = {field.name for field in obj._meta.concrete_fields}
+    obj.save(update_fields=[name for name in form.changed_data if name in names] + ['updated_at'])
+
+
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
-    list_display = ['user', 'usd_balance', 'ngn_balance', 'is_frozen', 'get_total_balance_usd', 'updated_at']
+    form = WalletAdminForm
+    list_display = ['user', 'usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance', 'is_frozen', 'get_total_balance_usd', 'updated_at']
     list_filter = ['is_frozen', 'two_factor_enabled', 'created_at']
     search_fields = ['user__username', 'user__email']
-    readonly_fields = ['created_at', 'updated_at']
+    # Balances only move through the ledger; use the adjustment fields
+    readonly_fields = ['usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance', 'created_at', 'updated_at']
     
     fieldsets = (
         ('User', {
@@ -91,6 +131,9 @@ class WalletAdmin(admin.ModelAdmin):
         ('Balances', {
             'fields': ('usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance')
         }),
+        ('Balance Adjustment', {
+            'fields': ('adjustment_currency', 'adjustment_amount', 'adjustment_memo')
+        }),
         ('Security', {
             'fields': ('is_frozen', 'freeze_reason', 'two_factor_enabled')
         }),
@@ -103,13 +146,40 @@ class WalletAdmin(admin.ModelAdmin):
         })
     )
 
+    def get_readonly_fields(self, request, obj=None):
+        # The ledger accounts belong to the user, not the wallet row
+        if obj is not None:
+            return self.readonly_fields + ['user']
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            save_form_fields(obj, form)
+        else:
+            super().save_model(request, obj, form, change)
+
+        amount = form.cleaned_data.get('adjustment_amount')
+        if not amount:
+            return
+        currency = form.cleaned_data['adjustment_currency']
+        memo = f"Adjustment by {request.user.username}: {form.cleaned_data['adjustment_memo']}"
+        try:
+            ledger.post_adjustment(obj.user, currency, amount, memo)
+        except ledger.LedgerError as e:
+            self.message_user(request, f"Adjustment of {amount} {currency} was not posted: {e}", messages.ERROR)
+        else:
+            self.message_user(request, f"Posted an adjustment of {amount} {currency}.")
+
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ['reference', 'user', 'transaction_type', 'amount', 'currency', 'status', 'created_at']
     list_filter = ['transaction_type', 'status', 'currency', 'created_at']
     search_fields = ['user__username', 'reference', 'external_reference', 'description']
-    readonly_fields = ['id', 'created_at', 'updated_at']
+    # Status changes go through the actions so they are posted to the ledger
+    readonly_fields = ['id', 'status', 'created_at', 'updated_at', 'completed_at']
+    # Fixed once the transaction has left pending, as the ledger posted them
+    posted_fields = ['user', 'transaction_type', 'amount', 'currency', 'fee_amount', 'recipient']
     
     fieldsets = (
         ('Transaction Details', {
@@ -130,6 +200,91 @@ class TransactionAdmin(admin.ModelAdmin):
         })
     )
 
+    actions = ['complete_transactions', 'cancel_transactions']
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None and obj.status not in ('pending', 'processing'):
+            return self.readonly_fields + self.posted_fields
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            save_form_fields(obj, form)
+        else:
+            super().save_model(request, obj, form, change)
+
+    def complete_transactions(self, request, queryset):
+        """Complete pending transactions and post them to the ledger"""
+        count = 0
+        for txn in queryset.filter(status__in=['pending', 'processing']):
+            try:
+                ledger.complete_transaction(txn)
+                count += 1
+            except ledger.LedgerError as e:
+                self.message_user(request, f"{txn.reference}: {e}", messages.ERROR)
+        
+        self.message_user(request, f"Completed {count} transactions.")
+    complete_transactions.short_description = "Complete selected transactions"
+
+    def cancel_transactions(self, request, queryset):
+        """Cancel transactions, reversing the ledger postings of completed ones"""
+        count = 0
+        for txn in queryset.filter(status__in=['pending', 'processing', 'completed']):
+            try:
+                ledger.cancel_transaction(txn)
+                count += 1
+            except ledger.LedgerError as e:
+                self.message_user(request, f"{txn.reference}: {e}", messages.ERROR)
+        
+        self.message_user(request, f"Cancelled {count} transactions.")
+    cancel_transactions.short_description = "Cancel selected transactions"
+
+
+@admin.register(LedgerAccount)
+class LedgerAccountAdmin(admin.ModelAdmin):
+    list_display = ['key', 'kind', 'currency', 'balance', 'updated_at']
+    list_filter = ['kind', 'currency']
+    search_fields = ['key', 'user__username']
+    readonly_fields = ['key', 'user', 'kind', 'currency', 'balance', 'created_at', 'updated_at']
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    # transaction_id: the transaction may have been archived
+    list_display = ['account', 'amount', 'transaction_id', 'memo', 'created_at']
+    list_filter = ['account__kind', 'account__currency']
+    search_fields = ['account__key', 'memo']
+    readonly_fields = ['transaction_id', 'account', 'amount', 'memo', 'created_at']
+    exclude = ['transaction']
+
+
+@admin.register(TransactionArchive)
+class TransactionArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'transaction_type', 'amount', 'currency', 'status', 'created_at', 'archived_at']
+    list_filter = ['transaction_type', 'status', 'currency']
+    search_fields = ['user__username', 'reference', 'external_reference']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(UserActivityArchive)
+class UserActivityArchiveAdmin(admin.ModelAdmin):
+    list_display = ['user', 'activity_type', 'created_at', 'archived_at']
+    list_filter = ['activity_type']
+    search_fields = ['user__username', 'description']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 # Referral System Admin
 @admin.register(ReferralProgram)
@@ -235,7 +390,8 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ['title', 'seller', 'get_business_name', 'category', 'price', 'status', 'in_stock', 'created_at']
     list_filter = ['status', 'category', 'condition', 'in_stock', 'featured', 'seller_verified', 'created_at']
     search_fields = ['title', 'description', 'tags', 'seller__username', 'merchant_application__business_name']
-    readonly_fields = ['id', 'views', 'saves', 'created_at', 'updated_at']
+    # Rating columns are running totals kept by review changes
+    readonly_fields = ['id', 'rating', 'review_count', 'views', 'saves', 'created_at', 'updated_at']
     filter_horizontal = []
     
     fieldsets = (
@@ -306,13 +462,24 @@ class ProductAdmin(admin.ModelAdmin):
     
     def feature_products(self, request, queryset):
         """Mark products as featured"""
-        count = queryset.filter(status='approved').update(featured=True)
+        # Saved one by one so the facet counts and marketplace cache follow
+        count = 0
+        for product in queryset.filter(status='approved', featured=False):
+            product.featured = True
+            product.save()
+            count += 1
+        
         self.message_user(request, f"Featured {count} products.")
     feature_products.short_description = "Mark as featured"
     
     def unfeature_products(self, request, queryset):
         """Remove featured status from products"""
-        count = queryset.update(featured=False)
+        count = 0
+        for product in queryset.filter(featured=True):
+            product.featured = False
+            product.save()
+            count += 1
+        
         self.message_user(request, f"Removed featured status from {count} products.")
     unfeature_products.short_description = "Remove featured status"
 
@@ -8,11 +8,21 @@ from .serializers import (
     MerchantApplicationSerializer, 
     ProductSerializer, 
     ProductSubmissionSerializer,
-    MarketplaceSettingsSerializer
+    MarketplaceSettingsSerializer,
+    ProductCardSerializer,
+    product_card_queryset
 )
+from .idempotency import IdempotentCreateMixin, idempotent
+from .pagination import ProductKeysetPagination
+from .facets import marketplace_facets
+from .response_cache import get_or_build, marketplace_tags, normalize_marketplace_params
+from .search import search_products
+from .tags import filter_by_tags, parse_tag_param
+from .similarity import similar_products
+from .view_counter import record_product_view
 
 
-class MerchantApplicationViewSet(viewsets.ModelViewSet):
+class MerchantApplicationViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
     """ViewSet for merchant applications"""
     
     serializer_class = MerchantApplicationSerializer
@@ -59,6 +69,7 @@ class MerchantApplicationViewSet(viewsets.ModelViewSet):
         })
     
     @action(detail=True, methods=['post'])
+    @idempotent
     def submit(self, request, pk=None):
         """Submit application for review"""
         application = self.get_object()
@@ -83,6 +94,7 @@ class ProductViewSet(viewsets.ModelViewSet):
     
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ProductKeysetPagination
     
     def get_queryset(self):
         """Return products based on user permissions"""
@@ -104,17 +116,41 @@ class ProductViewSet(viewsets.ModelViewSet):
         if category:
             queryset = queryset.filter(category=category)
         
-        # Search functionality
+        # Search functionality (full-text index, ranked by relevance)
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) |
-                Q(description__icontains=search) |
-                Q(tags__icontains=search)
-            )
+            queryset = search_products(queryset, search)
         
         return queryset.select_related('seller', 'merchant_application').prefetch_related('images')
     
+    def get_serializer_class(self):
+        """Use product cards for listings, the full serializer elsewhere"""
+        if self.action in ['list', 'marketplace']:
+            return ProductCardSerializer
+        return ProductSerializer
+    
+    def filter_queryset(self, queryset):
+        """Project list queries down to product card columns"""
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = product_card_queryset(queryset)
+        return queryset
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Return a product and count the view"""
+        product = self.get_object()
+        record_product_view(request, product)
+        serializer = self.get_serializer(product)
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Get precomputed similar products"""
+        product = self.get_object()
+        products = product_card_queryset(similar_products(product))
+        serializer = ProductCardSerializer(products, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+    
     def perform_create(self, serializer):
         """Set seller and merchant application when creating product"""
         # Get user's approved merchant application
@@ -216,53 +252,82 @@ class ProductViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def marketplace(self, request):
-        """Get approved products for marketplace display"""
+        """Get approved products for marketplace display (cached per filter set)
+        
+        With ?facets=true returns category, condition and price range counts
+        for the current filters instead of a page of products.
+        """
+        params = normalize_marketplace_params(request)
+        if params.get('facets') == 'true':
+            build = lambda: marketplace_facets(params, lambda skip: self.filter_marketplace(request, skip))
+        else:
+            build = lambda: self.build_marketplace_page(request)
+        data = get_or_build('marketplace', params, marketplace_tags(params), build)
+        return Response(data)
+    
+    def filter_marketplace(self, request, skip=()):
+        """Apply the marketplace filters, leaving out the facets named in `skip`"""
         products = Product.objects.filter(
             status='approved',
             in_stock=True,
             stock_count__gt=0
-        ).select_related('seller', 'merchant_application').prefetch_related('images')
+        )
         
         # Apply filters
         category = request.query_params.get('category')
-        if category:
+        if category and 'category' not in skip:
             products = products.filter(category=category)
         
         min_price = request.query_params.get('min_price')
         max_price = request.query_params.get('max_price')
-        if min_price:
-            products = products.filter(price__gte=min_price)
-        if max_price:
-            products = products.filter(price__lte=max_price)
+        if 'price' not in skip:
+            if min_price:
+                products = products.filter(price__gte=min_price)
+            if max_price:
+                products = products.filter(price__lte=max_price)
         
         condition = request.query_params.get('condition')
-        if condition:
+        if condition and 'condition' not in skip:
             products = products.filter(condition=condition)
         
         featured_only = request.query_params.get('featured')
         if featured_only == 'true':
             products = products.filter(featured=True)
         
+        # Tag filters: ?tags=a,b with tags_mode=all (default) or any
+        tags = parse_tag_param(request.query_params.get('tags'))
+        if tags:
+            match_all = request.query_params.get('tags_mode', 'all') != 'any'
+            products = filter_by_tags(products, tags, match_all=match_all)
+        
         search = request.query_params.get('search')
         if search:
-            products = products.filter(
-                Q(title__icontains=search) |
-                Q(description__icontains=search) |
-                Q(tags__icontains=search)
-            )
+            products = search_products(products, search)
         
-        # Ordering
-        ordering = request.query_params.get('ordering', '-created_at')
-        products = products.order_by(ordering)
+        return products
+    
+    def build_marketplace_page(self, request):
+        """Run the marketplace query and return the serialized page"""
+        products = self.filter_marketplace(request)
+        search = request.query_params.get('search')
+        
+        # Ordering (search results default to relevance)
+        ordering = request.query_params.get('ordering')
+        if ordering and ordering.lstrip('-') in ProductKeysetPagination.keyset_fields:
+            products = products.order_by(ordering)
+        elif not search:
+            products = products.order_by('-created_at')
+        
+        products = product_card_queryset(products)
         
         # Paginate
         page = self.paginate_queryset(products)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(serializer.data).data
         
         serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return serializer.data
 
 
 class ProductSubmissionViewSet(viewsets.ReadOnlyModelViewSet):
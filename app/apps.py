@@ -8,3 +8,7 @@ class AppConfig(AppConfig):
     def ready(self):
         """Import signals when the app is ready"""
         import app.models  # This will trigger the signal registration
+
+        from django.core import checks
+        from .response_cache import check_shared_cache
+        checks.register(check_shared_cache, checks.Tags.caches)
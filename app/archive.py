@@ -0,0 +1,149 @@
+"""
+Hot/cold archival of transaction and activity history
+Rows older than the archive horizon are copied into TransactionArchive and
+UserActivityArchive and removed from the hot tables a chunk at a time, so
+the tables every request touches stay small. History views read both
+through ArchivedHistory, which merges them in the requested order.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Value
+from django.utils import timezone
+
+ARCHIVE_AFTER = getattr(settings, 'HISTORY_ARCHIVE_AFTER', timedelta(days=365))
+CHUNK_SIZE = getattr(settings, 'HISTORY_ARCHIVE_CHUNK_SIZE', 1000)
+
+# Transactions in these states no longer change, except completed ones
+# being cancelled, which only happens well inside the horizon
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def archive_cutoff(now=None):
+    return (now or timezone.now()) - ARCHIVE_AFTER
+
+
+def _copied_fields(archive_model):
+    return [field.attname for field in archive_model._meta.concrete_fields if field.name != 'archived_at']
+
+
+def _move_chunk(candidates, archive_model, chunk_size):
+    """Copy the oldest `chunk_size` candidates into `archive_model`, then delete them"""
+    model = candidates.model
+    fields = _copied_fields(archive_model)
+    with transaction.atomic():
+        ids = list(candidates.select_for_update().order_by('created_at').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return 0
+        now = timezone.now()
+        rows = model.objects.filter(pk__in=ids).values(*fields)
+        # A chunk copied by a run that died before deleting is simply skipped
+        archive_model.objects.bulk_create(
+            [archive_model(archived_at=now, **row) for row in rows], ignore_conflicts=True
+        )
+        # Bypasses the delete collector: ledger entries PROTECT their
+        # transaction and must keep pointing at the archived id, and the
+        # wallet summary's transaction count includes archived rows
+        chunk = model.objects.filter(pk__in=ids)
+        chunk._raw_delete(chunk.db)
+    return len(ids)
+
+
+def archivable_transactions(cutoff):
+    """
+    Finished transactions created before `cutoff` that nothing hot links to.
+
+    Purchases, referrals, notifications and activity rows point at
+    transactions through constrained foreign keys, so a transaction stays
+    hot until they are gone or archived themselves.
+    """
+    from .models import Notification, Purchase, Referral, Transaction, UserActivity
+
+    linked = (
+        Purchase.objects.filter(payment_transaction=OuterRef('pk')),
+        Referral.objects.filter(referrer_transaction=OuterRef('pk')),
+        Referral.objects.filter(referee_transaction=OuterRef('pk')),
+        Notification.objects.filter(related_transaction=OuterRef('pk')),
+        UserActivity.objects.filter(related_transaction=OuterRef('pk')),
+    )
+    queryset = Transaction.objects.filter(status__in=FINAL_STATUSES, created_at__lt=cutoff)
+    for references in linked:
+        queryset = queryset.filter(~Exists(references))
+    return queryset
+
+
+def archivable_activity(cutoff):
+    from .models import UserActivity
+
+    return UserActivity.objects.filter(created_at__lt=cutoff)
+
+
+def archive_history(cutoff=None, chunk_size=CHUNK_SIZE, max_chunks=None):
+    """
+    Move history older than `cutoff` to the archive tables.
+
+    Activity goes first so the transactions it references become eligible
+    in the same run. Returns {'activity': moved, 'transactions': moved}.
+    """
+    from .models import TransactionArchive, UserActivityArchive
+
+    cutoff = cutoff or archive_cutoff()
+    moved = {}
+    for name, candidates, archive_model in (
+        ('activity', archivable_activity(cutoff), UserActivityArchive),
+        ('transactions', archivable_transactions(cutoff), TransactionArchive),
+    ):
+        moved[name] = chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            count = _move_chunk(candidates, archive_model, chunk_size)
+            if not count:
+                break
+            moved[name] += count
+            chunks += 1
+    return moved
+
+
+class ArchivedHistory:
+    """
+    Hot and archived rows of one history, merged in `ordering` order.
+
+    Behaves like a queryset to paginators: count() adds up both sides and
+    slicing runs a UNION ALL of (pk, sort keys) for just that page, then
+    loads the page's rows from whichever table holds them. `hot` and
+    `archived` must expose the same field names.
+    """
+
+    ordered = True
+
+    def __init__(self, hot, archived, ordering):
+        self.hot = hot
+        self.archived = archived
+        ordering = [field.replace('pk', 'id') if field.lstrip('-') == 'pk' else field
+                    for field in ordering or ['-created_at']]
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            # Tie-break equal sort keys so pages never overlap
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        self.ordering = ordering
+
+    def count(self):
+        return self.hot.count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def _keys(self, queryset, archived):
+        columns = [field.lstrip('-') for field in self.ordering if field.lstrip('-') != 'id']
+        return queryset.order_by().annotate(in_archive=Value(archived)).values_list('id', 'in_archive', *columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return self[index:index + 1][0]
+        keys = list(
+            self._keys(self.hot, False).union(self._keys(self.archived, True), all=True)
+            .order_by(*self.ordering)[index]
+        )
+        hot = self.hot.in_bulk([pk for pk, in_archive, *_ in keys if not in_archive])
+        archived = self.archived.in_bulk([pk for pk, in_archive, *_ in keys if in_archive])
+        return [(archived if in_archive else hot)[pk] for pk, in_archive, *_ in keys]
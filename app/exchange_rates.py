@@ -0,0 +1,136 @@
+"""
+Exchange rates for wallet valuation
+Rates are quoted as units of a currency per 1 USD and held in a
+process-wide cache that reloads from the configured provider once its TTL
+expires, so conversions never query per call. The default provider reads
+a local fixture file standing in for a live feed; the NGN rate set in
+SystemSettings overrides it when present.
+"""
+
+import json
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+RATE_TTL = getattr(settings, 'EXCHANGE_RATE_TTL', 300)
+FIXTURE_PATH = getattr(
+    settings, 'EXCHANGE_RATE_FIXTURE',
+    Path(__file__).resolve().parent / 'data' / 'exchange_rates.json'
+)
+PROVIDER = getattr(settings, 'EXCHANGE_RATE_PROVIDER', 'app.exchange_rates.FixtureRateProvider')
+
+CURRENCIES = ('USD', 'NGN', 'BTC', 'ETH')
+BALANCE_FIELDS = ('usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance')
+CENT = Decimal('0.01')
+
+
+class FixtureRateProvider:
+    """Rates from a JSON file: {"base": "USD", "rates": {"NGN": "1500", ...}}"""
+
+    def __init__(self, path=FIXTURE_PATH):
+        self.path = Path(path)
+
+    def fetch(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get('base', 'USD') != 'USD':
+            raise ValueError(f'{self.path}: rates must be quoted against USD')
+        rates = {currency: Decimal(str(rate)) for currency, rate in data['rates'].items()}
+        rates['USD'] = Decimal('1')
+
+        from .models import SystemSettings
+        ngn = SystemSettings.objects.values_list('exchange_rate_usd_to_ngn', flat=True).first()
+        if ngn:
+            rates['NGN'] = ngn
+        return rates
+
+
+class RateCache:
+    """Thread-safe process-wide rate table with a time-to-live"""
+
+    def __init__(self, provider=None, ttl=RATE_TTL):
+        self._provider = provider
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rates = None
+        self._loaded_at = 0.0
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            self._provider = import_string(PROVIDER)()
+        return self._provider
+
+    def get_rates(self):
+        rates = self._rates
+        if rates is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return rates
+        with self._lock:
+            if self._rates is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._rates = self.provider.fetch()
+                self._loaded_at = time.monotonic()
+            return self._rates
+
+    def invalidate(self):
+        with self._lock:
+            self._rates = None
+
+
+rates = RateCache()
+
+
+def get_rate(currency):
+    """Units of `currency` per 1 USD"""
+    try:
+        return rates.get_rates()[currency]
+    except KeyError:
+        raise ValueError(f'No exchange rate for {currency}')
+
+
+def to_usd(amount, currency):
+    """Exact USD value of `amount` in `currency`, rounded to cents"""
+    return (Decimal(amount) / get_rate(currency)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def total_usd(balances):
+    """
+    USD value of a {currency: amount} mapping.
+
+    Each currency is converted exactly and only the sum is rounded, so
+    small crypto balances are not lost to per-currency rounding.
+    """
+    table = rates.get_rates()
+    total = sum((Decimal(amount) / table[currency] for currency, amount in balances.items() if amount), Decimal('0'))
+    return total.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def wallet_balances(wallet):
+    """{currency: balance} for a Wallet instance or a values() row"""
+    get = wallet.get if isinstance(wallet, dict) else lambda field: getattr(wallet, field)
+    return {currency: get(field) for currency, field in zip(CURRENCIES, BALANCE_FIELDS)}
+
+
+def wallet_totals_usd(wallets):
+    """USD totals for a batch of wallets (instances or values() rows), in order"""
+    return [total_usd(wallet_balances(wallet)) for wallet in wallets]
+
+
+def wallet_totals_usd_array(balances):
+    """
+    Vectorized USD totals for reports.
+
+    `balances` is an (n, 4) array-like in CURRENCIES column order; returns a
+    float64 array. Floats are fine for aggregate reporting, use
+    wallet_totals_usd() wherever the figure is shown to a user.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError('NumPy is required for vectorized conversion (pip install numpy)')
+    table = rates.get_rates()
+    per_usd = np.array([float(table[currency]) for currency in CURRENCIES])
+    return np.asarray(balances, dtype=np.float64) @ (1.0 / per_usd)
@@ -0,0 +1,198 @@
+"""
+Marketplace facet counts
+Live products (approved, in stock) are counted per (category, condition,
+price bucket, featured) cell in ProductFacetCount, kept current by the
+product signals. Facet queries sum a few hundred cells in Python instead of
+aggregating the product table; filters the cells cannot express (search,
+tags, prices off the bucket edges) fall back to live aggregation.
+"""
+
+import bisect
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, When
+
+FACET_STATE_FIELDS = ('category', 'condition', 'price', 'featured', 'status', 'in_stock', 'stock_count')
+
+# Display ranges are [edge, next edge); the last one is open ended
+PRICE_EDGES = (Decimal('0'), Decimal('10'), Decimal('25'), Decimal('50'), Decimal('100'),
+               Decimal('250'), Decimal('500'), Decimal('1000'))
+
+# Stored buckets alternate between "exactly on an edge" (even) and "strictly
+# between two edges" (odd) so both price__gte and price__lte filters on an
+# edge map onto whole buckets
+PRICE_BUCKET_COUNT = len(PRICE_EDGES) * 2
+
+
+def price_bucket(price):
+    price = Decimal(price)
+    index = max(bisect.bisect_right(PRICE_EDGES, price) - 1, 0)
+    return index * 2 if price == PRICE_EDGES[index] else index * 2 + 1
+
+
+def price_range_label(index):
+    low = PRICE_EDGES[index]
+    if index + 1 < len(PRICE_EDGES):
+        return f'{low}-{PRICE_EDGES[index + 1]}'
+    return f'{low}+'
+
+
+def product_state(product):
+    return {field: getattr(product, field) for field in FACET_STATE_FIELDS}
+
+
+def facet_cell(state):
+    """The cell a product in `state` is counted in, or None when it is not listed"""
+    if not state or state['status'] != 'approved' or not state['in_stock'] or not state['stock_count'] > 0:
+        return None
+    return (state['category'], state['condition'], price_bucket(state['price']), bool(state['featured']))
+
+
+def _apply(cell, delta):
+    from .models import ProductFacetCount
+
+    category, condition, bucket, featured = cell
+    lookup = dict(category=category, condition=condition, price_bucket=bucket, featured=featured)
+    if ProductFacetCount.objects.filter(**lookup).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            ProductFacetCount.objects.create(count=delta, **lookup)
+    except IntegrityError:
+        # Another writer created the cell first
+        ProductFacetCount.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def apply_facet_change(previous, current):
+    """Move one product from cell `previous` to cell `current` (either may be None)"""
+    if previous == current:
+        return
+    if previous is not None:
+        _apply(previous, -1)
+    if current is not None:
+        _apply(current, 1)
+
+
+def rebuild_facet_counts():
+    """Recount every cell from the product table; returns the number of cells"""
+    from .models import Product, ProductFacetCount
+
+    counts = {}
+    rows = Product.objects.filter(
+        status='approved', in_stock=True, stock_count__gt=0
+    ).order_by().values('category', 'condition', 'featured', 'price').annotate(count=Count('pk'))
+    for row in rows.iterator(chunk_size=5000):
+        cell = (row['category'], row['condition'], price_bucket(row['price']), row['featured'])
+        counts[cell] = counts.get(cell, 0) + row['count']
+
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create([
+            ProductFacetCount(category=category, condition=condition, price_bucket=bucket,
+                              featured=featured, count=count)
+            for (category, condition, bucket, featured), count in counts.items()
+        ], batch_size=500)
+    return len(counts)
+
+
+def _edge_index(value):
+    """Index of `value` in PRICE_EDGES; None when absent, False when off an edge"""
+    if value in (None, ''):
+        return None
+    try:
+        value = Decimal(value)
+    except InvalidOperation:
+        return False
+    try:
+        return PRICE_EDGES.index(value)
+    except ValueError:
+        return False
+
+
+def can_use_counts(params):
+    """Whether the facet table can answer a marketplace query with these params"""
+    if params.get('search') or params.get('tags'):
+        return False
+    return _edge_index(params.get('min_price')) is not False and _edge_index(params.get('max_price')) is not False
+
+
+def _empty_facets():
+    from .models import Product
+
+    return {
+        'category': {value: 0 for value, _ in Product.CATEGORY_CHOICES},
+        'condition': {value: 0 for value, _ in Product.CONDITION_CHOICES},
+        'price': {price_range_label(index): 0 for index in range(len(PRICE_EDGES))},
+    }
+
+
+def facets_from_counts(params):
+    """
+    Disjunctive facet counts summed from ProductFacetCount.
+
+    Each facet ignores its own filter, so the counts answer "how many would
+    I get if I picked this value instead".
+    """
+    from .models import ProductFacetCount
+
+    category = params.get('category')
+    condition = params.get('condition')
+    featured_only = params.get('featured') == 'true'
+    low = _edge_index(params.get('min_price'))
+    high = _edge_index(params.get('max_price'))
+    low_bucket = 0 if low is None else low * 2
+    high_bucket = PRICE_BUCKET_COUNT - 1 if high is None else high * 2
+
+    facets = _empty_facets()
+    total = 0
+    cells = ProductFacetCount.objects.filter(count__gt=0).values_list(
+        'category', 'condition', 'price_bucket', 'featured', 'count'
+    )
+    for cell_category, cell_condition, bucket, featured, count in cells:
+        if featured_only and not featured:
+            continue
+        category_ok = not category or cell_category == category
+        condition_ok = not condition or cell_condition == condition
+        price_ok = low_bucket <= bucket <= high_bucket
+        if condition_ok and price_ok:
+            facets['category'][cell_category] = facets['category'].get(cell_category, 0) + count
+        if category_ok and price_ok:
+            facets['condition'][cell_condition] = facets['condition'].get(cell_condition, 0) + count
+        if category_ok and condition_ok:
+            facets['price'][price_range_label(bucket // 2)] += count
+            if price_ok:
+                total += count
+    return {'facets': facets, 'total': total}
+
+
+def facets_from_queryset(filtered):
+    """
+    Disjunctive facet counts aggregated live.
+
+    `filtered(skip)` must return the marketplace queryset with every filter
+    applied except those named in `skip`.
+    """
+    price_range = Case(
+        *[When(price__lt=edge, then=index - 1) for index, edge in enumerate(PRICE_EDGES) if index],
+        default=len(PRICE_EDGES) - 1,
+        output_field=IntegerField(),
+    )
+    facets = _empty_facets()
+    for name in ('category', 'condition'):
+        rows = filtered(skip=(name,)).order_by().values(name).annotate(count=Count('pk'))
+        for row in rows:
+            facets[name][row[name]] = row['count']
+    rows = filtered(skip=('price',)).order_by().annotate(price_range=price_range).values(
+        'price_range'
+    ).annotate(count=Count('pk'))
+    for row in rows:
+        facets['price'][price_range_label(row['price_range'])] = row['count']
+    return {'facets': facets, 'total': filtered(skip=()).order_by().count()}
+
+
+def marketplace_facets(params, filtered):
+    """Facet counts for marketplace `params`, from the table when it can answer"""
+    if can_use_counts(params):
+        return facets_from_counts(params)
+    return facets_from_queryset(filtered)
@@ -0,0 +1,176 @@
+"""
+Idempotency-Key support for write endpoints
+The first request carrying a key claims it by inserting an IdempotencyKey
+row, runs, and stores its response on that row. Retries with the same key
+replay the stored response; a retry that arrives while the first request
+is still running waits for its result rather than executing again. A
+claim is held under a short lease; if the request that claimed a key dies
+without finishing, a retry takes the key over once the lease lapses.
+"""
+
+import functools
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+KEY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', timedelta(hours=24))
+WAIT_TIMEOUT = getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 10)
+LEASE_DURATION = getattr(settings, 'IDEMPOTENCY_LEASE_DURATION', timedelta(seconds=60))
+WAIT_INTERVAL = 0.1
+MAX_KEY_LENGTH = 255
+
+# Response headers worth replaying
+REPLAYED_HEADERS = ('Location',)
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode('utf-8'))
+    digest.update(request.path.encode('utf-8'))
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    for name, value in record.response_headers.items():
+        response[name] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _lease_lapsed(now):
+    return Q(status='processing') & (Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True))
+
+
+def _claim(user, key, fingerprint):
+    """
+    Insert the key, or take over a processing one whose lease has lapsed;
+    returns (record, claimed)
+    """
+    from .models import IdempotencyKey
+
+    now = timezone.now()
+    # A key whose record has expired is free to be used again
+    IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint,
+                lease_expires_at=now + LEASE_DURATION, expires_at=now + KEY_TTL,
+            ), True
+    except IntegrityError:
+        pass
+    # The request holding the key died; only one retry wins the takeover
+    taken = IdempotencyKey.objects.filter(
+        _lease_lapsed(now), user=user, key=key, fingerprint=fingerprint
+    ).update(lease_expires_at=now + LEASE_DURATION)
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    return record, bool(taken) and record is not None
+
+
+def _wait_for(record):
+    """
+    Poll until the first request finishes; returns the finished record, or
+    None when the key was released or its lease lapsed and may be claimed
+    """
+    from .models import IdempotencyKey
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        current = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if current is None:
+            # The first request failed and released the key
+            return None
+        if current.status == 'completed':
+            return current
+        if current.lease_expires_at is None or current.lease_expires_at < timezone.now():
+            return None
+        if time.monotonic() >= deadline:
+            return current
+        time.sleep(WAIT_INTERVAL)
+
+
+def idempotent(handler):
+    """
+    Honor the Idempotency-Key header on a DRF view method.
+
+    Responses below 500 are stored and replayed for the key's lifetime;
+    server errors and exceptions release the key so the client can retry.
+    """
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        for _ in range(2):
+            record, created = _claim(request.user, key, fingerprint)
+            if created:
+                break
+            if record is None:
+                continue
+            if record.fingerprint != fingerprint:
+                return Response({'error': 'Idempotency-Key was already used for a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.status == 'processing':
+                record = _wait_for(record)
+                if record is None:
+                    continue
+                if record.status == 'processing':
+                    return Response({'error': 'A request with this Idempotency-Key is still in progress'},
+                                    status=status.HTTP_409_CONFLICT)
+            return _replay(record)
+        else:
+            return Response({'error': 'A request with this Idempotency-Key is still in progress'},
+                            status=status.HTTP_409_CONFLICT)
+
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+            return response
+
+        record.status = 'completed'
+        record.response_status = response.status_code
+        record.response_body = response.data
+        record.response_headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+        record.save(update_fields=['status', 'response_status', 'response_body', 'response_headers'])
+        return response
+    return wrapper
+
+
+class IdempotentCreateMixin:
+    """ViewSet mixin that makes create() honor Idempotency-Key"""
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+
+def purge_expired_keys(chunk_size=1000):
+    """Delete expired keys in chunks; returns the number removed"""
+    from .models import IdempotencyKey
+
+    removed = 0
+    now = timezone.now()
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return removed
+        removed += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
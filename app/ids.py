@@ -0,0 +1,93 @@
+"""
+Time-ordered identifiers
+uuid7() returns UUIDv7 values: a 48-bit millisecond timestamp followed by
+a per-process counter and random bits, so new primary keys are appended
+at the right edge of the index instead of landing on a random page.
+Transaction references are the same 128 bits written in Crockford base32,
+the ULID text form, which sorts by creation time and is safe to read out.
+"""
+
+import secrets
+import threading
+import time
+import uuid
+
+# Crockford's alphabet has no I, L, O or U
+CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+REFERENCE_PREFIX = 'TX-'
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def _next_timestamp_and_counter():
+    """
+    (milliseconds, 12-bit counter), strictly increasing within the process.
+
+    The counter starts at a random point in the lower half each
+    millisecond; if it runs out, or the clock steps back, the timestamp is
+    advanced past the last one issued rather than reused.
+    """
+    global _last_ms, _counter
+    with _lock:
+        now = time.time_ns() // 1_000_000
+        if now > _last_ms:
+            _last_ms, _counter = now, secrets.randbits(11)
+        elif _counter < 0xFFF:
+            _counter += 1
+        else:
+            _last_ms, _counter = _last_ms + 1, secrets.randbits(11)
+        return _last_ms, _counter
+
+
+def uuid7_from_parts(timestamp_ms, counter, random_bits):
+    """Assemble a UUIDv7 from its 48-bit timestamp, 12-bit counter and 62 random bits"""
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80
+    value |= 0x7 << 76
+    value |= (counter & 0xFFF) << 64
+    value |= 0b10 << 62
+    value |= random_bits & 0x3FFFFFFFFFFFFFFF
+    return uuid.UUID(int=value)
+
+
+def uuid7():
+    """A new time-ordered UUID; usable as a model field default"""
+    timestamp_ms, counter = _next_timestamp_and_counter()
+    return uuid7_from_parts(timestamp_ms, counter, secrets.randbits(62))
+
+
+def uuid7_timestamp_ms(value):
+    """Milliseconds since the epoch encoded in a UUIDv7"""
+    return value.int >> 80
+
+
+def encode_base32(value):
+    """128-bit UUID as 26 Crockford base32 characters"""
+    number = value.int
+    chars = []
+    for _ in range(26):
+        number, digit = divmod(number, 32)
+        chars.append(CROCKFORD[digit])
+    return ''.join(reversed(chars))
+
+
+def decode_base32(text):
+    """Inverse of encode_base32; accepts lower case and the I/L/O look-alikes"""
+    text = text.upper().replace('I', '1').replace('L', '1').replace('O', '0')
+    if len(text) != 26:
+        raise ValueError('Expected 26 base32 characters')
+    number = 0
+    for char in text:
+        digit = CROCKFORD.find(char)
+        if digit < 0:
+            raise ValueError(f'Invalid base32 character: {char}')
+        number = number * 32 + digit
+    if number >> 128:
+        raise ValueError('Value does not fit in 128 bits')
+    return uuid.UUID(int=number)
+
+
+def new_transaction_reference():
+    """Default for Transaction.reference, e.g. TX-01J9ZC3M8V2N6Q4R7T1W5XYZAB"""
+    return REFERENCE_PREFIX + encode_base32(uuid7())
@@ -0,0 +1,323 @@
+"""
+Double-entry ledger behind wallet balances
+Every completed Transaction is posted as balanced LedgerEntry legs, and each
+touched LedgerAccount balance plus the matching Wallet column is moved with a
+guarded F() update in the same atomic block. Accounts are locked in primary
+key order so concurrent postings serialize per account without deadlocking,
+and a debit that would overdraw a wallet matches no row and rolls back.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Wallet column caching each currency's balance for O(1) reads
+BALANCE_FIELDS = {
+    'USD': 'usd_balance',
+    'NGN': 'ngn_balance',
+    'BTC': 'btc_balance',
+    'ETH': 'eth_balance',
+}
+
+WALLET = 'wallet'
+# Counterpart of manual balance corrections made by staff
+ADJUSTMENTS = 'adjustments'
+
+
+class LedgerError(Exception):
+    """A posting could not be applied"""
+
+
+class InsufficientFunds(LedgerError):
+    """A wallet debit would take the balance below zero"""
+
+
+class WalletFrozen(LedgerError):
+    """A debit was attempted against a frozen (or missing) wallet"""
+
+
+class WithdrawalLimitExceeded(LedgerError):
+    """A withdrawal would take the user over a daily or monthly limit"""
+
+
+def account_key(kind, currency, user_id=None):
+    if kind == WALLET:
+        return f'wallet:{user_id}:{currency}'
+    return f'system:{kind}:{currency}'
+
+
+def transaction_legs(txn):
+    """
+    Return [(kind, user_id, amount)] for a transaction, summing to zero.
+
+    Wallet legs carry the user; system legs (external funds, sales, fees,
+    referral pool) have user_id None.
+    """
+    amount = Decimal(txn.amount)
+    fee = Decimal(txn.fee_amount or 0)
+    user_id = txn.user_id
+    kind = txn.transaction_type
+
+    if kind == 'deposit':
+        legs = [(WALLET, user_id, amount), ('external', None, -amount)]
+    elif kind == 'withdrawal':
+        legs = [(WALLET, user_id, -(amount + fee)), ('external', None, amount)]
+    elif kind == 'transfer':
+        if not txn.recipient_id or txn.recipient_id == user_id:
+            raise LedgerError('Transfers need a recipient other than the sender')
+        legs = [(WALLET, user_id, -(amount + fee)), (WALLET, txn.recipient_id, amount)]
+    elif kind == 'purchase':
+        legs = [(WALLET, user_id, -(amount + fee)), ('sales', None, amount)]
+    elif kind == 'refund':
+        legs = [(WALLET, user_id, amount), ('sales', None, -amount)]
+    elif kind == 'referral_bonus':
+        legs = [(WALLET, user_id, amount), ('referrals', None, -amount)]
+    elif kind == 'fee':
+        legs = [(WALLET, user_id, -amount), ('fees', None, amount)]
+    else:
+        raise LedgerError(f'Unknown transaction type {kind!r}')
+
+    if fee and kind in ('withdrawal', 'transfer', 'purchase'):
+        legs.append(('fees', None, fee))
+    if amount <= 0:
+        raise LedgerError('Transaction amount must be positive')
+    return legs
+
+
+def get_accounts(specs):
+    """
+    Map account key -> LedgerAccount for `specs` of (kind, currency, user_id),
+    creating missing accounts.
+    """
+    from .models import LedgerAccount
+
+    wanted = {account_key(kind, currency, user_id): (kind, currency, user_id) for kind, currency, user_id in specs}
+    accounts = {account.key: account for account in LedgerAccount.objects.filter(key__in=wanted)}
+    missing = [key for key in wanted if key not in accounts]
+    if missing:
+        LedgerAccount.objects.bulk_create([
+            LedgerAccount(key=key, kind=wanted[key][0], currency=wanted[key][1], user_id=wanted[key][2])
+            for key in missing
+        ], ignore_conflicts=True)
+        accounts.update((account.key, account) for account in LedgerAccount.objects.filter(key__in=missing))
+    return accounts
+
+
+def post_transactions(transactions, reverse=False):
+    """
+    Post the legs of already-saved `transactions` in one atomic unit.
+
+    Deltas are netted per account first, so a batch costs one UPDATE per
+    account touched plus one bulk insert of entries. Raises
+    InsufficientFunds or WalletFrozen when a wallet cannot cover its debits
+    and WithdrawalLimitExceeded when a withdrawal breaches the wallet's
+    limits, rolling everything back. With `reverse` the legs are negated to
+    undo an earlier posting. Returns the created entries.
+    """
+    from .models import LedgerEntry
+    from .referrals import enqueue_evaluations
+    from .wallet_summary import schedule_refresh
+    from .withdrawal_limits import check_batch, record_withdrawals
+
+    postings = []
+    for txn in transactions:
+        legs = transaction_legs(txn)
+        if reverse:
+            legs = [(kind, user_id, -amount) for kind, user_id, amount in legs]
+        if sum(amount for _, _, amount in legs) != 0:
+            raise LedgerError(f'Unbalanced posting for transaction {txn.pk}')
+        postings.append((txn, legs))
+    if not postings:
+        return []
+
+    with transaction.atomic():
+        accounts = get_accounts({
+            (kind, txn.currency, user_id)
+            for txn, legs in postings
+            for kind, user_id, _ in legs
+        })
+
+        deltas = defaultdict(Decimal)
+        entries = []
+        for txn, legs in postings:
+            # A transfer with a fee debits the same wallet once per leg kind;
+            # fold legs so each account appears once per transaction
+            per_account = defaultdict(Decimal)
+            for kind, user_id, amount in legs:
+                per_account[account_key(kind, txn.currency, user_id)] += amount
+            for key, amount in per_account.items():
+                deltas[key] += amount
+                entries.append(LedgerEntry(transaction=txn, account=accounts[key], amount=amount, reversal=reverse))
+
+        ordered = _lock_accounts(accounts[key] for key in deltas)
+
+        # Checked under the account locks so concurrent withdrawals cannot
+        # both fit under the same remaining limit
+        if not reverse:
+            check_batch([txn for txn, _ in postings])
+
+        _move_balances(ordered, deltas)
+
+        record_withdrawals([txn for txn, _ in postings], sign=-1 if reverse else 1)
+        if not reverse:
+            # Queued in this transaction, so a deposit is evaluated exactly
+            # when it commits
+            enqueue_evaluations([txn for txn, _ in postings])
+
+        # Wallet columns move with update(), which sends no post_save
+        for user_id in {account.user_id for account in ordered if account.kind == WALLET}:
+            schedule_refresh(user_id)
+        return LedgerEntry.objects.bulk_create(entries)
+
+
+def _lock_accounts(accounts):
+    """Lock `accounts` in primary key order; returns them in that order"""
+    from .models import LedgerAccount
+
+    ordered = sorted(accounts, key=lambda account: account.pk)
+    list(LedgerAccount.objects.select_for_update().filter(
+        pk__in=[account.pk for account in ordered]
+    ).order_by('pk').values_list('pk', flat=True))
+    return ordered
+
+
+def _move_balances(ordered, deltas):
+    """
+    Apply `deltas` (account key -> amount) to the locked `ordered` accounts
+    and their Wallet columns, raising when a wallet cannot cover a debit.
+    """
+    from .models import LedgerAccount, Wallet
+
+    now = timezone.now()
+    for account in ordered:
+        delta = deltas[account.key]
+        if not delta:
+            continue
+        rows = LedgerAccount.objects.filter(pk=account.pk)
+        if account.kind == WALLET and delta < 0:
+            rows = rows.filter(balance__gte=-delta)
+        if not rows.update(balance=F('balance') + delta, updated_at=now):
+            raise InsufficientFunds(f'{account.key} cannot cover {-delta}')
+
+        if account.kind == WALLET:
+            field = BALANCE_FIELDS[account.currency]
+            wallets = Wallet.objects.filter(user_id=account.user_id)
+            if delta < 0:
+                wallets = wallets.filter(is_frozen=False)
+            if not wallets.update(**{field: F(field) + delta, 'updated_at': now}):
+                raise WalletFrozen(f'Wallet of user {account.user_id} is frozen or missing')
+
+
+def post_transaction(txn):
+    return post_transactions([txn])
+
+
+def complete_transaction(txn):
+    """
+    Mark a pending or processing transaction completed and post it.
+
+    The status flip is a conditional UPDATE in the same atomic block as
+    the posting, so a transaction can only ever be posted once.
+    """
+    from .models import Transaction
+
+    with transaction.atomic():
+        now = timezone.now()
+        claimed = Transaction.objects.filter(
+            pk=txn.pk, status__in=['pending', 'processing']
+        ).update(status='completed', completed_at=now, updated_at=now)
+        if not claimed:
+            raise LedgerError(f'Transaction {txn.pk} is not pending')
+        txn.status = 'completed'
+        txn.completed_at = now
+        txn.updated_at = now
+        post_transactions([txn])
+    return txn
+
+
+def cancel_transaction(txn):
+    """
+    Cancel a transaction, reversing its posting if it had completed.
+
+    Like completion, the status flip is a conditional UPDATE, so only one
+    caller can cancel (and reverse) a given transaction.
+    """
+    from .models import Transaction
+    from .wallet_summary import schedule_refresh
+
+    with transaction.atomic():
+        now = timezone.now()
+        previous = Transaction.objects.filter(pk=txn.pk).values_list('status', flat=True).first()
+        if previous not in ('pending', 'processing', 'completed'):
+            raise LedgerError(f'Transaction {txn.pk} cannot be cancelled')
+        claimed = Transaction.objects.filter(pk=txn.pk, status=previous).update(status='cancelled', updated_at=now)
+        if not claimed:
+            raise LedgerError(f'Transaction {txn.pk} changed while cancelling')
+        if previous == 'completed':
+            post_transactions([txn], reverse=True)
+        else:
+            schedule_refresh(txn.user_id)
+    txn.status = 'cancelled'
+    txn.updated_at = now
+    return txn
+
+
+def record_transaction(user, transaction_type, amount, currency, description='', **fields):
+    """Create a completed transaction and post it in one atomic unit"""
+    from .models import Transaction
+
+    with transaction.atomic():
+        txn = Transaction.objects.create(
+            user=user,
+            transaction_type=transaction_type,
+            amount=amount,
+            currency=currency,
+            description=description or transaction_type.replace('_', ' ').title(),
+            status='completed',
+            completed_at=timezone.now(),
+            **fields
+        )
+        post_transactions([txn])
+    return txn
+
+
+def post_adjustment(user, currency, amount, memo):
+    """
+    Correct `user`'s `currency` balance by `amount` (negative to debit).
+
+    The correction is a balanced pair of entries against the system
+    adjustments account, with no Transaction behind it, so the wallet
+    column, its ledger account and the entries stay in step. A debit may
+    not take the wallet below zero. Returns the created entries.
+    """
+    from .models import LedgerEntry
+    from .wallet_summary import schedule_refresh
+
+    amount = Decimal(amount)
+    if not amount:
+        raise LedgerError('An adjustment needs a non-zero amount')
+    if currency not in BALANCE_FIELDS:
+        raise LedgerError(f'Unknown currency {currency!r}')
+    memo = memo[:LedgerEntry._meta.get_field('memo').max_length]
+
+    with transaction.atomic():
+        accounts = get_accounts({(WALLET, currency, user.pk), (ADJUSTMENTS, currency, None)})
+        wallet_key = account_key(WALLET, currency, user.pk)
+        system_key = account_key(ADJUSTMENTS, currency)
+        deltas = {wallet_key: amount, system_key: -amount}
+        _move_balances(_lock_accounts(accounts.values()), deltas)
+        schedule_refresh(user.pk)
+        return LedgerEntry.objects.bulk_create([
+            LedgerEntry(account=accounts[key], amount=delta, memo=memo) for key, delta in deltas.items()
+        ])
+
+
+def wallet_balance(user, currency):
+    """Cached balance of `user`'s wallet in `currency`"""
+    from .models import Wallet
+
+    field = BALANCE_FIELDS[currency]
+    return Wallet.objects.filter(user=user).values_list(field, flat=True).first() or Decimal('0')
@@ -0,0 +1,37 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app.archive import ARCHIVE_AFTER, CHUNK_SIZE, archive_history
+
+class Command(BaseCommand):
+    help = 'Move transactions and activity older than the archive horizon into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=ARCHIVE_AFTER.days,
+            help='Archive rows created more than this many days ago',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Number of rows to move per transaction',
+        )
+        parser.add_argument(
+            '--max-chunks',
+            type=int,
+            default=None,
+            help='Stop after this many chunks per table (default: until done)',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        moved = archive_history(cutoff, chunk_size=options['chunk_size'], max_chunks=options['max_chunks'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved["transactions"]} transactions and {moved["activity"]} activity rows '
+            f'created before {cutoff:%Y-%m-%d %H:%M}'
+        ))
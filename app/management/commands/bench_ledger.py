@@ -0,0 +1,139 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from app.ledger import BALANCE_FIELDS, InsufficientFunds, record_transaction
+from app.models import LedgerAccount, LedgerEntry, Wallet
+from decimal import Decimal
+import random
+import threading
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure ledger transfers per second with concurrent workers moving funds between a few hot wallets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--wallets',
+            type=int,
+            default=10,
+            help='Number of wallets the transfers are spread over (fewer means more contention)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of concurrent worker threads',
+        )
+        parser.add_argument(
+            '--transfers',
+            type=int,
+            default=250,
+            help='Transfers attempted by each worker',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the benchmark users and their ledger rows afterwards',
+        )
+
+    def handle(self, *args, **options):
+        if options['wallets'] < 2:
+            raise CommandError('At least two wallets are needed')
+
+        users = self.seed(options['wallets'])
+        stats = {'done': 0, 'rejected': 0, 'retries': 0}
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            done = rejected = retries = 0
+            try:
+                for _ in range(options['transfers']):
+                    sender, recipient = rng.sample(users, 2)
+                    amount = Decimal(rng.randint(1, 500)) / 100
+                    while True:
+                        try:
+                            record_transaction(sender, 'transfer', amount, 'USD', recipient=recipient)
+                            done += 1
+                        except InsufficientFunds:
+                            rejected += 1
+                        except OperationalError:
+                            # SQLite reports write contention as "database is locked"
+                            retries += 1
+                            time.sleep(0.001 * rng.randint(1, 5))
+                            continue
+                        break
+            finally:
+                connections.close_all()
+            with lock:
+                stats['done'] += done
+                stats['rejected'] += rejected
+                stats['retries'] += retries
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['workers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        problems = self.verify(users)
+
+        self.stdout.write(f'Backend: {connection.vendor}, workers: {options["workers"]}, wallets: {len(users)}')
+        self.stdout.write(f'Transfers posted:   {stats["done"]}')
+        self.stdout.write(f'Rejected (funds):   {stats["rejected"]}')
+        self.stdout.write(f'Lock retries:       {stats["retries"]}')
+        self.stdout.write(f'Elapsed:            {elapsed:.2f}s')
+        self.stdout.write(self.style.SUCCESS(f'Throughput: {stats["done"] / elapsed:.0f} transfers/s'))
+
+        if not options['keep']:
+            self.cleanup(users)
+        if problems:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(problem))
+            raise CommandError('Ledger invariants do not hold after the run')
+        self.stdout.write(self.style.SUCCESS('Ledger invariants hold'))
+
+    def seed(self, count):
+        self.cleanup(list(User.objects.filter(username__startswith='bench-ledger-')))
+        users = []
+        for n in range(count):
+            user = User.objects.create(username=f'bench-ledger-{n}')
+            Wallet.objects.get_or_create(user=user)
+            record_transaction(user, 'deposit', Decimal('100.00'), 'USD')
+            users.append(user)
+        return users
+
+    def verify(self, users):
+        problems = []
+        accounts = LedgerAccount.objects.filter(user__in=users, currency='USD')
+        # Summed in Python: SQLite aggregates decimals as floats
+        total = sum(LedgerAccount.objects.filter(currency='USD').values_list('balance', flat=True))
+        if total != 0:
+            problems.append(f'USD accounts sum to {total}, expected 0')
+        for account in accounts:
+            entries = sum(account.entries.values_list('amount', flat=True))
+            wallet = Wallet.objects.filter(user_id=account.user_id).values_list(BALANCE_FIELDS['USD'], flat=True).get()
+            if account.balance != entries or wallet != account.balance:
+                problems.append(f'{account.key}: balance {account.balance}, entries {entries}, wallet {wallet}')
+            if account.balance < 0:
+                problems.append(f'{account.key} is overdrawn')
+        return problems
+
+    def cleanup(self, users):
+        if not users:
+            return
+        with transaction.atomic():
+            entries = LedgerEntry.objects.filter(transaction__user__in=users)
+            # Take the benchmark's postings back out of the shared system accounts
+            totals = {}
+            for account_id, amount in entries.filter(account__user__isnull=True).values_list('account', 'amount'):
+                totals[account_id] = totals.get(account_id, 0) + amount
+            for account_id, total in totals.items():
+                LedgerAccount.objects.filter(pk=account_id).update(balance=F('balance') - total)
+            entries.delete()
+            LedgerEntry.objects.filter(account__user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
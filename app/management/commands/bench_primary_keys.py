@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from app.ids import uuid7
+import time
+import uuid
+
+GENERATORS = {
+    'uuid4': uuid.uuid4,
+    'uuid7': uuid7,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare insert throughput and primary-key index size for random (uuid4) and time-ordered (uuid7) keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=200000,
+            help='Rows inserted per key type',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per INSERT batch (one transaction each)',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the scratch tables afterwards',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError('Index sizes are measured with SQLite dbstat or PostgreSQL pg_relation_size')
+        if options['rows'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--rows and --batch-size must be positive')
+
+        results = {}
+        for name, generate in GENERATORS.items():
+            table = f'bench_pk_{name}'
+            self.create_table(table)
+            try:
+                elapsed = self.insert(table, generate, options['rows'], options['batch_size'])
+                results[name] = (elapsed, self.index_size(table))
+            finally:
+                if not options['keep']:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+
+        baseline_elapsed, baseline_size = results['uuid4']
+        for name, (elapsed, size) in results.items():
+            self.stdout.write(
+                f'{name}: {options["rows"] / elapsed:,.0f} rows/s, '
+                f'primary key index {size / 1024 / 1024:.2f} MiB'
+            )
+        elapsed, size = results['uuid7']
+        self.stdout.write(self.style.SUCCESS(
+            f'uuid7 vs uuid4: {baseline_elapsed / elapsed:.2f}x insert throughput, '
+            f'{size / baseline_size:.0%} of the index size'
+        ))
+
+    def create_table(self, table):
+        # Shaped like the Transaction table's hot columns: a 32-character
+        # UUID key in a rowid table, as Django creates it on SQLite
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+            cursor.execute(
+                f'CREATE TABLE {table} (id char(32) NOT NULL PRIMARY KEY, user_id integer NOT NULL, '
+                f'amount decimal NOT NULL, created_at varchar(32) NOT NULL)'
+            )
+
+    def insert(self, table, generate, rows, batch_size):
+        sql = f'INSERT INTO {table} (id, user_id, amount, created_at) VALUES (%s, %s, %s, %s)'
+        started = time.perf_counter()
+        for offset in range(0, rows, batch_size):
+            count = min(batch_size, rows - offset)
+            batch = [(generate().hex, (offset + i) % 1000, '10.00', '2024-01-01') for i in range(count)]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+        return time.perf_counter() - started
+
+    def index_size(self, table):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [f'sqlite_autoindex_{table}_1'])
+            else:
+                cursor.execute('SELECT pg_relation_size(%s)', [f'{table}_pkey'])
+            return cursor.fetchone()[0] or 0
@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import transaction
+from app.models import MerchantApplication, Product, ProductImage
+from app.serializers import ProductSerializer, ProductCardSerializer, product_card_queryset
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare per-row cost of the full product serializer and product cards (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=2000,
+            help='Number of products to serialize',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Runs per variant; the best run is reported',
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+
+        with transaction.atomic():
+            self.seed(rows)
+            base = Product.objects.filter(title__startswith='bench-card-')
+
+            def full():
+                queryset = base.select_related(
+                    'seller', 'merchant_application', 'merchant_application__user',
+                    'merchant_application__reviewed_by', 'reviewed_by'
+                ).prefetch_related('images')
+                return ProductSerializer(queryset, many=True).data
+
+            def cards():
+                return ProductCardSerializer(product_card_queryset(base), many=True).data
+
+            full_time = self.best_of(full, repeat)
+            card_time = self.best_of(cards, repeat)
+
+            transaction.set_rollback(True)
+
+        full_us = full_time / rows * 1e6
+        card_us = card_time / rows * 1e6
+        self.stdout.write(f'Rows: {rows}')
+        self.stdout.write(f'ProductSerializer:     {full_us:8.1f} us/row')
+        self.stdout.write(f'ProductCardSerializer: {card_us:8.1f} us/row')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {full_us / card_us:.1f}x'))
+
+    def seed(self, rows):
+        user = User.objects.create(username='bench-card-seller', first_name='Bench', last_name='Seller')
+        application = MerchantApplication.objects.create(
+            user=user, status='approved', payment_status='completed', business_name='Bench Goods'
+        )
+        products = Product.objects.bulk_create([
+            Product(
+                title=f'bench-card-{i}',
+                description='Benchmark product description ' * 8,
+                price=10 + i % 90,
+                category='other',
+                tags=['bench', 'card'],
+                specifications={'size': 'M'},
+                seller=user,
+                merchant_application=application,
+                status='approved',
+            )
+            for i in range(rows)
+        ])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'product_images/bench-{n}.jpg', order=n)
+            for product in products
+            for n in range(3)
+        ])
+
+    def best_of(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from app.referral_codes import DOMAIN, code_for_user_id
+import secrets
+import string
+import time
+
+TABLE = 'bench_referral_codes'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark derived referral codes against the random-code-plus-exists() loop they replace'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000000,
+            help='Number of user ids to derive codes for (checked for collisions in memory)',
+        )
+        parser.add_argument(
+            '--db-rows',
+            type=int,
+            default=20000,
+            help='Codes inserted into a scratch table by each strategy',
+        )
+        parser.add_argument(
+            '--prefill',
+            type=int,
+            default=0,
+            help='Rows already in the scratch table before timing, to model a filling code space',
+        )
+
+    def handle(self, *args, **options):
+        users = options['users']
+        if not 0 < users <= DOMAIN:
+            raise CommandError(f'--users must be between 1 and {DOMAIN}')
+
+        started = time.perf_counter()
+        codes = {code_for_user_id(user_id) for user_id in range(1, users + 1)}
+        elapsed = time.perf_counter() - started
+        if len(codes) != users:
+            raise CommandError(f'{users - len(codes)} collisions among {users} derived codes')
+        self.stdout.write(
+            f'derived {users:,} codes in {elapsed:.2f}s ({users / elapsed:,.0f}/s), no collisions'
+        )
+
+        rows = options['db_rows']
+        for name, strategy in (('random + exists()', self.insert_random), ('derived', self.insert_derived)):
+            self.create_table(options['prefill'])
+            try:
+                started = time.perf_counter()
+                queries = strategy(rows, offset=users + options['prefill'])
+                elapsed = time.perf_counter() - started
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+            self.stdout.write(
+                f'{name}: {rows / elapsed:,.0f} inserts/s, {queries / rows:.2f} queries per code'
+            )
+
+    def create_table(self, prefill):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+            cursor.execute(f'CREATE TABLE {TABLE} (user_id integer NOT NULL PRIMARY KEY, code varchar(20) NOT NULL UNIQUE)')
+            for start in range(0, prefill, 10000):
+                cursor.executemany(
+                    f'INSERT INTO {TABLE} (user_id, code) VALUES (%s, %s)',
+                    [(user_id, code_for_user_id(user_id)) for user_id in range(start + 1, min(start + 10000, prefill) + 1)],
+                )
+
+    def insert_random(self, rows, offset):
+        """The old loop: draw a code, check it is free, insert"""
+        alphabet = string.ascii_uppercase + string.digits
+        queries = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            for user_id in range(offset + 1, offset + rows + 1):
+                while True:
+                    code = ''.join(secrets.choice(alphabet) for _ in range(8))
+                    cursor.execute(f'SELECT 1 FROM {TABLE} WHERE code = %s LIMIT 1', [code])
+                    queries += 1
+                    if cursor.fetchone() is None:
+                        break
+                cursor.execute(f'INSERT INTO {TABLE} (user_id, code) VALUES (%s, %s)', [user_id, code])
+                queries += 1
+        return queries
+
+    def insert_derived(self, rows, offset):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for user_id in range(offset + 1, offset + rows + 1):
+                cursor.execute(f'INSERT INTO {TABLE} (user_id, code) VALUES (%s, %s)', [user_id, code_for_user_id(user_id)])
+        return rows
@@ -0,0 +1,122 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from app.models import (
+    Product, ProductSubmission, Transaction, Notification, UserActivity, Referral,
+    TransactionArchive, UserActivityArchive
+)
+from app.serializers import product_card_queryset
+from datetime import datetime
+import re
+
+# "SCAN app_product" without USING ... INDEX means a full table scan
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)(?! USING)')
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN on the main query of each hot endpoint and fail on full table scans'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plan checks are written for SQLite EXPLAIN QUERY PLAN output')
+
+        failures = []
+        for name, queryset in self.get_queries():
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+
+            scans = [detail for detail in plan if FULL_SCAN_RE.match(detail)]
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'FAIL {name}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'ok   {name}'))
+            for detail in plan:
+                self.stdout.write(f'       {detail}')
+
+        if failures:
+            raise CommandError(f'{len(failures)} queries scan a table: {", ".join(failures)}')
+
+    def get_queries(self):
+        # Parameter values only shape the plan, they need not exist
+        user = User(pk=1)
+        product = Product(pk='00000000000000000000000000000000')
+
+        start = timezone.make_aware(datetime(2024, 1, 1))
+        end = timezone.make_aware(datetime(2024, 2, 1))
+
+        live = Product.objects.filter(status='approved', in_stock=True, stock_count__gt=0)
+
+        queries = [
+            ('products: catalog by category', Product.objects.filter(
+                status='approved', category='electronics'
+            ).order_by('-created_at', '-pk')[:21]),
+            ('products: catalog recent', Product.objects.filter(
+                status='approved'
+            ).order_by('-created_at', '-pk')[:21]),
+            ('products: seller listing', Product.objects.filter(
+                Q(status='approved') | Q(seller=user)
+            ).filter(seller=user).order_by('-created_at')[:21]),
+            ('marketplace: recent', product_card_queryset(
+                live.order_by('-created_at', '-pk')
+            )[:21]),
+            ('marketplace: category recent', product_card_queryset(
+                live.filter(category='electronics').order_by('-created_at', '-pk')
+            )[:21]),
+            ('marketplace: price ascending', product_card_queryset(
+                live.order_by('price', 'pk')
+            )[:21]),
+            ('marketplace: top rated', product_card_queryset(
+                live.order_by('-rating', '-pk')
+            )[:21]),
+            ('marketplace: most viewed', product_card_queryset(
+                live.order_by('-views', '-pk')
+            )[:21]),
+            ('marketplace: featured', product_card_queryset(
+                live.filter(featured=True).order_by('-created_at', '-pk')
+            )[:21]),
+            ('marketplace: category price range', product_card_queryset(
+                live.filter(category='electronics', price__gte=10, price__lte=100).order_by('price', 'pk')
+            )[:21]),
+            ('transactions: user history', Transaction.objects.filter(
+                user=user
+            ).order_by('-created_at')[:21]),
+            ('transactions: export date range', Transaction.objects.filter(
+                user=user, created_at__gte=start, created_at__lt=end
+            ).order_by('created_at').values_list('id', 'created_at', 'recipient__username')),
+            ('transactions: export all users', Transaction.objects.filter(
+                created_at__gte=start
+            ).order_by('created_at').values_list('id', 'user__username')),
+            ('transactions: archived history', TransactionArchive.objects.filter(
+                user=user
+            ).order_by('-created_at')[:21]),
+            ('transactions: archived export', TransactionArchive.objects.filter(
+                user=user, created_at__gte=start, created_at__lt=end
+            ).order_by('created_at').values_list('id', 'created_at', 'recipient__username')),
+            ('notifications: unread', Notification.objects.filter(
+                user=user, is_read=False
+            ).order_by('-created_at')[:21]),
+            ('notifications: all', Notification.objects.filter(
+                user=user
+            ).order_by('-created_at')[:21]),
+            ('activity: user history', UserActivity.objects.filter(
+                user=user
+            ).order_by('-created_at')[:21]),
+            ('activity: archived history', UserActivityArchive.objects.filter(
+                user=user
+            ).order_by('-created_at')[:21]),
+            ('referrals: by status', Referral.objects.filter(
+                referrer=user, status__in=['qualified', 'paid']
+            )),
+            ('referrals: due for expiry', Referral.objects.filter(
+                status='pending', expires_at__lt=start
+            ).order_by('expires_at').values_list('pk')[:1000]),
+            ('submissions: pending for product', ProductSubmission.objects.filter(
+                product=product, status='pending'
+            )[:1]),
+        ]
+        return queries
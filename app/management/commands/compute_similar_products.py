@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.similarity import compute_similar_products, DEFAULT_K, DEFAULT_BLOCK_SIZE
+
+class Command(BaseCommand):
+    help = 'Compute top-k similar products (incremental since the last run unless --full)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute every product instead of only those affected by changes',
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=DEFAULT_K,
+            help='Number of neighbours to keep per product',
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            default=DEFAULT_BLOCK_SIZE,
+            help='Rows per matrix-multiply block',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            run = compute_similar_products(
+                k=options['k'],
+                block_size=options['block_size'],
+                full=options['full'],
+            )
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        mode = 'full' if run.full_rebuild else 'incremental'
+        elapsed = (run.finished_at - run.started_at).total_seconds()
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated neighbours for {run.products_updated} products ({mode}, {elapsed:.1f}s)'
+        ))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+from app.referrals import EXPIRY_BATCH_SIZE, expire_referrals
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Expire pending referrals past their deadline in bounded batches and notify both users. '
+        'Run it from cron (e.g. every 15 minutes) or keep it running with --loop.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=EXPIRY_BATCH_SIZE,
+            help='Number of referrals expired per transaction',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=0,
+            help='Stop a sweep after this many batches (0 means no limit)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Sweep again every --interval seconds instead of exiting',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=900.0,
+            help='Seconds between sweeps when looping',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            try:
+                stats = expire_referrals(
+                    batch_size=options['batch_size'], max_batches=options['max_batches'] or None
+                )
+            except OperationalError as e:
+                # Lock contention; committed batches stay expired and the
+                # rest are picked up by the next sweep
+                self.stdout.write(self.style.WARNING(f'sweep aborted: {e}'))
+            else:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(self.style.SUCCESS(
+                    f'Expired {stats.expired} referrals in {stats.batches} batches and sent '
+                    f'{stats.notified} notifications in {elapsed:.2f}s'
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
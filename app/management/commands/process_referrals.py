@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+from app.referrals import BATCH_SIZE, evaluate_batch, retry_unpaid_bonuses
+import time
+
+
+class Command(BaseCommand):
+    help = 'Evaluate queued deposits against pending referrals and pay qualifying bonuses in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Number of queued deposits evaluated per batch',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=0,
+            help='Stop after this many batches (0 means no limit)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling for new deposits instead of exiting when the queue is empty',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait between polls when looping and idle',
+        )
+
+    def handle(self, *args, **options):
+        batches = evaluated = qualified = paid = 0
+        started = time.perf_counter()
+
+        while not options['max_batches'] or batches < options['max_batches']:
+            try:
+                stats = evaluate_batch(batch_size=options['batch_size'])
+            except OperationalError as e:
+                # Lock contention; the batch rolled back and stays queued
+                self.stdout.write(self.style.WARNING(f'batch aborted: {e}'))
+                time.sleep(min(options['interval'], 1.0))
+                continue
+            if not stats.evaluated:
+                # Queue drained: retry bonuses the ledger rejected earlier
+                retried = retry_unpaid_bonuses(batch_size=options['batch_size'])
+                if retried.paid:
+                    paid += retried.paid
+                    self.stdout.write(
+                        f'retried {retried.paid} unpaid referrals with {retried.bonus_transactions} bonus transactions'
+                    )
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            batches += 1
+            evaluated += stats.evaluated
+            qualified += stats.qualified
+            paid += stats.paid
+            self.stdout.write(
+                f'batch {batches}: {stats.evaluated} deposits evaluated, {stats.qualified} referrals qualified, '
+                f'{stats.paid} paid with {stats.bonus_transactions} bonus transactions'
+            )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Evaluated {evaluated} deposits in {elapsed:.2f}s: {qualified} referrals qualified, {paid} paid'
+        ))
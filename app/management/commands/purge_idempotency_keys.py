@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app.idempotency import purge_expired_keys
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of keys to delete per batch',
+        )
+
+    def handle(self, *args, **options):
+        removed = purge_expired_keys(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {removed} expired idempotency keys'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from app.facets import rebuild_facet_counts
+from app.response_cache import ALL_CATEGORIES, invalidate_product_categories
+
+class Command(BaseCommand):
+    help = 'Recount marketplace facet cells from the product table'
+
+    def handle(self, *args, **options):
+        cells = rebuild_facet_counts()
+        invalidate_product_categories(ALL_CATEGORIES)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {cells} facet cells'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app.ratings import rebuild_ratings
+
+class Command(BaseCommand):
+    help = 'Recompute product ratings, review counts and star histograms from approved reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of products to recompute per batch',
+        )
+
+    def handle(self, *args, **options):
+        updated = rebuild_ratings(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed ratings for {updated} products'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from app.referrals import rebuild_referral_counters
+
+class Command(BaseCommand):
+    help = 'Recompute ReferralCode.signups, total_uses and total_earnings from the referrals table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of referral codes updated per statement',
+        )
+
+    def handle(self, *args, **options):
+        checked, drifted = rebuild_referral_counters(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt counters for {checked} referral codes ({drifted} had drifted)'
+        ))
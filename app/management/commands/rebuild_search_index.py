@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from app.search import rebuild_index, is_available
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of products to index per batch',
+        )
+
+    def handle(self, *args, **options):
+        if not is_available():
+            self.stdout.write(self.style.WARNING('Full-text index requires SQLite FTS5; nothing to do'))
+            return
+
+        total = rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} products'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from app.withdrawal_limits import rebuild_withdrawal_aggregates
+
+class Command(BaseCommand):
+    help = 'Rebuild daily and monthly withdrawal aggregates from completed withdrawal transactions'
+
+    def handle(self, *args, **options):
+        written, drifted = rebuild_withdrawal_aggregates()
+        if drifted:
+            self.stdout.write(self.style.WARNING(f'{drifted} aggregate rows had drifted from the transaction log'))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} withdrawal aggregate rows'))
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app.reconciliation import CHUNK_SIZE, reconcile
+import json
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare wallet balances with ledger entry totals per user and currency and write a drift report'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=None,
+            help='Number of user-id ranges to split the work into (default: 4 per worker)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Rows fetched per query',
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help='Report path (default: reconciliation-<timestamp>.json in the current directory)',
+        )
+        parser.add_argument(
+            '--fail-on-drift',
+            action='store_true',
+            help='Exit with an error when any drift or unposted transaction is found',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        shards = options['shards'] or workers * 4
+        if shards < 1 or options['chunk_size'] < 1:
+            raise CommandError('--shards and --chunk-size must be positive')
+
+        started = time.perf_counter()
+        results = reconcile(shards, workers=workers, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+
+        drift = [row for result in results for row in result['drift']]
+        unposted = [pk for result in results for pk in result['unposted']]
+        unposted_count = sum(result['unposted_count'] for result in results)
+        scanned = {
+            key: sum(result['scanned'][key] for result in results)
+            for key in ('entries', 'accounts', 'wallets')
+        }
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'elapsed_seconds': round(elapsed, 3),
+            'workers': workers,
+            'shards': [result['shard'] for result in results],
+            'scanned': scanned,
+            'drift_count': len(drift),
+            'drift': drift,
+            'unposted_count': unposted_count,
+            'unposted_sample': unposted,
+        }
+        path = options['output'] or f'reconciliation-{timezone.now():%Y%m%d-%H%M%S}.json'
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        summary = (
+            f'Checked {scanned["wallets"]} wallets, {scanned["accounts"]} ledger accounts and '
+            f'{scanned["entries"]} entries in {elapsed:.2f}s across {len(results)} shards; '
+            f'{len(drift)} drifted balances, {unposted_count} unposted transactions. Report: {path}'
+        )
+        if drift or unposted_count:
+            if options['fail_on_drift']:
+                raise CommandError(summary)
+            self.stdout.write(self.style.WARNING(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+from app.settlement import BATCH_SIZE, default_worker_id, get_gateway, settle_batch
+import time
+
+
+class Command(BaseCommand):
+    help = 'Settle pending transactions in leased batches; several workers may run at once'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Number of transactions claimed per batch',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=0,
+            help='Stop after this many batches (0 means no limit)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling for new transactions instead of exiting when none are left',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait between polls when looping and idle',
+        )
+        parser.add_argument(
+            '--worker-id',
+            default=None,
+            help='Lease owner name (defaults to host:pid:random)',
+        )
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        gateway = get_gateway()
+        batches = completed = failed = retried = 0
+        started = time.perf_counter()
+
+        while not options['max_batches'] or batches < options['max_batches']:
+            try:
+                stats = settle_batch(worker_id, gateway=gateway, batch_size=options['batch_size'])
+            except OperationalError as e:
+                # Lock contention with another worker; anything this batch
+                # claimed is retried once its lease expires
+                self.stdout.write(self.style.WARNING(f'batch aborted: {e}'))
+                time.sleep(min(options['interval'], 1.0))
+                continue
+            if not stats.claimed:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            batches += 1
+            completed += stats.completed
+            failed += stats.failed
+            retried += stats.retried
+            self.stdout.write(
+                f'batch {batches}: {stats.claimed} claimed, {stats.completed} completed, '
+                f'{stats.failed} failed, {stats.retried} left for retry'
+            )
+
+        elapsed = time.perf_counter() - started
+        rate = (completed + failed) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{worker_id}: settled {completed + failed} transactions '
+            f'({completed} completed, {failed} failed) in {elapsed:.2f}s, {rate:.0f}/s'
+        ))
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:21
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_totals(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    Review = apps.get_model('app', 'Review')
+
+    aggregates = {'total': Sum('rating'), 'count': Count('id')}
+    for stars in range(1, 6):
+        aggregates[f'rating_{stars}_count'] = Count('id', filter=Q(rating=stars))
+    stats = {
+        row['product_id']: row
+        for row in Review.objects.filter(is_approved=True).values('product_id').annotate(**aggregates).order_by()
+    }
+
+    # Products without approved reviews drop any seeded rating/review_count
+    Product.objects.exclude(pk__in=list(stats)).update(rating=0, review_count=0)
+    for product_id, row in stats.items():
+        Product.objects.filter(pk=product_id).update(
+            rating_total=row['total'],
+            review_count=row['count'],
+            rating=(Decimal(row['total']) / row['count']).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+            **{f'rating_{stars}_count': row[f'rating_{stars}_count'] for stars in range(1, 6)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_totals, migrations.RunPython.noop),
+    ]
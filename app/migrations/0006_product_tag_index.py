@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_product_tags(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    Tag = apps.get_model('app', 'Tag')
+    ProductTag = apps.get_model('app', 'ProductTag')
+
+    tag_ids = {}
+    links = []
+    for product_id, tags in Product.objects.values_list('id', 'tags').iterator():
+        if not isinstance(tags, list):
+            continue
+        names = {' '.join(str(tag).lower().split())[:50] for tag in tags} - {''}
+        for name in names:
+            if name not in tag_ids:
+                tag_ids[name] = Tag.objects.create(name=name).pk
+            links.append(ProductTag(product_id=product_id, tag_id=tag_ids[name]))
+    ProductTag.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_product_rating_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='app.product')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_links', to='app.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'product'], name='producttag_tag_product_idx')],
+                'unique_together': {('product', 'tag')},
+            },
+        ),
+        migrations.RunPython(backfill_product_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:26
+
+from django.db import migrations, models
+
+
+def backfill_facet_counts(apps, schema_editor):
+    from decimal import Decimal
+
+    Product = apps.get_model('app', 'Product')
+    ProductFacetCount = apps.get_model('app', 'ProductFacetCount')
+
+    # Same layout as app.facets: even buckets sit on an edge, odd ones between
+    edges = [Decimal(edge) for edge in (0, 10, 25, 50, 100, 250, 500, 1000)]
+    counts = {}
+    rows = Product.objects.filter(status='approved', in_stock=True, stock_count__gt=0).values_list(
+        'category', 'condition', 'price', 'featured'
+    )
+    for category, condition, price, featured in rows.iterator():
+        index = max(sum(1 for edge in edges if edge <= price) - 1, 0)
+        bucket = index * 2 if price == edges[index] else index * 2 + 1
+        key = (category, condition, bucket, featured)
+        counts[key] = counts.get(key, 0) + 1
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category=category, condition=condition, price_bucket=bucket, featured=featured, count=count)
+        for (category, condition, bucket, featured), count in counts.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_product_neighbors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('electronics', 'Electronics'), ('clothing', 'Clothing & Accessories'), ('home_garden', 'Home & Garden'), ('books_media', 'Books & Media'), ('sports_outdoors', 'Sports & Outdoors'), ('health_beauty', 'Health & Beauty'), ('automotive', 'Automotive'), ('tools_hardware', 'Tools & Hardware'), ('toys_games', 'Toys & Games'), ('other', 'Other')], max_length=20)),
+                ('condition', models.CharField(choices=[('new', 'New'), ('used', 'Used'), ('refurbished', 'Refurbished')], max_length=20)),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('featured', models.BooleanField(default=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Product Facet Count',
+                'verbose_name_plural': 'Product Facet Counts',
+                'unique_together': {('category', 'condition', 'price_bucket', 'featured')},
+            },
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
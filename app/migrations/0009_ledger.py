@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_wallet_accounts(apps, schema_editor):
+    """Carry existing wallet balances into the ledger as opening entries"""
+    from decimal import Decimal
+
+    Wallet = apps.get_model('app', 'Wallet')
+    LedgerAccount = apps.get_model('app', 'LedgerAccount')
+    LedgerEntry = apps.get_model('app', 'LedgerEntry')
+
+    fields = {'USD': 'usd_balance', 'NGN': 'ngn_balance', 'BTC': 'btc_balance', 'ETH': 'eth_balance'}
+    totals = {currency: Decimal('0') for currency in fields}
+    accounts = []
+    for wallet in Wallet.objects.iterator():
+        for currency, field in fields.items():
+            balance = getattr(wallet, field) or Decimal('0')
+            if balance:
+                totals[currency] += balance
+                accounts.append(LedgerAccount(
+                    key=f'wallet:{wallet.user_id}:{currency}', user_id=wallet.user_id,
+                    kind='wallet', currency=currency, balance=balance,
+                ))
+    for currency, total in totals.items():
+        if total:
+            accounts.append(LedgerAccount(
+                key=f'system:opening:{currency}', kind='opening', currency=currency, balance=-total,
+            ))
+    for account in accounts:
+        account.save()
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(account=account, amount=account.balance, memo='Opening balance') for account in accounts
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_product_facet_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(choices=[('wallet', 'User Wallet'), ('external', 'External Funds'), ('sales', 'Marketplace Sales'), ('fees', 'Fee Income'), ('referrals', 'Referral Bonuses'), ('opening', 'Opening Balances')], max_length=20)),
+                ('currency', models.CharField(choices=[('USD', 'US Dollar'), ('NGN', 'Nigerian Naira'), ('BTC', 'Bitcoin'), ('ETH', 'Ethereum')], max_length=5)),
+                ('balance', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_accounts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Ledger Account',
+                'verbose_name_plural': 'Ledger Accounts',
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('memo', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='app.ledgeraccount')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='app.transaction')),
+            ],
+            options={
+                'verbose_name': 'Ledger Entry',
+                'verbose_name_plural': 'Ledger Entries',
+                'indexes': [models.Index(fields=['account', 'created_at'], name='ledger_account_created_idx')],
+                'unique_together': {('transaction', 'account')},
+            },
+        ),
+        migrations.RunPython(open_wallet_accounts, migrations.RunPython.noop),
+    ]
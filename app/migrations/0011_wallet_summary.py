@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_transaction_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usd_balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('ngn_balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('btc_balance', models.DecimalField(decimal_places=8, default=0, max_digits=15)),
+                ('eth_balance', models.DecimalField(decimal_places=8, default=0, max_digits=15)),
+                ('total_balance_usd', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_transactions', models.PositiveIntegerField(default=0)),
+                ('recent_transactions', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Wallet Summary',
+                'verbose_name_plural': 'Wallet Summaries',
+            },
+        ),
+    ]
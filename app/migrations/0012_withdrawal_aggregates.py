@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_withdrawal_aggregates(apps, schema_editor):
+    from django.utils import timezone
+
+    Transaction = apps.get_model('app', 'Transaction')
+    WithdrawalAggregate = apps.get_model('app', 'WithdrawalAggregate')
+
+    totals = {}
+    rows = Transaction.objects.filter(
+        transaction_type='withdrawal', status='completed', completed_at__isnull=False
+    ).values_list('user_id', 'currency', 'completed_at', 'amount')
+    for user_id, currency, completed_at, amount in rows.iterator():
+        day = timezone.localdate(completed_at)
+        for period, start in (('day', day), ('month', day.replace(day=1))):
+            total, count = totals.get((user_id, period, start, currency), (0, 0))
+            totals[(user_id, period, start, currency)] = (total + amount, count + 1)
+    WithdrawalAggregate.objects.bulk_create([
+        WithdrawalAggregate(user_id=user_id, period=period, period_start=start, currency=currency,
+                            total=total, count=count)
+        for (user_id, period, start, currency), (total, count) in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_wallet_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='ledgerentry',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='reversal',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ledgerentry',
+            unique_together={('transaction', 'account', 'reversal')},
+        ),
+        migrations.CreateModel(
+            name='WithdrawalAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('currency', models.CharField(choices=[('USD', 'US Dollar'), ('NGN', 'Nigerian Naira'), ('BTC', 'Bitcoin'), ('ETH', 'Ethereum')], max_length=5)),
+                ('total', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='withdrawal_aggregates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Withdrawal Aggregate',
+                'verbose_name_plural': 'Withdrawal Aggregates',
+                'unique_together': {('user', 'period', 'period_start', 'currency')},
+            },
+        ),
+        migrations.RunPython(backfill_withdrawal_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:44
+
+import app.ids
+from django.db import migrations, models
+
+
+def backfill_references(apps, schema_editor):
+    """Give existing transactions a reference timestamped with their created_at"""
+    import secrets
+
+    for model_name in ('Transaction', 'TransactionArchive'):
+        Model = apps.get_model('app', model_name)
+        while True:
+            rows = list(Model.objects.filter(reference__isnull=True).only('pk', 'created_at')[:1000])
+            if not rows:
+                break
+            for row in rows:
+                value = app.ids.uuid7_from_parts(
+                    int(row.created_at.timestamp() * 1000), secrets.randbits(12), secrets.randbits(62)
+                )
+                row.reference = app.ids.REFERENCE_PREFIX + app.ids.encode_base32(value)
+            Model.objects.bulk_update(rows, ['reference'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_history_archive'),
+    ]
+
+    operations = [
+        # The defaults are computed in Python and never reach the schema;
+        # altering the columns would make SQLite rebuild every table
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='notification',
+                    name='id',
+                    field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='product',
+                    name='id',
+                    field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='purchase',
+                    name='id',
+                    field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='referral',
+                    name='id',
+                    field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='transaction',
+                    name='id',
+                    field=models.UUIDField(default=app.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='transaction',
+                    name='reference',
+                    field=models.CharField(blank=True, default=app.ids.new_transaction_reference, max_length=100, null=True, unique=True),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.RunPython(backfill_references, migrations.RunPython.noop),
+    ]
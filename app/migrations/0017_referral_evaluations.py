@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_time_ordered_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deposit_usd', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('deposited_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('referral', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='evaluations', to='app.referral')),
+                ('transaction', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='app.transaction')),
+            ],
+            options={
+                'verbose_name': 'Referral Evaluation',
+                'verbose_name_plural': 'Referral Evaluations',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:49
+
+from django.db import migrations, models
+
+
+def backfill_signups(apps, schema_editor):
+    from django.db.models import Count, OuterRef, Subquery
+    from django.db.models.functions import Coalesce
+
+    Referral = apps.get_model('app', 'Referral')
+    ReferralCode = apps.get_model('app', 'ReferralCode')
+
+    counts = Referral.objects.filter(referral_code=OuterRef('pk')).order_by().values(
+        'referral_code'
+    ).annotate(n=Count('pk')).values('n')
+    ReferralCode.objects.update(signups=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_referral_evaluations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='referralcode',
+            name='signups',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_signups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_referral_code_signups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='referral',
+            index=models.Index(fields=['status', 'expires_at'], name='referral_status_expires_idx'),
+        ),
+    ]
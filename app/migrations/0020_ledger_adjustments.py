@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_referral_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgeraccount',
+            name='kind',
+            field=models.CharField(choices=[('wallet', 'User Wallet'), ('external', 'External Funds'), ('sales', 'Marketplace Sales'), ('fees', 'Fee Income'), ('referrals', 'Referral Bonuses'), ('opening', 'Opening Balances'), ('adjustments', 'Manual Adjustments')], max_length=20),
+        ),
+    ]
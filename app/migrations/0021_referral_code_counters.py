@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:03
+
+from django.db import migrations
+
+
+def backfill_counters(apps, schema_editor):
+    """Bring total_uses and total_earnings in line with the referrals, which profiles now read"""
+    from app.referrals import rebuild_referral_counters
+
+    rebuild_referral_counters(
+        code_model=apps.get_model('app', 'ReferralCode'),
+        referral_model=apps.get_model('app', 'Referral'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_ledger_adjustments'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
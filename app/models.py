@@ -1,11 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 import uuid
-import secrets
-import string
+
+from .ids import new_transaction_reference, uuid7
 
 # Extend the User model with a profile
 class UserProfile(models.Model):
@@ -83,9 +84,10 @@ class Wallet(models.Model):
         return f"{self.user.username}'s Wallet"
     
     def get_total_balance_usd(self):
-        """Calculate total balance in USD equivalent"""
-        # This would use real exchange rates in production
-        return float(self.usd_balance) + (float(self.ngn_balance) / 1500)  # Mock exchange rate
+        """Calculate total balance in USD equivalent across all currencies"""
+        from .exchange_rates import total_usd, wallet_balances
+        return total_usd(wallet_balances(self))
+    get_total_balance_usd.short_description = 'Total (USD)'
 
 
 class Transaction(models.Model):
@@ -116,7 +118,7 @@ class Transaction(models.Model):
         ('ETH', 'Ethereum'),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -127,7 +129,7 @@ class Transaction(models.Model):
     
     # Transaction details
     description = models.TextField()
-    reference = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    reference = models.CharField(max_length=100, unique=True, null=True, blank=True, default=new_transaction_reference)
     external_reference = models.CharField(max_length=100, null=True, blank=True)
     
     # Related transactions (for transfers)
@@ -145,14 +147,218 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    
+    # Settlement worker holding this transaction, until the lease expires
+    lease_owner = models.CharField(max_length=64, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='txn_user_created_idx'),
+            models.Index(fields=['created_at'], name='txn_created_idx'),
+            models.Index(fields=['status', 'lease_expires_at'], name='txn_status_lease_idx'),
+        ]
 
     def __str__(self):
         return f"{self.transaction_type} - {self.amount} {self.currency} - {self.user.username}"
 
 
+class TransactionArchive(models.Model):
+    """
+    Finished transactions moved out of Transaction by the archiver.
+
+    Columns mirror Transaction so history views can serialize either. The
+    foreign keys carry no database constraint: rows are copied verbatim and
+    ledger entries keep pointing at the archived id.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False, related_name='+')
+    transaction_type = models.CharField(max_length=20, choices=Transaction.TRANSACTION_TYPES)
+    status = models.CharField(max_length=20, choices=Transaction.STATUS_CHOICES)
+    
+    amount = models.DecimalField(max_digits=15, decimal_places=8)
+    currency = models.CharField(max_length=5, choices=Transaction.CURRENCY_CHOICES)
+    
+    description = models.TextField()
+    reference = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    external_reference = models.CharField(max_length=100, null=True, blank=True)
+    
+    recipient = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False, related_name='+')
+    
+    payment_method = models.CharField(max_length=50, null=True, blank=True)
+    payment_gateway = models.CharField(max_length=50, null=True, blank=True)
+    
+    fee_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    network_fee = models.DecimalField(max_digits=10, decimal_places=8, default=0.00000000)
+    
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Archived Transaction'
+        verbose_name_plural = 'Archived Transactions'
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='txn_archive_user_created_idx'),
+            models.Index(fields=['created_at'], name='txn_archive_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_type} - {self.amount} {self.currency} (archived)"
+
+
+class WalletSummary(models.Model):
+    """Materialized dashboard summary of a user's wallet, refreshed on writes"""
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='wallet_summary')
+    
+    usd_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    ngn_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    btc_balance = models.DecimalField(max_digits=15, decimal_places=8, default=0)
+    eth_balance = models.DecimalField(max_digits=15, decimal_places=8, default=0)
+    total_balance_usd = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    
+    total_transactions = models.PositiveIntegerField(default=0)
+    recent_transactions = models.JSONField(default=list)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Wallet Summary'
+        verbose_name_plural = 'Wallet Summaries'
+
+    def __str__(self):
+        return f"{self.user.username}'s Wallet Summary"
+
+
+class LedgerAccount(models.Model):
+    """Double-entry ledger account; user wallets get one per currency"""
+    
+    KIND_CHOICES = [
+        ('wallet', 'User Wallet'),
+        ('external', 'External Funds'),
+        ('sales', 'Marketplace Sales'),
+        ('fees', 'Fee Income'),
+        ('referrals', 'Referral Bonuses'),
+        ('opening', 'Opening Balances'),
+        ('adjustments', 'Manual Adjustments'),
+    ]
+
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='ledger_accounts')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    currency = models.CharField(max_length=5, choices=Wallet.CURRENCY_CHOICES)
+    
+    # Running total of this account's entries
+    balance = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Ledger Account'
+        verbose_name_plural = 'Ledger Accounts'
+
+    def __str__(self):
+        return f"{self.key}: {self.balance} {self.currency}"
+
+
+class LedgerEntry(models.Model):
+    """One leg of a posting; the legs of a transaction sum to zero per currency"""
+    
+    # No database constraint: archiving a transaction moves its row to
+    # TransactionArchive and the entries keep the id
+    transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, null=True, blank=True, db_constraint=False, related_name='ledger_entries')
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name='entries')
+    
+    # Positive credits the account, negative debits it
+    amount = models.DecimalField(max_digits=20, decimal_places=8)
+    memo = models.CharField(max_length=100, blank=True)
+    
+    # Set on the legs that undo a cancelled transaction's original posting
+    reversal = models.BooleanField(default=False)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Ledger Entry'
+        verbose_name_plural = 'Ledger Entries'
+        # A transaction touches each account at most once per direction,
+        # which also makes posting (or reversing) it twice fail
+        unique_together = ['transaction', 'account', 'reversal']
+        indexes = [
+            models.Index(fields=['account', 'created_at'], name='ledger_account_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account.key} {self.amount}"
+
+
+class WithdrawalAggregate(models.Model):
+    """Completed withdrawals per user, currency and day or month, for limit checks"""
+    
+    PERIOD_CHOICES = [
+        ('day', 'Day'),
+        ('month', 'Month'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='withdrawal_aggregates')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    currency = models.CharField(max_length=5, choices=Wallet.CURRENCY_CHOICES)
+    
+    total = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'period', 'period_start', 'currency']
+        verbose_name = 'Withdrawal Aggregate'
+        verbose_name_plural = 'Withdrawal Aggregates'
+
+    def __str__(self):
+        return f"{self.user.username} {self.period} {self.period_start}: {self.total} {self.currency}"
+
+
+class IdempotencyKey(models.Model):
+    """Response recorded for a client-supplied Idempotency-Key, replayed on retries"""
+    
+    STATUS_CHOICES = [
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    
+    # Hash of method, path and body; reusing a key for another request is an error
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    # A processing key whose request has not finished by then may be taken over
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    response_headers = models.JSONField(default=dict, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'key']
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+
+    def __str__(self):
+        return f"{self.user.username}: {self.key} ({self.status})"
+
+
 class ReferralProgram(models.Model):
     """Referral program configuration"""
     
@@ -190,6 +396,10 @@ class ReferralCode(models.Model):
     
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='referral_code')
     code = models.CharField(max_length=20, unique=True)
+    # Referrals attributed to the code at registration, in any state;
+    # capped by ReferralProgram.max_referrals_per_user
+    signups = models.PositiveIntegerField(default=0)
+    # Qualified or paid referrals, and the referrer bonuses paid out
     total_uses = models.PositiveIntegerField(default=0)
     total_earnings = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     is_active = models.BooleanField(default=True)
@@ -201,11 +411,9 @@ class ReferralCode(models.Model):
     
     @classmethod
     def generate_code(cls, user):
-        """Generate a unique referral code for a user"""
-        while True:
-            code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
-            if not cls.objects.filter(code=code).exists():
-                return cls.objects.create(user=user, code=code)
+        """Create the user's referral code, derived from their id"""
+        from .referral_codes import create_referral_code
+        return create_referral_code(user)
 
 
 class Referral(models.Model):
@@ -218,7 +426,7 @@ class Referral(models.Model):
         ('expired', 'Expired'),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     referrer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='referrals_made')
     referee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='referrals_received')
     referral_code = models.ForeignKey(ReferralCode, on_delete=models.CASCADE)
@@ -244,11 +452,39 @@ class Referral(models.Model):
 
     class Meta:
         unique_together = ['referrer', 'referee']
+        indexes = [
+            models.Index(fields=['referrer', 'status'], name='referral_referrer_status_idx'),
+            models.Index(fields=['status', 'expires_at'], name='referral_status_expires_idx'),
+        ]
 
     def __str__(self):
         return f"{self.referrer.username} referred {self.referee.username}"
 
 
+class ReferralEvaluation(models.Model):
+    """
+    A completed deposit waiting to be counted towards a pending referral.
+
+    Rows are queued in the same database transaction that posts the
+    deposit and deleted by the worker that evaluates them.
+    """
+    
+    referral = models.ForeignKey(Referral, on_delete=models.CASCADE, related_name='evaluations')
+    # The deposit; unconstrained so it can be archived independently
+    transaction = models.ForeignKey(Transaction, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    deposit_usd = models.DecimalField(max_digits=15, decimal_places=2)
+    deposited_at = models.DateTimeField()
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Referral Evaluation'
+        verbose_name_plural = 'Referral Evaluations'
+
+    def __str__(self):
+        return f"{self.referral_id}: {self.deposit_usd} USD"
+
+
 # Keep existing models with improvements
 
 class MerchantApplication(models.Model):
@@ -367,7 +603,7 @@ class Product(models.Model):
     ]
 
     # Basic Information
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     title = models.CharField(max_length=200)
     description = models.TextField()
     
@@ -395,6 +631,14 @@ class Product(models.Model):
     # Rating and Reviews
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0, validators=[MinValueValidator(0.0), MaxValueValidator(5.0)])
     review_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)  # Sum of approved review ratings
+    
+    # Star histogram of approved reviews
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
     
     # Status and Admin Review
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
@@ -417,13 +661,51 @@ class Product(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
+        indexes = [
+            # Listings filter on status (and category) and page by (sort key, id)
+            models.Index(fields=['status', '-created_at', '-id'], name='product_status_created_idx'),
+            models.Index(fields=['status', 'category', '-created_at', '-id'], name='product_status_cat_idx'),
+            models.Index(fields=['status', 'price', 'id'], name='product_status_price_idx'),
+            models.Index(fields=['status', 'category', 'price', 'id'], name='product_status_cat_price_idx'),
+            models.Index(fields=['status', '-rating', '-id'], name='product_status_rating_idx'),
+            models.Index(fields=['status', '-views', '-id'], name='product_status_views_idx'),
+            models.Index(fields=['seller', '-created_at'], name='product_seller_created_idx'),
+        ]
         
+    # Moved only by F() updates (apply_rating_delta, rebuild_ratings)
+    COUNTER_FIELDS = (
+        'rating', 'review_count', 'rating_total',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+    )
+
     def __str__(self):
         return f"{self.title} - {self.get_status_display()}"
-    
+
+    def save(self, *args, **kwargs):
+        """Save, leaving out the counter columns when updating an existing row
+
+        A full save would write back the counters loaded with the instance and
+        undo any delta applied since; pass update_fields to write them.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def is_available(self):
         return self.status == 'approved' and self.in_stock and self.stock_count > 0
     
+    def get_rating_histogram(self):
+        return {
+            '1': self.rating_1_count,
+            '2': self.rating_2_count,
+            '3': self.rating_3_count,
+            '4': self.rating_4_count,
+            '5': self.rating_5_count,
+        }
+    
     def get_seller_name(self):
         if hasattr(self.merchant_application, 'business_name') and self.merchant_application.business_name:
             return self.merchant_application.business_name
@@ -442,6 +724,9 @@ class ProductImage(models.Model):
 
     class Meta:
         ordering = ['order', 'created_at']
+        indexes = [
+            models.Index(fields=['product', 'order', 'created_at'], name='productimage_product_order_idx'),
+        ]
         verbose_name = 'Product Image'
         verbose_name_plural = 'Product Images'
 
@@ -449,6 +734,85 @@ class ProductImage(models.Model):
         return f"Image for {self.product.title}"
 
 
+class Tag(models.Model):
+    """Normalized product tag"""
+    
+    name = models.CharField(max_length=50, unique=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class ProductTag(models.Model):
+    """Tag/product association mirrored from Product.tags"""
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='tag_links')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='product_links')
+
+    class Meta:
+        unique_together = ['product', 'tag']
+        indexes = [
+            models.Index(fields=['tag', 'product'], name='producttag_tag_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} - {self.tag.name}"
+
+
+class ProductNeighbor(models.Model):
+    """Precomputed "similar products" list entry"""
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbor_links')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        unique_together = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.product_id} ~ {self.neighbor_id} ({self.score:.3f})"
+
+
+class SimilarityRun(models.Model):
+    """Bookkeeping for the similar-products batch job"""
+    
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full_rebuild = models.BooleanField(default=False)
+    products_updated = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Similarity run {self.started_at:%Y-%m-%d %H:%M} ({self.products_updated} products)"
+
+
+class ProductFacetCount(models.Model):
+    """Live marketplace product counts per facet cell, maintained on product writes"""
+    
+    category = models.CharField(max_length=20, choices=Product.CATEGORY_CHOICES)
+    condition = models.CharField(max_length=20, choices=Product.CONDITION_CHOICES)
+    price_bucket = models.PositiveSmallIntegerField()
+    featured = models.BooleanField(default=False)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['category', 'condition', 'price_bucket', 'featured']
+        verbose_name = 'Product Facet Count'
+        verbose_name_plural = 'Product Facet Counts'
+
+    def __str__(self):
+        return f"{self.category}/{self.condition}/{self.price_bucket}/{self.featured}: {self.count}"
+
+
 class ProductSubmission(models.Model):
     """Model for tracking product submission history"""
     
@@ -470,6 +834,9 @@ class ProductSubmission(models.Model):
 
     class Meta:
         ordering = ['-submitted_at']
+        indexes = [
+            models.Index(fields=['product', 'status', '-submitted_at'], name='submission_product_status_idx'),
+        ]
         verbose_name = 'Product Submission'
         verbose_name_plural = 'Product Submissions'
 
@@ -527,7 +894,7 @@ class Purchase(models.Model):
         ('refunded', 'Refunded'),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='purchases')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='purchases')
     seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sales')
@@ -598,7 +965,7 @@ class Notification(models.Model):
         ('promotion', 'Promotion'),
     ]
 
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     
     notification_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
@@ -622,6 +989,9 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notification_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Notification: {self.title} - {self.user.username}"
@@ -680,11 +1050,45 @@ class UserActivity(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='activity_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.activity_type} - {self.created_at}"
 
 
+class UserActivityArchive(models.Model):
+    """Activity rows moved out of UserActivity by the archiver; same columns"""
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False, related_name='+')
+    activity_type = models.CharField(max_length=20, choices=UserActivity.ACTIVITY_TYPES)
+    description = models.TextField(null=True, blank=True)
+    
+    related_product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False, related_name='+')
+    # May point at a hot or an archived transaction
+    related_transaction = models.ForeignKey(Transaction, on_delete=models.DO_NOTHING, null=True, blank=True, db_constraint=False, related_name='+')
+    
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    user_agent = models.TextField(null=True, blank=True)
+    
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Archived User Activity'
+        verbose_name_plural = 'Archived User Activities'
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='activity_archive_user_idx'),
+            models.Index(fields=['created_at'], name='activity_archive_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.activity_type} - {self.created_at} (archived)"
+
+
 class SystemSettings(models.Model):
     """Global system settings"""
     
@@ -728,7 +1132,7 @@ class SystemSettings(models.Model):
 
 
 # Django Signals for automatic profile and wallet creation
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 
 @receiver(post_save, sender=User)
@@ -753,9 +1157,127 @@ def create_user_wallet(sender, instance, created, **kwargs):
 def create_user_referral_code(sender, instance, created, **kwargs):
     """Automatically create ReferralCode when User is created"""
     if created:
-        # Generate unique referral code
-        while True:
-            code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
-            if not ReferralCode.objects.filter(code=code).exists():
-                ReferralCode.objects.create(user=instance, code=code)
-                break
+        ReferralCode.generate_code(instance)
+
+
+@receiver(post_save, sender=ReferralCode)
+@receiver(post_delete, sender=ReferralCode)
+def forget_referral_code(sender, instance, **kwargs):
+    """Drop the code from this process's attribution cache"""
+    from .referrals import code_cache
+    code_cache.invalidate(instance.code)
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, **kwargs):
+    """Keep the full-text search index in sync with product edits"""
+    from .search import index_product
+    index_product(instance)
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    """Drop deleted products from the full-text search index"""
+    from .search import remove_product
+    remove_product(instance.pk)
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    """Remember the stored listing state so post_save can diff against it"""
+    from .facets import FACET_STATE_FIELDS
+    instance._previous_state = None
+    if instance.pk and not instance._state.adding:
+        instance._previous_state = Product.objects.filter(pk=instance.pk).values(*FACET_STATE_FIELDS).first()
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_marketplace_for_product(sender, instance, **kwargs):
+    """Evict cached marketplace pages for the product's categories (covers approve/reject too)"""
+    from .response_cache import invalidate_product_categories
+    previous = getattr(instance, '_previous_state', None) or {}
+    invalidate_product_categories(instance.category, previous.get('category'))
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_marketplace_for_image(sender, instance, **kwargs):
+    """Thumbnails are part of cached marketplace cards"""
+    from .response_cache import invalidate_product_categories
+    category = Product.objects.filter(pk=instance.product_id).values_list('category', flat=True).first()
+    invalidate_product_categories(category)
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    """Remember what the stored review contributed to its product's rating"""
+    instance._previous_rating = None
+    if instance.pk and not instance._state.adding:
+        instance._previous_rating = Review.objects.filter(
+            pk=instance.pk, is_approved=True
+        ).values_list('product_id', 'rating').first()
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, **kwargs):
+    """Adjust running rating totals for created, edited or (un)approved reviews"""
+    from .ratings import apply_review_change
+    current = (instance.product_id, instance.rating) if instance.is_approved else None
+    apply_review_change(getattr(instance, '_previous_rating', None), current)
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    """Remove a deleted review from its product's rating"""
+    from .ratings import apply_review_change
+    if instance.is_approved:
+        apply_review_change((instance.product_id, instance.rating), None)
+
+@receiver(post_save, sender=Product)
+def sync_product_tag_index(sender, instance, **kwargs):
+    """Mirror Product.tags into the ProductTag association"""
+    from .tags import sync_product_tags
+    previous = getattr(instance, '_previous_state', None) or {}
+    sync_product_tags(instance, previous.get('status'))
+
+@receiver(post_delete, sender=Product)
+def refresh_tag_suggestions(sender, instance, **kwargs):
+    """Deleted products may leave tags without products"""
+    from .response_cache import invalidate_tags
+    from .tags import SUGGESTIONS_TAG
+    invalidate_tags(SUGGESTIONS_TAG)
+
+@receiver(post_save, sender=Product)
+def update_facets_on_product_save(sender, instance, **kwargs):
+    """Move the product between facet cells when status, stock, price etc. change"""
+    from .facets import apply_facet_change, facet_cell, product_state
+    apply_facet_change(
+        facet_cell(getattr(instance, '_previous_state', None)),
+        facet_cell(product_state(instance))
+    )
+
+@receiver(post_delete, sender=Product)
+def update_facets_on_product_delete(sender, instance, **kwargs):
+    """Drop a deleted product from its facet cell"""
+    from .facets import apply_facet_change, facet_cell, product_state
+    apply_facet_change(facet_cell(product_state(instance)), None)
+
+@receiver(post_save, sender=Transaction)
+def update_wallet_summary_on_transaction(sender, instance, created, **kwargs):
+    """Count new transactions and refresh the recent list once committed"""
+    from .wallet_summary import adjust_transaction_count, schedule_refresh
+    if created:
+        adjust_transaction_count(instance.user_id, 1)
+    schedule_refresh(instance.user_id)
+
+@receiver(post_delete, sender=Transaction)
+def update_wallet_summary_on_transaction_delete(sender, instance, **kwargs):
+    from .wallet_summary import adjust_transaction_count, schedule_refresh
+    adjust_transaction_count(instance.user_id, -1)
+    schedule_refresh(instance.user_id)
+
+@receiver(post_save, sender=Wallet)
+def update_wallet_summary_on_wallet(sender, instance, **kwargs):
+    """Pick up balance edits made through the model (e.g. the admin)"""
+    from .wallet_summary import schedule_refresh
+    schedule_refresh(instance.user_id)
+
+@receiver(post_save, sender=SystemSettings)
+def reload_exchange_rates(sender, instance, **kwargs):
+    """Pick up an edited NGN rate in this process without waiting for the TTL"""
+    from .exchange_rates import rates
+    rates.invalidate()
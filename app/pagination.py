@@ -0,0 +1,199 @@
+"""
+Keyset (cursor) pagination for product listings
+Pages are addressed by the (sort value, id) of the last row seen instead of
+an OFFSET, so deep pages cost the same as the first one and no COUNT(*) runs
+"""
+
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor paginator over (ordering field, pk).
+
+    The queryset's ordering decides the keyset; only fields listed in
+    `keyset_fields` are supported. Anything else (e.g. search relevance)
+    is handed to `fallback_class`.
+    """
+
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    total_query_param = 'include_total'
+    keyset_fields = ('created_at',)
+    default_ordering = '-created_at'
+    estimate_cap = 10000
+    fallback_class = PageNumberPagination
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.fallback = None
+
+        keyset = self.get_keyset(queryset)
+        if keyset is None:
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.field, self.descending = keyset
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        backwards = cursor is not None and cursor['d'] == 'p'
+
+        # Walk in the direction of travel; previous pages are read reversed
+        descending = self.descending != backwards
+        prefix = '-' if descending else ''
+        page_qs = queryset.order_by(f'{prefix}{self.field}', f'{prefix}pk')
+
+        if cursor is not None:
+            model = queryset.model
+            value = model._meta.get_field(self.field).to_python(cursor['v'])
+            pk = model._meta.pk.to_python(cursor['k'])
+            lookup = 'lt' if descending else 'gt'
+            page_qs = page_qs.filter(
+                Q(**{f'{self.field}__{lookup}': value}) |
+                Q(**{self.field: value, f'pk__{lookup}': pk})
+            )
+
+        rows = list(page_qs[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if backwards:
+            rows.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_previous = cursor is not None
+            self.has_next = has_more
+
+        self.page = rows
+        self.estimated_total = None
+        if request.query_params.get(self.total_query_param) == 'true':
+            self.estimated_total = self.estimate_total(queryset)
+        return rows
+
+    def get_keyset(self, queryset):
+        """Return (field, descending) for the queryset ordering, or None"""
+        ordering = list(queryset.query.order_by) or list(queryset.query.get_meta().ordering)
+        if not ordering:
+            ordering = [self.default_ordering]
+
+        leading = ordering[0]
+        if not isinstance(leading, str):
+            return None
+        field = leading.lstrip('-')
+        if field not in self.keyset_fields:
+            return None
+        return field, leading.startswith('-')
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def estimate_total(self, queryset):
+        """Bounded count: exact up to `estimate_cap`, capped beyond it"""
+        count = queryset.order_by()[:self.estimate_cap + 1].count()
+        return {
+            'value': min(count, self.estimate_cap),
+            'exact': count <= self.estimate_cap,
+        }
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            cursor = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if cursor['d'] not in ('n', 'p') or 'v' not in cursor or 'k' not in cursor:
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, row, direction):
+        value = self._row_value(row, self.field)
+        pk = self._row_value(row, 'pk')
+        payload = {
+            'v': value.isoformat() if hasattr(value, 'isoformat') else str(value),
+            'k': str(pk),
+            'd': direction,
+        }
+        raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def _row_value(self, row, name):
+        # Rows can be model instances or .values() dicts
+        if isinstance(row, dict):
+            return row['id'] if name == 'pk' else row[name]
+        return getattr(row, name)
+
+    def _build_url(self, row, direction):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(row, direction))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._build_url(self.page[-1], 'n')
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return None
+        return self._build_url(self.page[0], 'p')
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.estimated_total is not None:
+            payload['estimated_total'] = self.estimated_total
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'estimated_total': {
+                    'type': 'object',
+                    'properties': {
+                        'value': {'type': 'integer'},
+                        'exact': {'type': 'boolean'},
+                    },
+                },
+                'results': schema,
+            },
+        }
+
+
+class ProductKeysetPagination(KeysetPagination):
+    """Keyset pagination over the product orderings exposed to clients"""
+
+    keyset_fields = ('created_at', 'price', 'rating', 'views')
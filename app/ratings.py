@@ -0,0 +1,111 @@
+"""
+Incremental product rating maintenance
+Each approved review adds its stars to Product.rating_total, review_count and
+the star histogram; the average is recomputed inside the same UPDATE, so no
+request ever aggregates over the review table
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+
+STARS = (1, 2, 3, 4, 5)
+
+
+def _histogram_field(stars):
+    return f'rating_{stars}_count'
+
+
+def apply_rating_delta(product_id, total_delta, count_delta, histogram_delta):
+    """Shift one product's running totals in a single atomic UPDATE"""
+    from .models import Product
+
+    new_total = F('rating_total') + total_delta
+    new_count = F('review_count') + count_delta
+    updates = {
+        'rating_total': new_total,
+        'review_count': new_count,
+        'rating': Coalesce(
+            Round(Cast(new_total, FloatField()) / NullIf(new_count, Value(0)), 2),
+            Value(0.0)
+        ),
+    }
+    for stars, delta in histogram_delta.items():
+        if delta:
+            field = _histogram_field(stars)
+            updates[field] = F(field) + delta
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def apply_review_change(previous, current):
+    """
+    Move a review's contribution from `previous` to `current`.
+
+    Both are (product_id, rating) tuples, or None when the review did not
+    count (not approved, not yet created, or deleted).
+    """
+    if previous == current:
+        return
+
+    deltas = {}
+    for contribution, sign in ((previous, -1), (current, 1)):
+        if contribution is None:
+            continue
+        product_id, stars = contribution
+        delta = deltas.setdefault(product_id, {'total': 0, 'count': 0, 'histogram': {}})
+        delta['total'] += sign * stars
+        delta['count'] += sign
+        delta['histogram'][stars] = delta['histogram'].get(stars, 0) + sign
+
+    with transaction.atomic():
+        for product_id, delta in deltas.items():
+            apply_rating_delta(product_id, delta['total'], delta['count'], delta['histogram'])
+
+
+def rebuild_ratings(chunk_size=1000):
+    """Recompute every product's rating fields from approved reviews, chunk by chunk"""
+    from .models import Product, Review
+
+    aggregates = {
+        'total': Sum('rating'),
+        'count': Count('id'),
+    }
+    for stars in STARS:
+        aggregates[_histogram_field(stars)] = Count('id', filter=Q(rating=stars))
+
+    fields = ['rating', 'rating_total', 'review_count'] + [_histogram_field(stars) for stars in STARS]
+    updated = 0
+    last_pk = None
+    while True:
+        products = Product.objects.order_by('pk')
+        if last_pk is not None:
+            products = products.filter(pk__gt=last_pk)
+        products = list(products.only('pk')[:chunk_size])
+        if not products:
+            return updated
+        last_pk = products[-1].pk
+
+        stats = {
+            row['product_id']: row
+            for row in Review.objects.filter(
+                is_approved=True, product__in=products
+            ).values('product_id').annotate(**aggregates).order_by()
+        }
+        for product in products:
+            row = stats.get(product.pk)
+            product.rating_total = row['total'] if row else 0
+            product.review_count = row['count'] if row else 0
+            product.rating = Decimal(0)
+            if product.review_count:
+                product.rating = (Decimal(product.rating_total) / product.review_count).quantize(
+                    Decimal('0.01'), rounding=ROUND_HALF_UP
+                )
+            for stars in STARS:
+                field = _histogram_field(stars)
+                setattr(product, field, row[field] if row else 0)
+
+        with transaction.atomic():
+            Product.objects.bulk_update(products, fields)
+        updated += len(products)
@@ -0,0 +1,187 @@
+"""
+Balance reconciliation
+Wallet ledger entries are streamed in keyset chunks, converted to integer
+units of 1e-8 in SQL and summed per (user, currency) with NumPy. The sums
+are compared with the wallet accounts' running balances and the Wallet
+columns. Work is split into user-id ranges that run in separate processes;
+each shard also lists completed transactions that never reached the ledger.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+import multiprocessing
+
+from django.conf import settings
+from django.db.models import BigIntegerField, Case, Exists, F, IntegerField, Max, Min, OuterRef, Value, When
+from django.db.models.functions import Cast, Round
+
+from .exchange_rates import BALANCE_FIELDS, CURRENCIES
+
+CHUNK_SIZE = getattr(settings, 'RECONCILIATION_CHUNK_SIZE', 50000)
+# Unposted transactions listed per shard; the count is always exact
+UNPOSTED_SAMPLE = 100
+
+# Every balance column has at most 8 decimal places
+SCALE = 10 ** 8
+
+
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError('NumPy is required for reconciliation (pip install numpy)')
+    return np
+
+
+def _units(field):
+    """`field` as an exact integer count of 1e-8 units"""
+    return Cast(Round(F(field) * SCALE), BigIntegerField())
+
+
+def _currency_index(field):
+    return Case(
+        *[When(**{field: currency}, then=Value(index)) for index, currency in enumerate(CURRENCIES)],
+        default=Value(-1), output_field=IntegerField(),
+    )
+
+
+def _chunks(queryset, columns, chunk_size):
+    """Yield (n, len(columns)) int64 arrays, walking the primary key"""
+    np = _numpy()
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(page.values_list('pk', *columns)[:chunk_size])
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield np.array([row[1:] for row in rows], dtype=np.int64).reshape(len(rows), len(columns))
+
+
+def _to_decimal(units):
+    return format(Decimal(int(units)).scaleb(-8), 'f')
+
+
+def user_id_shards(shards):
+    """Split the wallet user-id range into `shards` half-open [low, high) ranges"""
+    from .models import Wallet
+
+    bounds = Wallet.objects.aggregate(low=Min('user_id'), high=Max('user_id'))
+    low, high = bounds['low'], bounds['high']
+    if low is None:
+        return []
+    high += 1
+    step = max(1, -(-(high - low) // shards))
+    return [(start, min(start + step, high)) for start in range(low, high, step)]
+
+
+def ledger_opened_at():
+    """When opening balances were booked; earlier transactions are covered by them"""
+    from .models import LedgerEntry
+
+    return LedgerEntry.objects.filter(account__kind='opening').aggregate(opened=Min('created_at'))['opened']
+
+
+def unposted_transactions(low, high, opened_at=None):
+    """Completed transactions of users in [low, high) with no ledger entries"""
+    from .models import LedgerEntry, Transaction, TransactionArchive
+
+    posted = LedgerEntry.objects.filter(transaction_id=OuterRef('pk'), reversal=False)
+    found, count = [], 0
+    for model in (Transaction, TransactionArchive):
+        queryset = model.objects.filter(status='completed', user_id__gte=low, user_id__lt=high)
+        if opened_at:
+            queryset = queryset.filter(completed_at__gte=opened_at)
+        queryset = queryset.filter(~Exists(posted))
+        count += queryset.count()
+        found += [str(pk) for pk in queryset.values_list('pk', flat=True)[:UNPOSTED_SAMPLE - len(found)]]
+    return count, found
+
+
+def reconcile_shard(low, high, chunk_size=CHUNK_SIZE, opened_at=None):
+    """
+    Reconcile users with ids in [low, high).
+
+    Returns a dict with the rows scanned, the drifted (user, currency)
+    pairs and the unposted transactions.
+    """
+    from .models import LedgerAccount, LedgerEntry, Wallet
+
+    np = _numpy()
+    size = high - low
+    entries = np.zeros((size, len(CURRENCIES)), dtype=np.int64)
+    accounts = np.zeros_like(entries)
+    wallets = np.zeros_like(entries)
+    scanned = {'entries': 0, 'accounts': 0, 'wallets': 0}
+
+    in_range = dict(account__kind='wallet', account__user_id__gte=low, account__user_id__lt=high)
+    entry_rows = LedgerEntry.objects.filter(**in_range).annotate(
+        owner=F('account__user_id'), slot=_currency_index('account__currency'), units=_units('amount'),
+    )
+    for chunk in _chunks(entry_rows, ('owner', 'slot', 'units'), chunk_size):
+        np.add.at(entries, (chunk[:, 0] - low, chunk[:, 1]), chunk[:, 2])
+        scanned['entries'] += len(chunk)
+
+    account_rows = LedgerAccount.objects.filter(kind='wallet', user_id__gte=low, user_id__lt=high).annotate(
+        slot=_currency_index('currency'), units=_units('balance'),
+    )
+    for chunk in _chunks(account_rows, ('user_id', 'slot', 'units'), chunk_size):
+        accounts[chunk[:, 0] - low, chunk[:, 1]] = chunk[:, 2]
+        scanned['accounts'] += len(chunk)
+
+    wallet_rows = Wallet.objects.filter(user_id__gte=low, user_id__lt=high).annotate(
+        **{f'{field}_units': _units(field) for field in BALANCE_FIELDS}
+    )
+    present = np.zeros(size, dtype=bool)
+    for chunk in _chunks(wallet_rows, ['user_id'] + [f'{field}_units' for field in BALANCE_FIELDS], chunk_size):
+        wallets[chunk[:, 0] - low] = chunk[:, 1:]
+        present[chunk[:, 0] - low] = True
+        scanned['wallets'] += len(chunk)
+
+    # Entries are the source of truth; a user with entries but no wallet
+    # row shows up with a zero wallet balance
+    mismatched = (entries != accounts) | ((entries != wallets) & (present[:, None] | (entries != 0)))
+    drift = [
+        {
+            'user_id': int(row) + low,
+            'currency': CURRENCIES[column],
+            'entries_total': _to_decimal(entries[row, column]),
+            'ledger_balance': _to_decimal(accounts[row, column]),
+            'wallet_balance': _to_decimal(wallets[row, column]) if present[row] else None,
+        }
+        for row, column in zip(*np.nonzero(mismatched))
+    ]
+    unposted_count, unposted = unposted_transactions(low, high, opened_at)
+    return {
+        'shard': [low, high],
+        'scanned': scanned,
+        'drift': drift,
+        'unposted_count': unposted_count,
+        'unposted': unposted,
+    }
+
+
+def _run_shard(args):
+    return reconcile_shard(*args)
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def reconcile(shards, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Reconcile every wallet, `workers` shards at a time.
+
+    Shards run in spawned processes with their own database connections
+    when workers > 1. Returns the per-shard results in id order.
+    """
+    opened_at = ledger_opened_at()
+    jobs = [(low, high, chunk_size, opened_at) for low, high in user_id_shards(shards)]
+    if workers <= 1 or len(jobs) <= 1:
+        return [_run_shard(job) for job in jobs]
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        return list(pool.map(_run_shard, jobs))
@@ -0,0 +1,99 @@
+"""
+Deterministic referral codes
+A user's code is their id pushed through a keyed permutation of the
+8-character base-36 space and written out in base 36. A permutation never
+maps two ids to the same value, so a code can be inserted straight away
+with no lookup for collisions. The key keeps codes from being guessable
+from user ids; set REFERRAL_CODE_KEY and never change it, since existing
+codes stay as they are.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+CODE_LENGTH = 8
+DOMAIN = len(ALPHABET) ** CODE_LENGTH
+
+# Feistel network over 42 bits, the smallest even width covering DOMAIN;
+# values that land outside it are walked forward until they fit
+HALF_BITS = 21
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 6
+
+# Variants tried when a code is taken by one issued before codes were
+# derived (or with another key); each is a separate permutation
+MAX_VARIANTS = 8
+
+
+def _key():
+    key = getattr(settings, 'REFERRAL_CODE_KEY', None)
+    if key is None:
+        key = 'referral-codes:' + settings.SECRET_KEY
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return hashlib.sha256(key).digest()
+
+
+_round_key = None
+
+
+def _round(variant, index, half):
+    global _round_key
+    if _round_key is None:
+        _round_key = _key()
+    data = bytes((variant, index)) + half.to_bytes(3, 'big')
+    return int.from_bytes(hashlib.blake2b(data, key=_round_key, digest_size=3).digest(), 'big') & HALF_MASK
+
+
+def _feistel(value, variant):
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for index in range(ROUNDS):
+        left, right = right, left ^ _round(variant, index, right)
+    return (left << HALF_BITS) | right
+
+
+def permute(number, variant=0):
+    """Keyed bijection of range(DOMAIN) onto itself"""
+    if not 0 <= number < DOMAIN:
+        raise ValueError(f'Only {DOMAIN} distinct codes exist')
+    value = _feistel(number, variant)
+    while value >= DOMAIN:
+        # Cycle walking: the Feistel permutes 2**42 values, and repeating
+        # it from an out-of-range value always gets back into range
+        value = _feistel(value, variant)
+    return value
+
+
+def encode(number):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def code_for_user_id(user_id, variant=0):
+    """The referral code derived for `user_id`"""
+    return encode(permute(user_id, variant))
+
+
+def create_referral_code(user):
+    """
+    Insert `user`'s referral code; one INSERT in the normal case.
+
+    Falls back to the next variant only if a legacy random code already
+    took the derived value.
+    """
+    from .models import ReferralCode
+
+    for variant in range(MAX_VARIANTS):
+        try:
+            with transaction.atomic():
+                return ReferralCode.objects.create(user=user, code=code_for_user_id(user.pk, variant))
+        except IntegrityError:
+            if ReferralCode.objects.filter(user=user).exists():
+                raise
+    raise IntegrityError(f'No free referral code for user {user.pk}')
@@ -0,0 +1,492 @@
+"""
+Referral attribution and qualification
+New users who register with a code are attributed to its owner through
+attribute_referral(). Posting a completed deposit queues a ReferralEvaluation for each pending
+referral of the depositor. A worker drains the queue in chunks: it adds
+the deposits to the referrals' running deposit_amount, qualifies the ones
+that reach the active program's minimum before they expire, creates and
+posts both bonus transactions in bulk, and moves the referral codes'
+total_uses and total_earnings counters, all in one database transaction
+per chunk. Qualified referrals whose bonuses the ledger rejected are paid
+later by retry_unpaid_bonuses(). Referrals still pending when they expire are swept in bounded
+batches by expire_referrals().
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .exchange_rates import to_usd
+from .ledger import LedgerError, post_transactions
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'REFERRAL_EVALUATION_BATCH_SIZE', 500)
+EXPIRY_BATCH_SIZE = getattr(settings, 'REFERRAL_EXPIRY_BATCH_SIZE', 1000)
+CODE_CACHE_SIZE = getattr(settings, 'REFERRAL_CODE_CACHE_SIZE', 10000)
+CODE_CACHE_TTL = getattr(settings, 'REFERRAL_CODE_CACHE_TTL', 300)
+BONUS_CURRENCY = 'USD'
+
+# Referrals counted in ReferralCode.total_uses
+COUNTED_STATUSES = ('qualified', 'paid')
+
+REFERRAL_UPDATE_FIELDS = [
+    'status', 'deposit_amount', 'qualified_at', 'paid_at', 'referrer_reward', 'referee_reward',
+    'referrer_transaction', 'referee_transaction', 'updated_at',
+]
+
+
+@dataclass
+class EvaluationStats:
+    evaluated: int = 0
+    qualified: int = 0
+    paid: int = 0
+    bonus_transactions: int = 0
+
+
+@dataclass
+class ExpiryStats:
+    batches: int = 0
+    expired: int = 0
+    notified: int = 0
+
+
+class ReferralCodeCache:
+    """
+    Thread-safe, process-wide LRU of code -> (code id, owner id).
+
+    Only codes that exist are cached, so made-up codes cannot push the
+    popular ones out. A stale entry is harmless: attribution re-checks the
+    code row in its UPDATE.
+    """
+
+    def __init__(self, size=CODE_CACHE_SIZE, ttl=CODE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, code):
+        from .models import ReferralCode
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None and now - entry[2] < self.ttl:
+                self._entries.move_to_end(code)
+                return entry[:2]
+        row = ReferralCode.objects.filter(code=code, is_active=True).values_list('pk', 'user_id').first()
+        with self._lock:
+            if row is None:
+                self._entries.pop(code, None)
+                return None
+            self._entries[code] = (*row, now)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return row
+
+    def invalidate(self, code=None):
+        with self._lock:
+            if code is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(code, None)
+
+
+code_cache = ReferralCodeCache()
+
+
+def attribute_referral(user, code):
+    """
+    Record that the newly registered `user` signed up with `code`.
+
+    Call inside the registration transaction. Resolves the code through
+    code_cache, then reserves a place under the program's
+    max_referrals_per_user with one conditional UPDATE of the code's
+    signups counter and creates the Referral. Returns the Referral, or
+    None for an unknown, inactive or full code, or when no program is
+    running.
+    """
+    from .models import Referral, ReferralCode, ReferralProgram
+
+    resolved = code_cache.get(code.strip().upper())
+    if resolved is None:
+        return None
+    code_id, referrer_id = resolved
+    if referrer_id == user.pk:
+        return None
+    now = timezone.now()
+    program = ReferralProgram.get_active_program()
+    if not program_is_open(program, now):
+        return None
+    with transaction.atomic():
+        reserved = ReferralCode.objects.filter(
+            pk=code_id, is_active=True, signups__lt=program.max_referrals_per_user
+        ).update(signups=F('signups') + 1)
+        if not reserved:
+            return None
+        return Referral.objects.create(
+            referrer_id=referrer_id, referee=user, referral_code_id=code_id,
+            expires_at=now + timedelta(days=program.expiry_days),
+        )
+
+
+def enqueue_evaluations(transactions):
+    """Queue the completed deposits among `transactions` for their referrals"""
+    from .models import Referral, ReferralEvaluation
+
+    deposits = [txn for txn in transactions if txn.transaction_type == 'deposit']
+    if not deposits:
+        return
+    pending = defaultdict(list)
+    for referee_id, referral_id in Referral.objects.filter(
+        referee_id__in={txn.user_id for txn in deposits}, status='pending'
+    ).values_list('referee_id', 'pk'):
+        pending[referee_id].append(referral_id)
+    if not pending:
+        return
+    now = timezone.now()
+    ReferralEvaluation.objects.bulk_create([
+        ReferralEvaluation(
+            referral_id=referral_id, transaction_id=txn.pk,
+            deposit_usd=to_usd(txn.amount, txn.currency), deposited_at=txn.completed_at or now,
+        )
+        for txn in deposits
+        for referral_id in pending.get(txn.user_id, ())
+    ])
+
+
+def program_is_open(program, moment):
+    if program is None or not program.is_active or program.start_date > moment:
+        return False
+    return program.end_date is None or program.end_date > moment
+
+
+def _bonus(user_id, amount, description):
+    from .models import Transaction
+
+    return Transaction(
+        user_id=user_id, transaction_type='referral_bonus', status='completed',
+        amount=amount, currency=BONUS_CURRENCY, description=description,
+        completed_at=timezone.now(),
+    )
+
+
+def _pay(payouts):
+    """
+    Create and post the bonus transactions of `payouts`, [(referral, [txn])].
+
+    Tries the whole chunk at once; if the ledger rejects it, pays referral
+    by referral so one bad wallet does not hold up the rest. Returns the
+    referrals whose bonuses were posted.
+    """
+    from .models import Transaction
+
+    def create_and_post(batch):
+        bonuses = [txn for _, txns in batch for txn in txns]
+        with transaction.atomic():
+            Transaction.objects.bulk_create(bonuses)
+            post_transactions(bonuses)
+
+    try:
+        create_and_post(payouts)
+        return [referral for referral, _ in payouts]
+    except LedgerError:
+        pass
+    paid = []
+    for referral, txns in payouts:
+        try:
+            create_and_post([(referral, txns)])
+            paid.append(referral)
+        except LedgerError as e:
+            logger.warning('Referral %s qualified but its bonus was rejected by the ledger: %s', referral.pk, e)
+    return paid
+
+
+def _bonuses(referral):
+    """Build the bonus transactions of a qualified referral and link them to it"""
+    txns = []
+    if referral.referrer_reward > 0:
+        referral.referrer_transaction = _bonus(
+            referral.referrer_id, referral.referrer_reward,
+            f'Referral bonus for inviting {referral.referee.username}',
+        )
+        txns.append(referral.referrer_transaction)
+    if referral.referee_reward > 0:
+        referral.referee_transaction = _bonus(
+            referral.referee_id, referral.referee_reward,
+            f'Welcome bonus for joining with {referral.referrer.username}\'s code',
+        )
+        txns.append(referral.referee_transaction)
+    return txns
+
+
+def _settle(payouts, now):
+    """
+    Pay `payouts` and mark the referrals that were paid.
+
+    Returns (referrer earnings per code, bonus transactions per user) for
+    the counters the caller moves.
+    """
+    earnings = defaultdict(Decimal)
+    created = defaultdict(int)
+    for referral in _pay(payouts):
+        referral.status = 'paid'
+        referral.paid_at = now
+        earnings[referral.referral_code_id] += referral.referrer_reward
+        for txn in (referral.referrer_transaction, referral.referee_transaction):
+            if txn is not None:
+                created[txn.user_id] += 1
+    for referral, _ in payouts:
+        if referral.status != 'paid':
+            # Not posted: keep it qualified, without dangling links
+            referral.referrer_transaction = referral.referee_transaction = None
+    return earnings, created
+
+
+def evaluate_batch(batch_size=BATCH_SIZE):
+    """Evaluate up to `batch_size` queued deposits; returns EvaluationStats"""
+    from .models import Referral, ReferralCode, ReferralEvaluation, ReferralProgram
+    from .wallet_summary import adjust_transaction_count
+
+    stats = EvaluationStats()
+    with transaction.atomic():
+        queue = ReferralEvaluation.objects.order_by('pk')
+        if connection.features.has_select_for_update_skip_locked:
+            queue = queue.select_for_update(skip_locked=True)
+        evaluations = list(queue[:batch_size])
+        if not evaluations:
+            return stats
+        stats.evaluated = len(evaluations)
+
+        referrals = {
+            referral.pk: referral
+            for referral in Referral.objects.select_for_update().filter(
+                pk__in={evaluation.referral_id for evaluation in evaluations}, status='pending'
+            ).select_related('referrer', 'referee')
+        }
+        codes = {
+            code.pk: code
+            for code in ReferralCode.objects.select_for_update().filter(
+                pk__in={referral.referral_code_id for referral in referrals.values()}
+            ).order_by('pk')
+        }
+        now = timezone.now()
+        program = ReferralProgram.get_active_program()
+        is_open = program_is_open(program, now)
+
+        changed = {}
+        for evaluation in evaluations:
+            referral = referrals.get(evaluation.referral_id)
+            # Deposits made after the referral lapsed do not count
+            if referral is None or evaluation.deposited_at > referral.expires_at:
+                continue
+            referral.deposit_amount = Decimal(referral.deposit_amount) + evaluation.deposit_usd
+            referral.updated_at = now
+            changed[referral.pk] = referral
+
+        uses = defaultdict(int)
+        payouts = []
+        for referral in changed.values():
+            if not is_open or referral.deposit_amount < program.minimum_deposit_usd:
+                continue
+            code = codes[referral.referral_code_id]
+            if code.total_uses + uses[code.pk] >= program.max_referrals_per_user:
+                continue
+            uses[code.pk] += 1
+            referral.status = 'qualified'
+            referral.qualified_at = now
+            referral.referrer_reward = program.referrer_bonus_usd
+            referral.referee_reward = program.referee_bonus_usd
+            stats.qualified += 1
+            payouts.append((referral, _bonuses(referral)))
+
+        earnings, created = _settle(payouts, now)
+        stats.paid = sum(1 for referral, _ in payouts if referral.status == 'paid')
+
+        Referral.objects.bulk_update(changed.values(), REFERRAL_UPDATE_FIELDS, batch_size=BATCH_SIZE)
+        for code_id in uses.keys() | earnings.keys():
+            ReferralCode.objects.filter(pk=code_id).update(
+                total_uses=F('total_uses') + uses[code_id],
+                total_earnings=F('total_earnings') + earnings[code_id],
+            )
+        # bulk_create sends no post_save, so count the bonuses here
+        for user_id, count in created.items():
+            adjust_transaction_count(user_id, count)
+        stats.bonus_transactions = sum(created.values())
+
+        ReferralEvaluation.objects.filter(pk__in=[evaluation.pk for evaluation in evaluations]).delete()
+    return stats
+
+
+def retry_unpaid_bonuses(batch_size=BATCH_SIZE):
+    """
+    Pay up to `batch_size` qualified referrals whose bonuses the ledger
+    rejected earlier; returns EvaluationStats with paid and
+    bonus_transactions set.
+
+    Such referrals keep their rewards but have no bonus transactions. They
+    already count in total_uses, so only total_earnings moves.
+    """
+    from .models import Referral, ReferralCode
+    from .wallet_summary import adjust_transaction_count
+
+    stats = EvaluationStats()
+    with transaction.atomic():
+        unpaid = Referral.objects.filter(
+            status='qualified', referrer_transaction__isnull=True, referee_transaction__isnull=True
+        ).order_by('qualified_at')
+        if connection.features.has_select_for_update_skip_locked:
+            unpaid = unpaid.select_for_update(skip_locked=True, of=('self',))
+        referrals = list(unpaid.select_related('referrer', 'referee')[:batch_size])
+        if not referrals:
+            return stats
+
+        now = timezone.now()
+        payouts = [(referral, _bonuses(referral)) for referral in referrals]
+        earnings, created = _settle(payouts, now)
+        paid = [referral for referral in referrals if referral.status == 'paid']
+        for referral in paid:
+            referral.updated_at = now
+        stats.paid = len(paid)
+
+        Referral.objects.bulk_update(paid, REFERRAL_UPDATE_FIELDS, batch_size=BATCH_SIZE)
+        for code_id, amount in earnings.items():
+            ReferralCode.objects.filter(pk=code_id).update(total_earnings=F('total_earnings') + amount)
+        for user_id, count in created.items():
+            adjust_transaction_count(user_id, count)
+        stats.bonus_transactions = sum(created.values())
+    return stats
+
+
+def _expected_counters(referral_model=None):
+    """signups, total_uses and total_earnings per code, computed from the referrals"""
+    from .models import Referral
+
+    referrals = (referral_model or Referral).objects.filter(
+        referral_code=OuterRef('pk')
+    ).order_by().values('referral_code')
+    signups = referrals.annotate(n=Count('pk')).values('n')
+    uses = referrals.filter(status__in=COUNTED_STATUSES).annotate(n=Count('pk')).values('n')
+    earnings = referrals.filter(status='paid').annotate(total=Sum('referrer_reward')).values('total')
+    money = DecimalField(max_digits=10, decimal_places=2)
+    return {
+        'expected_signups': Coalesce(Subquery(signups), Value(0)),
+        'expected_uses': Coalesce(Subquery(uses), Value(0)),
+        'expected_earnings': Coalesce(Subquery(earnings, output_field=money), Value(Decimal('0')), output_field=money),
+    }
+
+
+def rebuild_referral_counters(chunk_size=5000, code_model=None, referral_model=None):
+    """
+    Recompute ReferralCode.signups, total_uses and total_earnings in SQL.
+
+    Works through the codes in primary-key ranges, one UPDATE ... SET
+    col = (subquery) per range, so no lock is held for the whole table.
+    Migrations pass their historical models. Returns (codes checked, codes
+    whose counters had drifted).
+    """
+    from .models import ReferralCode
+
+    codes = (code_model or ReferralCode).objects
+    checked = drifted = 0
+    last = 0
+    while True:
+        ids = list(codes.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return checked, drifted
+        last = ids[-1]
+        with transaction.atomic():
+            chunk = codes.select_for_update().filter(pk__in=ids)
+            expected = _expected_counters(referral_model)
+            drifted += chunk.annotate(**expected).filter(
+                ~Q(signups=F('expected_signups'))
+                | ~Q(total_uses=F('expected_uses'))
+                | ~Q(total_earnings=F('expected_earnings'))
+            ).count()
+            chunk.update(
+                signups=expected['expected_signups'],
+                total_uses=expected['expected_uses'],
+                total_earnings=expected['expected_earnings'],
+            )
+        checked += len(ids)
+
+
+def _expiry_notifications(rows):
+    """Notifications for both sides of each expired referral"""
+    from .models import Notification
+
+    notifications = []
+    for _, referrer_id, referee_id, referrer_name, referee_name in rows:
+        notifications.append(Notification(
+            user_id=referrer_id, notification_type='referral', title='Referral expired',
+            message=f'{referee_name} did not make a qualifying deposit in time, so this referral has expired.',
+        ))
+        notifications.append(Notification(
+            user_id=referee_id, notification_type='referral', title='Referral offer expired',
+            message=f'The sign-up bonus from {referrer_name}\'s referral has expired.',
+        ))
+    return notifications
+
+
+def expire_batch(now=None, batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Expire up to `batch_size` pending referrals past expires_at.
+
+    The oldest are taken from the (status, expires_at) index and flipped
+    with one UPDATE, and both users of each referral the UPDATE changed are
+    notified with one bulk insert, all in a short transaction. Referrals
+    with deposits still queued for evaluation are skipped until the queue
+    has been drained. Returns (expired, notified).
+    """
+    from .models import Notification, Referral, ReferralEvaluation
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        # A referral with a queued deposit is left to the evaluation worker:
+        # the deposit may predate expires_at and qualify it
+        due = Referral.objects.filter(
+            ~Exists(ReferralEvaluation.objects.filter(referral=OuterRef('pk'))),
+            status='pending', expires_at__lt=now,
+        ).order_by('expires_at')
+        rows = list(due.select_for_update(of=('self',)).values_list(
+            'pk', 'referrer_id', 'referee_id', 'referrer__username', 'referee__username'
+        )[:batch_size])
+        if not rows:
+            return 0, 0
+        ids = [row[0] for row in rows]
+        expired = Referral.objects.filter(pk__in=ids, status='pending').update(status='expired', updated_at=now)
+        # A referral that qualified after it was read is left out of the
+        # UPDATE; notify only the ones it changed
+        changed = set(
+            Referral.objects.filter(pk__in=ids, status='expired', updated_at=now).values_list('pk', flat=True)
+        )
+        notifications = Notification.objects.bulk_create(
+            _expiry_notifications([row for row in rows if row[0] in changed])
+        )
+    return expired, len(notifications)
+
+
+def expire_referrals(now=None, batch_size=EXPIRY_BATCH_SIZE, max_batches=None):
+    """Sweep every expired pending referral, a batch at a time; returns ExpiryStats"""
+    now = now or timezone.now()
+    stats = ExpiryStats()
+    while max_batches is None or stats.batches < max_batches:
+        expired, notified = expire_batch(now, batch_size)
+        if not expired:
+            break
+        stats.batches += 1
+        stats.expired += expired
+        stats.notified += notified
+    return stats
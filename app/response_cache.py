@@ -0,0 +1,154 @@
+"""
+Tag-invalidated response cache for read-heavy public endpoints
+Entries are keyed by normalized request parameters plus the current version
+of every tag they depend on; invalidating a tag bumps its version so all
+dependent entries are skipped and age out on their own.
+
+Versions and build locks live in the default cache, which must be shared
+by all worker processes (the database cache in settings, or Redis or
+Memcached). With a per-process LocMemCache an invalidation only reaches
+the process that made it, and each process builds its own copy.
+check_shared_cache() reports that configuration as a system check error.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+CACHE_TIMEOUT = getattr(settings, 'MARKETPLACE_CACHE_TIMEOUT', 300)
+LOCK_TIMEOUT = 10
+LOCK_WAIT_INTERVAL = 0.05
+LOCK_WAIT_ATTEMPTS = 40
+
+ALL_CATEGORIES = '*'
+
+# Backends whose entries are private to one process
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Query parameters that change the marketplace response
+MARKETPLACE_PARAMS = (
+    'category', 'min_price', 'max_price', 'condition', 'featured', 'search',
+    'ordering', 'page', 'page_size', 'cursor', 'include_total', 'tags', 'tags_mode', 'facets',
+)
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """System check: tag invalidation needs a cache shared by all workers"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', PROCESS_LOCAL_BACKENDS[0])
+    if backend not in PROCESS_LOCAL_BACKENDS:
+        return []
+    message = f'The default cache ({backend}) is private to each process.'
+    hint = 'Configure a shared CACHES backend (database, Redis or Memcached).'
+    try:
+        workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    except ValueError:
+        workers = 1
+    if workers > 1:
+        return [checks.Error(
+            message + ' Invalidations in one worker leave stale marketplace responses in the others.',
+            hint=hint, id='app.E001',
+        )]
+    return [checks.Warning(message + ' Only a single worker process is safe.', hint=hint, id='app.W001')]
+
+
+def _tag_key(tag):
+    return f'tag-version:{tag}'
+
+
+def get_tag_versions(tags):
+    """Current version for each tag, initializing missing ones"""
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions = cache.get_many(keys.keys())
+    for key in keys:
+        if key not in versions:
+            # Seed from the clock so a tag evicted from the cache never
+            # comes back at a version an old entry was built with
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in sorted(keys)]
+
+
+def invalidate_tags(*tags):
+    """Bump tag versions, orphaning every cached entry that depends on them"""
+    for tag in set(tags):
+        key = _tag_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def category_tag(category):
+    return f'marketplace:category:{category}'
+
+
+def invalidate_product_categories(*categories):
+    """Evict marketplace pages for the given categories and the unfiltered pages"""
+    tags = [category_tag(category) for category in categories if category]
+    invalidate_tags(category_tag(ALL_CATEGORIES), *tags)
+
+
+def normalize_marketplace_params(request):
+    params = {}
+    for name in MARKETPLACE_PARAMS:
+        value = request.query_params.get(name)
+        if value in (None, ''):
+            continue
+        if name == 'search':
+            value = ' '.join(value.lower().split())
+        elif name == 'tags':
+            from .tags import parse_tag_param
+            value = ','.join(sorted(parse_tag_param(value)))
+        params[name] = value
+    params['host'] = request.get_host()
+    return params
+
+
+def marketplace_tags(params):
+    # Facet counts span every category, so any product change affects them
+    if params.get('facets') == 'true':
+        return [category_tag(ALL_CATEGORIES)]
+    return [category_tag(params.get('category', ALL_CATEGORIES))]
+
+
+def get_or_build(namespace, params, tags, build, timeout=CACHE_TIMEOUT):
+    """
+    Return the cached value for (params, tags) or build and store it.
+
+    Concurrent misses for the same key are collapsed: one caller takes a
+    short lock and builds, the rest poll for its result before falling
+    back to building themselves.
+    """
+    versions = get_tag_versions(tags)
+    digest = hashlib.sha256(
+        json.dumps([params, versions], sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    key = f'{namespace}:{digest}'
+
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        for _ in range(LOCK_WAIT_ATTEMPTS):
+            time.sleep(LOCK_WAIT_INTERVAL)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        return build()
+
+    try:
+        value = build()
+        cache.set(key, value, timeout=timeout)
+    finally:
+        cache.delete(lock_key)
+    return value
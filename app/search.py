@@ -0,0 +1,145 @@
+"""
+Full-text product search backed by an SQLite FTS5 index
+Keeps app_product_fts in sync with Product rows and ranks matches with BM25
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+from rest_framework.filters import BaseFilterBackend
+
+FTS_TABLE = 'app_product_fts'
+
+# BM25 column weights: product_id (unindexed), title, description, tags
+BM25_WEIGHTS = (0.0, 10.0, 1.0, 5.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+CREATE_INDEX_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "product_id UNINDEXED, title, description, tags, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+DROP_INDEX_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+
+def is_available():
+    """FTS5 is only used on SQLite; other backends fall back to icontains"""
+    return connection.vendor == 'sqlite'
+
+
+def _tags_text(tags):
+    if isinstance(tags, (list, tuple)):
+        return ' '.join(str(tag) for tag in tags)
+    return str(tags or '')
+
+
+def build_match_query(search):
+    """Turn free text into an FTS5 query: every term must match, as a prefix"""
+    terms = TOKEN_RE.findall(search or '')
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def index_product(product):
+    """Insert or replace the index row for a product"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE product_id = %s", [product.pk.hex])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (product_id, title, description, tags) VALUES (%s, %s, %s, %s)",
+            [product.pk.hex, product.title, product.description, _tags_text(product.tags)]
+        )
+
+
+def remove_product(product_id):
+    """Drop a product from the index"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE product_id = %s", [product_id.hex])
+
+
+def rebuild_index(chunk_size=2000):
+    """Recreate the whole index from the product table, chunk by chunk"""
+    from .models import Product
+
+    if not is_available():
+        return 0
+
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(DROP_INDEX_SQL)
+        cursor.execute(CREATE_INDEX_SQL)
+        rows = Product.objects.values_list('id', 'title', 'description', 'tags').order_by()
+        batch = []
+        for product_id, title, description, tags in rows.iterator(chunk_size=chunk_size):
+            batch.append((product_id.hex, title, description, _tags_text(tags)))
+            if len(batch) >= chunk_size:
+                cursor.executemany(
+                    f"INSERT INTO {FTS_TABLE} (product_id, title, description, tags) VALUES (%s, %s, %s, %s)",
+                    batch
+                )
+                total += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (product_id, title, description, tags) VALUES (%s, %s, %s, %s)",
+                batch
+            )
+            total += len(batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def search_products(queryset, search, rank_order=True):
+    """
+    Restrict a Product queryset to full-text matches for `search`.
+
+    Joins the FTS table so SQLite drives the query from the index, and
+    annotates `search_rank` (lower is better). When `rank_order` is set the
+    result is ordered by relevance.
+    """
+    match = build_match_query(search)
+    if not match:
+        return queryset
+
+    if not is_available():
+        return queryset.filter(
+            Q(title__icontains=search) |
+            Q(description__icontains=search) |
+            Q(tags__icontains=search)
+        )
+
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    queryset = queryset.extra(
+        tables=[FTS_TABLE],
+        where=[
+            f"{FTS_TABLE}.product_id = app_product.id",
+            f"{FTS_TABLE} MATCH %s",
+        ],
+        params=[match],
+        select={'search_rank': f"bm25({FTS_TABLE}, {weights})"},
+    )
+    if rank_order:
+        queryset = queryset.order_by('search_rank', '-created_at')
+    return queryset
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    `search` query parameter backed by the FTS index.
+
+    Place after OrderingFilter: results are ranked by relevance unless the
+    client asked for an explicit `ordering`.
+    """
+
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        search = request.query_params.get(self.search_param, '')
+        if not search.strip():
+            return queryset
+        rank_order = 'ordering' not in request.query_params
+        return search_products(queryset, search, rank_order=rank_order)
@@ -5,13 +5,18 @@ Handles data serialization/deserialization for all app models
 
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Value, CharField
+from django.db.models.functions import Coalesce, Concat, NullIf, Trim
 from decimal import Decimal
 from .models import (
     UserProfile, Wallet, Transaction, ReferralProgram, ReferralCode, Referral,
     MerchantApplication, Product, ProductImage, ProductSubmission,
     Purchase, Review, Notification, Wishlist, UserActivity,
-    MarketplaceSettings, SystemSettings
+    MarketplaceSettings, SystemSettings, WalletSummary
 )
+from .referrals import attribute_referral
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -66,111 +71,100 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
     
-    def get_referral_code(self, obj):
-        """Get user's referral code"""
+    def _referral_code(self, obj):
+        """The user's ReferralCode; profile querysets select_related it"""
         try:
-            return obj.user.referral_code.code
-        except:
+            return obj.user.referral_code
+        except ReferralCode.DoesNotExist:
             return None
     
+    def get_referral_code(self, obj):
+        """Get user's referral code"""
+        code = self._referral_code(obj)
+        return code.code if code else None
+    
     def get_referral_earnings(self, obj):
-        """Calculate total referral earnings"""
-        referrals = Referral.objects.filter(referrer=obj.user, status='paid')
-        return float(sum(r.referrer_reward for r in referrals))
+        """Paid referrer bonuses, counted on ReferralCode.total_earnings"""
+        code = self._referral_code(obj)
+        return float(code.total_earnings) if code else 0.0
     
     def get_total_referrals(self, obj):
-        """Get total number of referrals"""
-        return Referral.objects.filter(referrer=obj.user, status__in=['qualified', 'paid']).count()
+        """Qualified and paid referrals, counted on ReferralCode.total_uses"""
+        code = self._referral_code(obj)
+        return code.total_uses if code else 0
 
 
 class WalletSerializer(serializers.ModelSerializer):
     """Serializer for Wallet model"""
-    user_profile = UserProfileSerializer(read_only=True)
     total_balance_usd = serializers.SerializerMethodField()
     
     class Meta:
         model = Wallet
         fields = [
-            'id', 'user_profile', 'balance_usd', 'balance_ngn', 'total_transactions',
-            'total_earned', 'total_spent', 'is_frozen', 'last_transaction_at',
+            'id', 'usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance',
+            'is_frozen', 'daily_withdrawal_limit', 'monthly_withdrawal_limit',
             'total_balance_usd', 'created_at', 'updated_at'
         ]
-        read_only_fields = [
-            'id', 'total_transactions', 'total_earned', 'total_spent',
-            'last_transaction_at', 'total_balance_usd', 'created_at', 'updated_at'
-        ]
+        read_only_fields = fields
     
     def get_total_balance_usd(self, obj):
-        """Calculate total balance in USD (including NGN converted)"""
-        system_settings = SystemSettings.objects.first()
-        exchange_rate = system_settings.exchange_rate_usd_to_ngn if system_settings else Decimal('1500.00')
-        ngn_in_usd = obj.balance_ngn / exchange_rate
-        return float(obj.balance_usd + ngn_in_usd)
+        """Calculate total balance in USD"""
+        return obj.get_total_balance_usd()
 
 
 class TransactionSerializer(serializers.ModelSerializer):
     """Serializer for Transaction model"""
-    wallet = WalletSerializer(read_only=True)
+    recipient = serializers.SlugRelatedField(slug_field='username', read_only=True)
     
     class Meta:
         model = Transaction
         fields = [
-            'id', 'wallet', 'transaction_type', 'amount', 'currency', 'description',
-            'reference_id', 'status', 'payment_method', 'external_reference',
-            'fees', 'exchange_rate', 'created_at', 'updated_at'
+            'id', 'transaction_type', 'amount', 'currency', 'description',
+            'reference', 'status', 'payment_method', 'external_reference',
+            'recipient', 'fee_amount', 'network_fee', 'created_at', 'updated_at',
+            'completed_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'completed_at']
 
 
 class ReferralProgramSerializer(serializers.ModelSerializer):
     """Serializer for ReferralProgram model"""
-    active_referrals = serializers.SerializerMethodField()
     
     class Meta:
         model = ReferralProgram
         fields = [
-            'id', 'name', 'description', 'referrer_reward', 'referee_reward',
-            'currency', 'minimum_purchase', 'maximum_rewards', 'is_active',
-            'start_date', 'end_date', 'active_referrals', 'created_at', 'updated_at'
+            'id', 'name', 'is_active', 'referrer_bonus_usd', 'referee_bonus_usd',
+            'minimum_deposit_usd', 'max_referrals_per_user', 'expiry_days',
+            'start_date', 'end_date', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'active_referrals', 'created_at', 'updated_at']
-    
-    def get_active_referrals(self, obj):
-        """Get count of active referrals for this program"""
-        return Referral.objects.filter(program=obj, is_active=True).count()
+        read_only_fields = fields
 
 
 class ReferralCodeSerializer(serializers.ModelSerializer):
     """Serializer for ReferralCode model"""
     user = UserSerializer(read_only=True)
-    program = ReferralProgramSerializer(read_only=True)
     
     class Meta:
         model = ReferralCode
         fields = [
-            'id', 'user', 'program', 'code', 'usage_count', 'max_uses',
-            'is_active', 'expires_at', 'created_at', 'updated_at'
+            'id', 'user', 'code', 'total_uses', 'total_earnings', 'is_active', 'created_at'
         ]
-        read_only_fields = ['id', 'code', 'usage_count', 'created_at', 'updated_at']
+        read_only_fields = fields
 
 
 class ReferralSerializer(serializers.ModelSerializer):
     """Serializer for Referral model"""
-    referrer = UserSerializer(read_only=True)
-    referee = UserSerializer(read_only=True)
-    program = ReferralProgramSerializer(read_only=True)
-    referral_code = ReferralCodeSerializer(read_only=True)
+    referrer = serializers.SlugRelatedField(slug_field='username', read_only=True)
+    referee = serializers.SlugRelatedField(slug_field='username', read_only=True)
     
     class Meta:
         model = Referral
         fields = [
-            'id', 'referrer', 'referee', 'program', 'referral_code',
-            'referrer_reward', 'referee_reward', 'currency', 'is_active',
-            'completed_at', 'total_earned', 'created_at', 'updated_at'
-        ]
-        read_only_fields = [
-            'id', 'total_earned', 'completed_at', 'created_at', 'updated_at'
+            'id', 'referrer', 'referee', 'status', 'deposit_amount',
+            'referrer_reward', 'referee_reward', 'expires_at', 'qualified_at',
+            'paid_at', 'created_at', 'updated_at'
         ]
+        read_only_fields = fields
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -210,6 +204,7 @@ class ProductSerializer(serializers.ModelSerializer):
     merchant_application = MerchantApplicationSerializer(read_only=True)
     reviewed_by = UserSerializer(read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
+    rating_histogram = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
@@ -217,7 +212,7 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'seller', 'merchant_application', 'title', 'description',
             'category', 'subcategory', 'price', 'original_price', 'condition',
             'tags', 'specifications', 'in_stock', 'stock_count', 'location',
-            'rating', 'review_count', 'views', 'saves', 'status', 'submitted_at',
+            'rating', 'review_count', 'rating_histogram', 'views', 'saves', 'status', 'submitted_at',
             'approved_at', 'rejected_at', 'admin_notes', 'reviewed_by',
             'featured', 'seller_verified', 'images', 'created_at', 'updated_at'
         ]
@@ -227,6 +222,51 @@ class ProductSerializer(serializers.ModelSerializer):
             'admin_notes', 'reviewed_by', 'featured', 'seller_verified', 'images',
             'created_at', 'updated_at'
         ]
+    
+    def get_rating_histogram(self, obj):
+        """Approved review counts per star"""
+        return obj.get_rating_histogram()
+
+
+# Columns fetched for product cards; created_at and views ride along so
+# keyset pagination can read the sort key without touching the model
+PRODUCT_CARD_FIELDS = ['id', 'title', 'price', 'rating', 'thumbnail', 'seller_name', 'created_at', 'views']
+
+
+def product_card_queryset(queryset):
+    """Project a Product queryset down to the columns a product card needs"""
+    thumbnail = ProductImage.objects.filter(
+        product=OuterRef('pk')
+    ).order_by('order', 'created_at').values('image')[:1]
+    full_name = Trim(Concat('seller__first_name', Value(' '), 'seller__last_name'))
+    seller_name = Coalesce(
+        NullIf('merchant_application__business_name', Value('')),
+        NullIf(full_name, Value('')),
+        'seller__username',
+        output_field=CharField()
+    )
+    return queryset.select_related(None).prefetch_related(None).annotate(
+        thumbnail=Subquery(thumbnail),
+        seller_name=seller_name,
+    ).values(*PRODUCT_CARD_FIELDS)
+
+
+class ProductCardSerializer(serializers.Serializer):
+    """Lightweight product representation for list views, built from product_card_queryset rows"""
+    id = serializers.UUIDField(read_only=True)
+    title = serializers.CharField(read_only=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+    seller_name = serializers.CharField(read_only=True)
+    
+    def get_thumbnail(self, obj):
+        """Resolve the stored image path to a URL"""
+        if not obj['thumbnail']:
+            return None
+        url = default_storage.url(obj['thumbnail'])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
 
 
 class ProductSubmissionSerializer(serializers.ModelSerializer):
@@ -320,8 +360,8 @@ class UserActivitySerializer(serializers.ModelSerializer):
     class Meta:
         model = UserActivity
         fields = [
-            'id', 'user', 'activity_type', 'description', 'ip_address',
-            'user_agent', 'metadata', 'created_at'
+            'id', 'user', 'activity_type', 'description', 'related_product',
+            'related_transaction', 'ip_address', 'user_agent', 'created_at'
         ]
         read_only_fields = ['id', 'user', 'created_at']
 
@@ -384,25 +424,20 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         referral_code = validated_data.pop('referral_code', None)
         password = validated_data.pop('password')
         
-        # Create user with hashed password
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            first_name=validated_data.get('first_name', ''),
-            last_name=validated_data.get('last_name', ''),
-            password=password
-        )
-        
-        # Handle referral code if provided (signals will create profile automatically)
-        if referral_code:
-            try:
-                referrer_profile = UserProfile.objects.get(referral_code=referral_code)
-                # Update the profile created by signals with referral info
-                profile = user.profile
-                profile.referred_by = referrer_profile.user
-                profile.save()
-            except UserProfile.DoesNotExist:
-                pass  # Invalid referral code, just ignore
+        with transaction.atomic():
+            # Create user with hashed password (signals add the profile,
+            # wallet and referral code)
+            user = User.objects.create_user(
+                username=validated_data['username'],
+                email=validated_data['email'],
+                first_name=validated_data.get('first_name', ''),
+                last_name=validated_data.get('last_name', ''),
+                password=password
+            )
+            
+            # An unknown or exhausted referral code does not block signing up
+            if referral_code:
+                attribute_referral(user, referral_code)
         
         return user
 
@@ -464,25 +499,13 @@ class ProductCreateSerializer(serializers.ModelSerializer):
 
 
 class WalletSummarySerializer(serializers.ModelSerializer):
-    """Simplified wallet serializer for dashboard"""
-    total_balance_usd = serializers.SerializerMethodField()
-    recent_transactions = serializers.SerializerMethodField()
+    """Wallet summary for the dashboard, read from the materialized WalletSummary"""
     
     class Meta:
-        model = Wallet
+        model = WalletSummary
         fields = [
-            'balance_usd', 'balance_ngn', 'total_balance_usd',
-            'total_transactions', 'recent_transactions'
+            'usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance',
+            'total_balance_usd', 'total_transactions', 'recent_transactions',
+            'updated_at'
         ]
-    
-    def get_total_balance_usd(self, obj):
-        """Calculate total balance in USD"""
-        system_settings = SystemSettings.objects.first()
-        exchange_rate = system_settings.exchange_rate_usd_to_ngn if system_settings else Decimal('1500.00')
-        ngn_in_usd = obj.balance_ngn / exchange_rate
-        return float(obj.balance_usd + ngn_in_usd)
-    
-    def get_recent_transactions(self, obj):
-        """Get recent transactions"""
-        recent = Transaction.objects.filter(wallet=obj).order_by('-created_at')[:5]
-        return TransactionSerializer(recent, many=True).data
\ No newline at end of file
+        read_only_fields = fields
@@ -0,0 +1,194 @@
+"""
+Batch settlement of pending transactions
+Workers claim chunks of pending (or abandoned processing) transactions
+with a lease, hand the whole chunk to the payment gateway, then post the
+successful ones to the ledger and write every status change back with one
+bulk_update. Leases make parallel workers safe: a chunk belongs to one
+worker until it is applied or its lease runs out.
+"""
+
+import hashlib
+import logging
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .ledger import LedgerError, post_transactions
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'SETTLEMENT_BATCH_SIZE', 500)
+LEASE_DURATION = getattr(settings, 'SETTLEMENT_LEASE_DURATION', timedelta(minutes=5))
+GATEWAY = getattr(settings, 'SETTLEMENT_GATEWAY', 'app.settlement.LocalGatewayStub')
+
+SETTLEABLE = ('pending', 'processing')
+UPDATE_FIELDS = ['status', 'completed_at', 'external_reference', 'lease_owner', 'lease_expires_at', 'updated_at']
+
+
+@dataclass
+class SettlementResult:
+    success: bool
+    external_reference: str = ''
+    message: str = ''
+
+
+@dataclass
+class BatchStats:
+    claimed: int = 0
+    completed: int = 0
+    failed: int = 0
+    retried: int = 0
+
+
+class LocalGatewayStub:
+    """
+    Stand-in for a payment gateway; settles a batch without network calls.
+
+    Outcomes are deterministic per transaction id, and a share given by
+    SETTLEMENT_STUB_FAILURE_RATE is declined.
+    """
+
+    def __init__(self, failure_rate=None):
+        if failure_rate is None:
+            failure_rate = getattr(settings, 'SETTLEMENT_STUB_FAILURE_RATE', 0.0)
+        self.failure_rate = failure_rate
+
+    def settle(self, transactions):
+        """Return {transaction pk: SettlementResult} for the batch"""
+        results = {}
+        for txn in transactions:
+            digest = hashlib.sha256(str(txn.pk).encode('utf-8')).hexdigest()
+            declined = int(digest[:8], 16) / 0xFFFFFFFF < self.failure_rate
+            results[txn.pk] = SettlementResult(
+                success=not declined,
+                external_reference=f'stub-{digest[:16]}',
+                message='Declined by gateway' if declined else '',
+            )
+        return results
+
+
+def get_gateway():
+    return import_string(GATEWAY)()
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def claim_batch(worker_id, batch_size=BATCH_SIZE, lease=LEASE_DURATION):
+    """
+    Lease up to `batch_size` settleable transactions to `worker_id`.
+
+    Candidates are pending or processing rows with no live lease. Where the
+    database supports SKIP LOCKED, rows another worker is claiming are
+    skipped; everywhere else the conditional UPDATE decides, since only one
+    worker's UPDATE can match a row that is still unleased.
+    """
+    from .models import Transaction
+
+    now = timezone.now()
+    available = Q(status__in=SETTLEABLE) & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now))
+    with transaction.atomic():
+        candidates = Transaction.objects.filter(available).order_by('created_at')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        Transaction.objects.filter(available, pk__in=ids).update(
+            status='processing', lease_owner=worker_id, lease_expires_at=now + lease, updated_at=now
+        )
+    # Oldest first, so earlier transactions are posted first when funds run short
+    return list(Transaction.objects.filter(pk__in=ids, lease_owner=worker_id).order_by('created_at'))
+
+
+def _post_isolating_failures(completed):
+    """Post `completed`; if the batch fails, post one by one and return the rejects"""
+    try:
+        with transaction.atomic():
+            post_transactions(completed)
+        return []
+    except LedgerError:
+        pass
+    rejected = []
+    for txn in completed:
+        try:
+            with transaction.atomic():
+                post_transactions([txn])
+        except LedgerError as e:
+            logger.warning('Settlement of transaction %s rejected by ledger: %s', txn.pk, e)
+            rejected.append(txn)
+    return rejected
+
+
+def apply_results(worker_id, claimed, results):
+    """Write gateway `results` for the `claimed` transactions this worker still holds"""
+    from .models import Transaction
+    from .wallet_summary import schedule_refresh
+
+    stats = BatchStats(claimed=len(claimed))
+    now = timezone.now()
+    with transaction.atomic():
+        # A lease that expired mid-batch may have been taken over
+        held = set(Transaction.objects.select_for_update().filter(
+            pk__in=[txn.pk for txn in claimed], lease_owner=worker_id
+        ).values_list('pk', flat=True))
+
+        completed, changed = [], []
+        for txn in claimed:
+            if txn.pk not in held:
+                continue
+            result = results.get(txn.pk)
+            if result is None:
+                # No answer from the gateway; the lease runs out and a later
+                # batch retries it
+                stats.retried += 1
+                continue
+            if result.success:
+                txn.status = 'completed'
+                txn.completed_at = now
+                txn.external_reference = result.external_reference or txn.external_reference
+                completed.append(txn)
+            else:
+                txn.status = 'failed'
+                txn.external_reference = result.external_reference or txn.external_reference
+            txn.lease_owner = None
+            txn.lease_expires_at = None
+            txn.updated_at = now
+            changed.append(txn)
+
+        for txn in _post_isolating_failures(completed):
+            txn.status = 'failed'
+            txn.completed_at = None
+        Transaction.objects.bulk_update(changed, UPDATE_FIELDS, batch_size=BATCH_SIZE)
+
+        for txn in changed:
+            if txn.status == 'completed':
+                stats.completed += 1
+            elif txn.status == 'failed':
+                stats.failed += 1
+                schedule_refresh(txn.user_id)
+    return stats
+
+
+def settle_batch(worker_id, gateway=None, batch_size=BATCH_SIZE):
+    """Claim, settle and apply one chunk; returns BatchStats"""
+    claimed = claim_batch(worker_id, batch_size)
+    if not claimed:
+        return BatchStats()
+    gateway = gateway or get_gateway()
+    try:
+        results = gateway.settle(claimed)
+    except Exception:
+        # Leave the leases to expire so another attempt picks the batch up
+        logger.exception('Gateway call failed for %d transactions', len(claimed))
+        return BatchStats(claimed=len(claimed), retried=len(claimed))
+    return apply_results(worker_id, claimed, results)
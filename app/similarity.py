@@ -0,0 +1,256 @@
+"""
+Precomputed "similar products"
+Approved products are embedded as feature vectors (one-hot category and
+condition, hashed tags, scaled log price), and each product's top-k
+cosine neighbours are found with blocked matrix multiplies and stored in
+ProductNeighbor. Requires NumPy, which is only imported by this job.
+"""
+
+import math
+import zlib
+
+from django.db import transaction
+from django.utils import timezone
+
+DEFAULT_K = 10
+DEFAULT_BLOCK_SIZE = 1024
+WRITE_CHUNK_SIZE = 500
+TAG_BUCKETS = 64
+
+# Relative importance of each feature group in the cosine similarity
+CATEGORY_WEIGHT = 1.0
+CONDITION_WEIGHT = 0.3
+TAG_WEIGHT = 1.0
+PRICE_WEIGHT = 0.5
+
+# log1p(price) is mapped to roughly [-1, 1] around a $100 item
+PRICE_LOG_CENTER = math.log1p(100)
+PRICE_LOG_SCALE = 2.5
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('NumPy is required to compute similar products (pip install numpy)')
+    return numpy
+
+
+def _tag_bucket(tag):
+    # crc32 rather than hash() so buckets are stable across processes
+    return zlib.crc32(tag.encode('utf-8')) % TAG_BUCKETS
+
+
+def load_catalog():
+    """Return ids and raw features of every approved product"""
+    from .models import Product
+    from .tags import normalize_tags
+
+    ids, categories, conditions, tags, prices, updated = [], [], [], [], [], []
+    rows = Product.objects.filter(status='approved').order_by().values_list(
+        'id', 'category', 'condition', 'tags', 'price', 'updated_at'
+    )
+    for product_id, category, condition, product_tags, price, updated_at in rows.iterator(chunk_size=5000):
+        ids.append(product_id)
+        categories.append(category)
+        conditions.append(condition)
+        tags.append(normalize_tags(product_tags))
+        prices.append(float(price))
+        updated.append(updated_at)
+    return ids, categories, conditions, tags, prices, updated
+
+
+def vectorize(categories, conditions, tags, prices):
+    """Build the L2-normalized float32 feature matrix, one row per product"""
+    from .models import Product
+
+    np = _numpy()
+    category_index = {value: i for i, (value, _) in enumerate(Product.CATEGORY_CHOICES)}
+    condition_index = {value: i for i, (value, _) in enumerate(Product.CONDITION_CHOICES)}
+    tag_offset = len(category_index) + len(condition_index)
+    price_column = tag_offset + TAG_BUCKETS
+
+    count = len(categories)
+    matrix = np.zeros((count, price_column + 1), dtype=np.float32)
+    rows = np.arange(count)
+
+    matrix[rows, [category_index.get(value, len(category_index) - 1) for value in categories]] = CATEGORY_WEIGHT
+    matrix[rows, [len(category_index) + condition_index.get(value, 0) for value in conditions]] = CONDITION_WEIGHT
+
+    for row, product_tags in enumerate(tags):
+        if not product_tags:
+            continue
+        weight = TAG_WEIGHT / math.sqrt(len(product_tags))
+        for tag in product_tags:
+            matrix[row, tag_offset + _tag_bucket(tag)] += weight
+
+    # Fixed centering keeps each vector independent of the rest of the
+    # catalog, which is what lets incremental runs skip unchanged products
+    log_price = np.log1p(np.asarray(prices, dtype=np.float32))
+    matrix[:, price_column] = PRICE_WEIGHT * (log_price - PRICE_LOG_CENTER) / PRICE_LOG_SCALE
+
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    matrix /= norms[:, None]
+    return matrix
+
+
+def top_k_neighbors(matrix, rows, k, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Yield (block_rows, neighbor_rows, scores) for `rows` of `matrix`.
+
+    Each block is one (block_size x n) matrix multiply; the top k per row is
+    selected with argpartition and only those k are sorted.
+    """
+    np = _numpy()
+    total = matrix.shape[0]
+    k = min(k, total - 1)
+    if k <= 0:
+        return
+
+    rows = np.asarray(rows, dtype=np.int64)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = matrix[block] @ matrix.T
+        scores[np.arange(len(block)), block] = -np.inf
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        yield (
+            block,
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(candidate_scores, order, axis=1),
+        )
+
+
+def _best_score_against(matrix, rows, block_size):
+    """Highest similarity of every product to any of `rows` (itself excluded)"""
+    np = _numpy()
+    best = np.full(matrix.shape[0], -np.inf, dtype=np.float32)
+    rows = np.asarray(rows, dtype=np.int64)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = matrix[block] @ matrix.T
+        scores[np.arange(len(block)), block] = -np.inf
+        np.maximum(best, scores.max(axis=0), out=best)
+    return best
+
+
+def _rows_to_refresh(ids, updated, matrix, k, since, block_size):
+    """
+    Pick the products whose neighbour lists may have changed since `since`.
+
+    That is every product edited since then, every product whose list points
+    at one of them or at a product that is gone, lists that are short, and
+    lists whose weakest entry is now beaten by an edited product.
+    """
+    from django.db.models import Count, Min
+    from .models import ProductNeighbor
+
+    np = _numpy()
+    position = {product_id: row for row, product_id in enumerate(ids)}
+    expected = min(k, len(ids) - 1)
+
+    changed = [row for row, updated_at in enumerate(updated) if updated_at >= since]
+    refresh = set(changed)
+
+    changed_ids = [ids[row] for row in changed]
+    for start in range(0, len(changed_ids), WRITE_CHUNK_SIZE):
+        for product_id in ProductNeighbor.objects.filter(
+            neighbor_id__in=changed_ids[start:start + WRITE_CHUNK_SIZE]
+        ).values_list('product_id', flat=True):
+            if product_id in position:
+                refresh.add(position[product_id])
+
+    # Lists that lost entries to unapproved or deleted products
+    stale_owners = ProductNeighbor.objects.exclude(
+        neighbor__status='approved'
+    ).values_list('product_id', flat=True)
+    refresh.update(position[product_id] for product_id in stale_owners if product_id in position)
+
+    weakest = {}
+    for row in ProductNeighbor.objects.values('product_id').annotate(
+        weakest=Min('score'), entries=Count('id')
+    ).order_by():
+        weakest[row['product_id']] = (row['weakest'], row['entries'])
+
+    best = _best_score_against(matrix, changed, block_size) if changed else None
+    for row, product_id in enumerate(ids):
+        if row in refresh:
+            continue
+        score, entries = weakest.get(product_id, (None, 0))
+        if entries < expected:
+            refresh.add(row)
+        elif best is not None and best[row] > score:
+            refresh.add(row)
+    return np.array(sorted(refresh), dtype=np.int64)
+
+
+def _store(ids, block, neighbors, scores):
+    from .models import ProductNeighbor
+
+    owner_ids = [ids[row] for row in block]
+    entries = [
+        ProductNeighbor(
+            product_id=ids[row],
+            neighbor_id=ids[neighbor],
+            rank=rank,
+            score=float(score),
+        )
+        for row, row_neighbors, row_scores in zip(block, neighbors, scores)
+        for rank, (neighbor, score) in enumerate(zip(row_neighbors, row_scores), start=1)
+    ]
+    with transaction.atomic():
+        for start in range(0, len(owner_ids), WRITE_CHUNK_SIZE):
+            ProductNeighbor.objects.filter(product_id__in=owner_ids[start:start + WRITE_CHUNK_SIZE]).delete()
+        ProductNeighbor.objects.bulk_create(entries, batch_size=WRITE_CHUNK_SIZE)
+
+
+def compute_similar_products(k=DEFAULT_K, block_size=DEFAULT_BLOCK_SIZE, full=False):
+    """
+    Refresh stored neighbours; incremental unless `full` or no run finished yet.
+
+    Returns the SimilarityRun recorded for this pass.
+    """
+    from .models import ProductNeighbor, SimilarityRun
+
+    _numpy()
+    started_at = timezone.now()
+    last_run = SimilarityRun.objects.filter(finished_at__isnull=False).first()
+    full = full or last_run is None
+
+    ids, categories, conditions, tags, prices, updated = load_catalog()
+    matrix = vectorize(categories, conditions, tags, prices)
+
+    # Products that left the catalog keep no list of their own
+    ProductNeighbor.objects.exclude(product__status='approved').delete()
+
+    if full:
+        rows = range(len(ids))
+    else:
+        rows = _rows_to_refresh(ids, updated, matrix, k, last_run.started_at, block_size)
+
+    updated_count = 0
+    for block, neighbors, scores in top_k_neighbors(matrix, rows, k, block_size):
+        _store(ids, block, neighbors, scores)
+        updated_count += len(block)
+
+    if len(ids) <= 1:
+        ProductNeighbor.objects.all().delete()
+
+    return SimilarityRun.objects.create(
+        started_at=started_at,
+        finished_at=timezone.now(),
+        full_rebuild=full,
+        products_updated=updated_count,
+    )
+
+
+def similar_products(product):
+    """Approved neighbours of `product` in rank order"""
+    from .models import Product
+
+    return Product.objects.filter(
+        neighbor_links__product=product,
+        status='approved',
+    ).order_by('neighbor_links__rank')
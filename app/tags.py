@@ -0,0 +1,122 @@
+"""
+Normalized product tag index
+Product.tags (a JSON list) is mirrored into Tag/ProductTag rows so tag filters
+are indexed joins, and tag names are served for autocomplete from an
+in-memory sorted list
+"""
+
+import bisect
+import threading
+
+from django.db import transaction
+from django.db.models import Count
+
+from .response_cache import get_tag_versions, invalidate_tags
+
+MAX_TAG_LENGTH = 50
+SUGGESTIONS_TAG = 'tag-suggestions'
+
+
+def normalize_tags(tags):
+    """Lowercase, trim and de-duplicate tags, preserving order"""
+    if not isinstance(tags, (list, tuple)):
+        return []
+    seen = []
+    for tag in tags:
+        name = ' '.join(str(tag).lower().split())[:MAX_TAG_LENGTH]
+        if name and name not in seen:
+            seen.append(name)
+    return seen
+
+
+def parse_tag_param(value):
+    """Split a comma-separated `tags` query parameter"""
+    return normalize_tags((value or '').split(','))
+
+
+def sync_product_tags(product, previous_status=None):
+    """
+    Bring a product's ProductTag rows in line with product.tags.
+
+    Suggestions only list tags of approved products, so they are also
+    refreshed when the product is approved or leaves approval.
+    """
+    from .models import ProductTag, Tag
+
+    wanted = set(normalize_tags(product.tags))
+    with transaction.atomic():
+        current = dict(
+            ProductTag.objects.filter(product=product).values_list('tag__name', 'pk')
+        )
+        removed = [pk for name, pk in current.items() if name not in wanted]
+        added = wanted - set(current)
+        if removed:
+            ProductTag.objects.filter(pk__in=removed).delete()
+        if added:
+            Tag.objects.bulk_create([Tag(name=name) for name in added], ignore_conflicts=True)
+            tag_ids = Tag.objects.filter(name__in=added).values_list('pk', flat=True)
+            ProductTag.objects.bulk_create(
+                [ProductTag(product=product, tag_id=tag_id) for tag_id in tag_ids],
+                ignore_conflicts=True
+            )
+    approval_changed = (previous_status == 'approved') != (product.status == 'approved')
+    if removed or added or (approval_changed and wanted):
+        invalidate_tags(SUGGESTIONS_TAG)
+
+
+def filter_by_tags(queryset, tags, match_all=True):
+    """Restrict a Product queryset to products carrying all (or any) of `tags`"""
+    from .models import ProductTag
+
+    if not tags:
+        return queryset
+    links = ProductTag.objects.filter(tag__name__in=tags)
+    if match_all:
+        links = links.values('product_id').annotate(
+            matched=Count('tag_id')
+        ).filter(matched=len(tags))
+    return queryset.filter(pk__in=links.values('product_id'))
+
+
+class TagSuggester:
+    """
+    Sorted in-memory names of the tags on approved products, reloaded when
+    any process changes that set
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = []
+        self._version = None
+
+    def _refresh(self):
+        from .models import Tag
+
+        version = get_tag_versions([SUGGESTIONS_TAG])
+        if version == self._version:
+            return
+        names = list(
+            Tag.objects.filter(product_links__product__status='approved')
+            .distinct().order_by('name').values_list('name', flat=True)
+        )
+        with self._lock:
+            self._names = names
+            self._version = version
+
+    def suggest(self, prefix, limit=10):
+        """Return up to `limit` tag names starting with `prefix`"""
+        prefix = ' '.join((prefix or '').lower().split())
+        if not prefix:
+            return []
+        self._refresh()
+        names = self._names
+        start = bisect.bisect_left(names, prefix)
+        matches = []
+        for name in names[start:start + limit]:
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+        return matches
+
+
+suggester = TagSuggester()
@@ -1,3 +1,2112 @@
-from django.test import TestCase
+import csv
+from datetime import timedelta
+from decimal import Decimal
+import importlib
+from io import StringIO
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+import uuid
+import warnings
 
-# Create your tests here.
+import numpy
+from django.apps import apps as django_apps
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    IdempotencyKey, LedgerAccount, LedgerEntry, MerchantApplication, Notification, Product, ProductFacetCount,
+    ProductImage, ProductNeighbor, ProductTag, Referral, ReferralCode, ReferralEvaluation, ReferralProgram, Review,
+    SystemSettings, Transaction, TransactionArchive, UserActivity, UserActivityArchive, Wallet, WalletSummary,
+    WithdrawalAggregate
+)
+from . import exchange_rates, ledger, referral_codes, response_cache, view_counter
+from .archive import archive_history
+from .exchange_rates import (
+    FixtureRateProvider, RateCache, to_usd, total_usd, wallet_totals_usd, wallet_totals_usd_array
+)
+from .exports import merged_export_rows
+from .facets import can_use_counts, price_bucket, rebuild_facet_counts
+from .ids import decode_base32, encode_base32, new_transaction_reference, uuid7, uuid7_timestamp_ms
+from .ledger import WithdrawalLimitExceeded
+from .ratings import rebuild_ratings
+from .reconciliation import reconcile, user_id_shards
+from .referral_codes import code_for_user_id, create_referral_code
+from .referrals import (
+    ReferralCodeCache, attribute_referral, code_cache, evaluate_batch, expire_batch,
+    expire_referrals, rebuild_referral_counters, retry_unpaid_bonuses
+)
+from .response_cache import check_shared_cache, get_or_build, get_tag_versions, invalidate_tags
+from .search import build_match_query, rebuild_index, search_products
+from .settlement import SettlementResult, apply_results, claim_batch, settle_batch
+from .similarity import compute_similar_products, similar_products, top_k_neighbors
+from .tags import TagSuggester, filter_by_tags, normalize_tags, parse_tag_param
+from .view_counter import ViewCountBuffer
+from .wallet_summary import RECENT_TRANSACTIONS, get_wallet_summary, refresh_wallet_summary
+from .withdrawal_limits import check_batch, period_starts, withdrawn_usd
+
+
+def make_user(username, **fields):
+    return User.objects.create_user(username=username, password='pass12345', **fields)
+
+
+def make_product(seller, title='Product', **fields):
+    """An approved, in-stock product of `seller`"""
+    application = MerchantApplication.objects.filter(user=seller).first()
+    if application is None:
+        application = MerchantApplication.objects.create(user=seller, status='approved', business_name=f'{seller.username} store')
+    fields.setdefault('description', f'{title} description')
+    fields.setdefault('price', Decimal('10.00'))
+    fields.setdefault('category', 'electronics')
+    fields.setdefault('status', 'approved')
+    return Product.objects.create(seller=seller, merchant_application=application, title=title, **fields)
+
+
+# Full-text product search
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.seller = make_user('seller')
+
+    def search(self, text):
+        return list(search_products(Product.objects.all(), text).values_list('title', flat=True))
+
+    def test_build_match_query_requires_every_term_as_prefix(self):
+        self.assertEqual(build_match_query('Red  shoe'), '"Red"* AND "shoe"*')
+        self.assertEqual(build_match_query('"; DROP TABLE x --'), '"DROP"* AND "TABLE"* AND "x"*')
+        self.assertEqual(build_match_query('  !! '), '')
+
+    def test_matches_title_description_and_tags_by_prefix(self):
+        make_product(self.seller, 'Wireless headphones')
+        make_product(self.seller, 'Desk lamp', description='Warm light for reading')
+        make_product(self.seller, 'Kettle', tags=['kitchen', 'steel'])
+
+        self.assertEqual(self.search('wire'), ['Wireless headphones'])
+        self.assertEqual(self.search('reading'), ['Desk lamp'])
+        self.assertEqual(self.search('kitch'), ['Kettle'])
+        self.assertEqual(self.search('lamp reading'), ['Desk lamp'])
+        self.assertEqual(self.search('lamp kettle'), [])
+
+    def test_title_matches_rank_above_description_matches(self):
+        make_product(self.seller, 'Plain mug', description='A camera-shaped mug')
+        make_product(self.seller, 'Camera', description='Takes photos')
+
+        self.assertEqual(self.search('camera'), ['Camera', 'Plain mug'])
+
+    def test_index_follows_edits_and_deletes(self):
+        product = make_product(self.seller, 'Old name', description='Used')
+        product.title = 'Brand new name'
+        product.save()
+
+        self.assertEqual(self.search('old'), [])
+        self.assertEqual(self.search('brand'), ['Brand new name'])
+
+        product.delete()
+        self.assertEqual(self.search('brand'), [])
+
+    def test_rebuild_index_restores_every_product(self):
+        make_product(self.seller, 'Guitar')
+        make_product(self.seller, 'Violin')
+
+        self.assertEqual(rebuild_index(chunk_size=1), 2)
+        self.assertEqual(self.search('guitar'), ['Guitar'])
+
+    def test_product_list_endpoint_searches_approved_products(self):
+        make_product(self.seller, 'Camping tent')
+        make_product(self.seller, 'Camping stove', status='draft')
+
+        response = APIClient().get('/api/products/', {'search': 'camping'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['title'] for row in response.data['results']], ['Camping tent'])
+
+
+# Keyset pagination
+class ProductKeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        seller = make_user('seller')
+        self.products = [make_product(seller, f'Item {i}', price=Decimal(10 + i % 3)) for i in range(7)]
+        # Ties on the sort value must still page without gaps or repeats
+        Product.objects.filter(pk__in=[p.pk for p in self.products[2:5]]).update(
+            created_at=self.products[2].created_at
+        )
+
+    def walk(self, **params):
+        ids, url, pages = [], '/api/products/', 0
+        response = self.client.get(url, {'page_size': 3, **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            pages += 1
+            if not response.data['next']:
+                return ids, pages, response
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_every_product_once_in_order(self):
+        ids, pages, _ = self.walk()
+
+        expected = Product.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)
+        self.assertEqual(ids, [str(pk) for pk in expected])
+        self.assertEqual(pages, 3)
+
+    def test_ordering_by_price_pages_on_price_then_id(self):
+        ids, _, _ = self.walk(ordering='price')
+
+        expected = Product.objects.order_by('price', 'pk').values_list('pk', flat=True)
+        self.assertEqual(ids, [str(pk) for pk in expected])
+
+    def test_previous_link_returns_the_earlier_page(self):
+        first = self.client.get('/api/products/', {'page_size': 3})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        self.assertIsNone(first.data['previous'])
+        self.assertEqual([row['id'] for row in back.data['results']], [row['id'] for row in first.data['results']])
+
+    def test_pages_are_not_counted_unless_asked(self):
+        response = self.client.get('/api/products/', {'page_size': 3})
+        self.assertNotIn('estimated_total', response.data)
+
+        response = self.client.get('/api/products/', {'page_size': 3, 'include_total': 'true'})
+        self.assertEqual(response.data['estimated_total'], {'value': 7, 'exact': True})
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/products/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_relevance_falls_back_to_page_numbers(self):
+        response = self.client.get('/api/products/', {'search': 'item', 'page_size': 3})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 7)
+
+
+# Product cards
+class ProductCardTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = make_user('seller', first_name='Ada', last_name='Lovelace')
+
+    def test_list_returns_only_card_fields(self):
+        make_product(self.seller, 'Lamp')
+
+        row = self.client.get('/api/products/').data['results'][0]
+
+        self.assertEqual(set(row), {'id', 'title', 'price', 'rating', 'thumbnail', 'seller_name'})
+
+    def test_thumbnail_is_the_first_image_by_order(self):
+        product = make_product(self.seller, 'Lamp')
+        ProductImage.objects.create(product=product, image='products/second.jpg', order=2)
+        ProductImage.objects.create(product=product, image='products/first.jpg', order=1)
+
+        row = self.client.get('/api/products/').data['results'][0]
+
+        self.assertTrue(row['thumbnail'].endswith('/media/products/first.jpg'))
+
+    def test_seller_name_prefers_business_then_full_name_then_username(self):
+        product = make_product(self.seller, 'Lamp')
+        self.assertEqual(self.client.get('/api/products/').data['results'][0]['seller_name'], 'seller store')
+
+        MerchantApplication.objects.filter(pk=product.merchant_application_id).update(business_name='')
+        self.assertEqual(self.client.get('/api/products/').data['results'][0]['seller_name'], 'Ada Lovelace')
+
+        User.objects.filter(pk=self.seller.pk).update(first_name='', last_name='')
+        self.assertEqual(self.client.get('/api/products/').data['results'][0]['seller_name'], 'seller')
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        make_product(self.seller, 'Lamp')
+        with CaptureQueriesContext(connection) as one:
+            self.client.get('/api/products/')
+
+        for i in range(5):
+            product = make_product(self.seller, f'Extra {i}')
+            ProductImage.objects.create(product=product, image=f'products/{i}.jpg')
+        with CaptureQueriesContext(connection) as six:
+            response = self.client.get('/api/products/')
+
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(six), len(one))
+
+
+# Composite indexes for hot query paths
+class QueryPlanTests(TestCase):
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return ' | '.join(row[-1] for row in cursor.fetchall())
+
+    def test_marketplace_orderings_read_their_indexes(self):
+        live = Product.objects.filter(status='approved')
+        cases = [
+            (live.order_by('-created_at', '-pk'), 'product_status_created_idx'),
+            (live.filter(category='electronics').order_by('-created_at', '-pk'), 'product_status_cat_idx'),
+            (live.order_by('price', 'pk'), 'product_status_price_idx'),
+            (live.order_by('-rating', '-pk'), 'product_status_rating_idx'),
+            (live.order_by('-views', '-pk'), 'product_status_views_idx'),
+        ]
+        for queryset, index in cases:
+            plan = self.plan(queryset[:21])
+            self.assertIn(index, plan)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_featured_listing_needs_no_scan_or_sort(self):
+        plan = self.plan(Product.objects.filter(status='approved', featured=True).order_by('-created_at', '-pk')[:21])
+        self.assertIn('product_status_created_idx', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_user_histories_read_their_indexes(self):
+        user = make_user('user')
+        cases = [
+            (Transaction.objects.filter(user=user).order_by('-created_at'), 'txn_user_created_idx'),
+            (Notification.objects.filter(user=user).order_by('-created_at'), 'notification_user_created_idx'),
+            (UserActivity.objects.filter(user=user).order_by('-created_at'), 'activity_user_created_idx'),
+        ]
+        for queryset, index in cases:
+            self.assertIn(index, self.plan(queryset[:21]))
+
+    def test_check_query_plans_finds_no_table_scans(self):
+        out = StringIO()
+        with warnings.catch_warnings():
+            # Sample filters must be timezone-aware
+            warnings.simplefilter('error', RuntimeWarning)
+            call_command('check_query_plans', stdout=out)
+        self.assertNotIn('FAIL', out.getvalue())
+
+
+# Tag-invalidated response cache
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return {'build': self.builds}
+
+    def test_entries_are_reused_until_a_tag_is_invalidated(self):
+        first = get_or_build('test', {'page': 1}, ['a', 'b'], self.build)
+        again = get_or_build('test', {'page': 1}, ['a', 'b'], self.build)
+        other_params = get_or_build('test', {'page': 2}, ['a', 'b'], self.build)
+        invalidate_tags('b')
+        rebuilt = get_or_build('test', {'page': 1}, ['a', 'b'], self.build)
+
+        self.assertEqual(first, again)
+        self.assertEqual(other_params, {'build': 2})
+        self.assertEqual(rebuilt, {'build': 3})
+
+    def test_waiter_takes_the_value_built_by_the_lock_holder(self):
+        get_tag_versions(['a'])
+        with mock.patch.object(response_cache.cache, 'add', return_value=False), \
+                mock.patch.object(response_cache.cache, 'get', side_effect=[None, None, {'build': 'elsewhere'}]), \
+                mock.patch('app.response_cache.time.sleep') as sleep:
+            value = get_or_build('test', {}, ['a'], self.build)
+
+        self.assertEqual(value, {'build': 'elsewhere'})
+        self.assertEqual(self.builds, 0)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_waiter_builds_itself_when_the_lock_holder_never_finishes(self):
+        with mock.patch.object(response_cache.cache, 'add', return_value=False), \
+                mock.patch('app.response_cache.time.sleep') as sleep:
+            value = get_or_build('test', {}, ['a'], self.build)
+
+        self.assertEqual(value, {'build': 1})
+        self.assertEqual(sleep.call_count, response_cache.LOCK_WAIT_ATTEMPTS)
+
+    def test_process_local_cache_is_reported(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES=locmem):
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+                self.assertEqual([e.id for e in check_shared_cache(None)], ['app.W001'])
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+                self.assertEqual([e.id for e in check_shared_cache(None)], ['app.E001'])
+
+
+@override_settings(ROOT_URLCONF='app.api_urls')
+class MarketplaceCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('buyer'))
+        self.seller = make_user('seller')
+        self.lamp = make_product(self.seller, 'Lamp', category='electronics')
+
+    def titles(self, **params):
+        response = self.client.get('/api/products/marketplace/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['title'] for row in response.data['results']]
+
+    def test_pages_are_served_from_cache_until_their_category_changes(self):
+        self.assertEqual(self.titles(category='electronics'), ['Lamp'])
+
+        # Writes that skip signals are not seen: the page is cached
+        Product.objects.filter(pk=self.lamp.pk).update(title='Renamed lamp')
+        self.assertEqual(self.titles(category='electronics'), ['Lamp'])
+
+        # Another category's change leaves this page alone
+        make_product(self.seller, 'Novel', category='books_media')
+        self.assertEqual(self.titles(category='electronics'), ['Lamp'])
+
+        # A change in the category evicts it
+        make_product(self.seller, 'Radio', category='electronics')
+        self.assertEqual(self.titles(category='electronics'), ['Radio', 'Renamed lamp'])
+
+    def test_unfiltered_pages_see_changes_in_any_category(self):
+        self.assertEqual(self.titles(), ['Lamp'])
+
+        make_product(self.seller, 'Novel', category='books_media')
+
+        self.assertEqual(self.titles(), ['Novel', 'Lamp'])
+
+    def test_rejecting_a_product_evicts_its_pages(self):
+        self.assertEqual(self.titles(category='electronics'), ['Lamp'])
+
+        self.lamp.status = 'rejected'
+        self.lamp.save()
+
+        self.assertEqual(self.titles(category='electronics'), [])
+
+
+# Buffered product view counting
+class ViewCountBufferTests(TestCase):
+    def setUp(self):
+        seller = make_user('seller')
+        self.lamp = make_product(seller, 'Lamp')
+        self.radio = make_product(seller, 'Radio')
+        self.viewer = make_user('viewer')
+        self.buffer = ViewCountBuffer(interval=0, threshold=100)
+
+    def views(self, product):
+        return Product.objects.values_list('views', flat=True).get(pk=product.pk)
+
+    def test_views_are_written_on_flush_in_batches(self):
+        for _ in range(3):
+            self.buffer.record(self.lamp.pk)
+        self.buffer.record(self.radio.pk)
+        self.assertEqual(self.views(self.lamp), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 4)
+
+        self.assertEqual((self.views(self.lamp), self.views(self.radio)), (3, 1))
+        updates = [q for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_reaching_the_threshold_flushes_inline(self):
+        buffer = ViewCountBuffer(interval=0, threshold=2)
+        buffer.record(self.lamp.pk)
+        self.assertEqual(self.views(self.lamp), 0)
+
+        buffer.record(self.lamp.pk)
+        self.assertEqual(self.views(self.lamp), 2)
+
+    def test_signed_in_views_are_logged_as_activity(self):
+        self.buffer.record(self.lamp.pk, user=self.viewer, ip_address='10.0.0.1')
+        self.buffer.record(self.lamp.pk, user=AnonymousUser())
+        self.buffer.flush()
+
+        activity = UserActivity.objects.get()
+        self.assertEqual((activity.user, activity.activity_type, activity.related_product_id),
+                         (self.viewer, 'product_view', self.lamp.pk))
+        self.assertEqual(activity.ip_address, '10.0.0.1')
+
+    def test_views_of_deleted_products_are_dropped(self):
+        self.buffer.record(self.radio.pk, user=self.viewer)
+        self.radio.delete()
+
+        self.buffer.flush()
+
+        self.assertFalse(UserActivity.objects.exists())
+
+    def test_failed_flush_keeps_the_views_for_the_next_one(self):
+        self.buffer.record(self.lamp.pk, user=self.viewer)
+        with mock.patch.object(ViewCountBuffer, '_write', side_effect=DatabaseError('locked')), \
+                self.assertLogs('app.view_counter', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.views(self.lamp), 1)
+        self.assertEqual(UserActivity.objects.count(), 1)
+
+    def test_product_detail_counts_a_view(self):
+        with mock.patch.object(view_counter, 'buffer', self.buffer):
+            response = APIClient().get(f'/api/products/{self.lamp.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+        self.buffer.flush()
+        self.assertEqual(self.views(self.lamp), 1)
+
+
+# Incremental product ratings
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        self.seller = make_user('seller')
+        self.product = make_product(self.seller, 'Lamp')
+        self.reviewers = [make_user(f'reviewer{i}') for i in range(3)]
+
+    def review(self, user, rating, product=None, **fields):
+        return Review.objects.create(
+            product=product or self.product, user=user, rating=rating, title='Review', content='Text', **fields
+        )
+
+    def rating(self, product=None):
+        product = Product.objects.get(pk=(product or self.product).pk)
+        return product.rating, product.review_count, product.get_rating_histogram()
+
+    def test_approved_reviews_update_average_and_histogram(self):
+        self.review(self.reviewers[0], 5)
+        self.review(self.reviewers[1], 4)
+        self.review(self.reviewers[2], 4)
+
+        rating, count, histogram = self.rating()
+        self.assertEqual((rating, count), (Decimal('4.33'), 3))
+        self.assertEqual(histogram, {'1': 0, '2': 0, '3': 0, '4': 2, '5': 1})
+
+    def test_unapproved_reviews_count_only_once_approved(self):
+        review = self.review(self.reviewers[0], 2, is_approved=False)
+        self.assertEqual(self.rating()[:2], (Decimal('0'), 0))
+
+        review.is_approved = True
+        review.save()
+        self.assertEqual(self.rating()[:2], (Decimal('2'), 1))
+
+        review.is_approved = False
+        review.save()
+        self.assertEqual(self.rating()[:2], (Decimal('0'), 0))
+
+    def test_editing_and_deleting_a_review_moves_its_stars(self):
+        review = self.review(self.reviewers[0], 1)
+        self.review(self.reviewers[1], 5)
+
+        review.rating = 3
+        review.save()
+        rating, count, histogram = self.rating()
+        self.assertEqual((rating, count, histogram['1'], histogram['3']), (Decimal('4'), 2, 0, 1))
+
+        review.delete()
+        self.assertEqual(self.rating()[:2], (Decimal('5'), 1))
+
+    def test_rebuild_ratings_repairs_drifted_totals(self):
+        self.review(self.reviewers[0], 4)
+        self.review(self.reviewers[1], 2)
+        Product.objects.filter(pk=self.product.pk).update(rating=1, review_count=9, rating_total=9, rating_4_count=0)
+
+        self.assertEqual(rebuild_ratings(chunk_size=1), 1)
+
+        rating, count, histogram = self.rating()
+        self.assertEqual((rating, count, histogram['2'], histogram['4']), (Decimal('3'), 2, 1, 1))
+
+    def test_saving_a_stale_product_keeps_newer_review_deltas(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.review(self.reviewers[0], 4)
+
+        stale.title = 'Desk lamp'
+        stale.save()
+
+        self.assertEqual(Product.objects.get(pk=self.product.pk).title, 'Desk lamp')
+        self.assertEqual(self.rating()[:2], (Decimal('4'), 1))
+
+    def test_admin_cannot_edit_the_rating(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pass12345')
+        self.client.force_login(admin_user)
+        self.review(self.reviewers[0], 4)
+
+        response = self.client.get(f'/admin/app/product/{self.product.pk}/change/')
+
+        self.assertNotIn('name="rating"', response.content.decode())
+        self.assertNotIn('name="review_count"', response.content.decode())
+
+
+# Normalized tag index and autocomplete
+class TagIndexTests(TestCase):
+    def setUp(self):
+        self.seller = make_user('seller')
+
+    def linked_tags(self, product):
+        return sorted(ProductTag.objects.filter(product=product).values_list('tag__name', flat=True))
+
+    def test_normalize_tags_lowercases_trims_and_deduplicates(self):
+        self.assertEqual(normalize_tags([' Red ', 'red', 'Dark   Blue', '', 7]), ['red', 'dark blue', '7'])
+        self.assertEqual(normalize_tags('red'), [])
+        self.assertEqual(parse_tag_param('Red, blue,,red'), ['red', 'blue'])
+
+    def test_product_tag_rows_follow_product_tags(self):
+        product = make_product(self.seller, 'Lamp', tags=['Desk', 'LED'])
+        self.assertEqual(self.linked_tags(product), ['desk', 'led'])
+
+        product.tags = ['led', 'warm']
+        product.save()
+
+        self.assertEqual(self.linked_tags(product), ['led', 'warm'])
+
+    def test_filter_by_tags_matches_all_or_any(self):
+        both = make_product(self.seller, 'Both', tags=['red', 'large'])
+        red = make_product(self.seller, 'Red', tags=['red'])
+        make_product(self.seller, 'Blue', tags=['blue'])
+        products = Product.objects.all()
+
+        self.assertEqual(list(filter_by_tags(products, ['red', 'large'])), [both])
+        self.assertEqual(set(filter_by_tags(products, ['red', 'large'], match_all=False)), {both, red})
+        self.assertEqual(filter_by_tags(products, []).count(), 3)
+
+    def test_suggestions_list_tags_of_approved_products_only(self):
+        make_product(self.seller, 'Lamp', tags=['lamp', 'lantern'])
+        draft = make_product(self.seller, 'Draft', status='draft', tags=['laser'])
+        make_product(self.seller, 'Rejected', status='rejected', tags=['latex'])
+        suggester = TagSuggester()
+
+        self.assertEqual(suggester.suggest('LA'), ['lamp', 'lantern'])
+        self.assertEqual(suggester.suggest('lamp', limit=1), ['lamp'])
+        self.assertEqual(suggester.suggest('  '), [])
+
+        draft.status = 'approved'
+        draft.save()
+        self.assertEqual(suggester.suggest('la'), ['lamp', 'lantern', 'laser'])
+
+        draft.status = 'suspended'
+        draft.save()
+        self.assertEqual(suggester.suggest('la'), ['lamp', 'lantern'])
+
+    def test_suggestions_drop_tags_removed_from_every_product(self):
+        product = make_product(self.seller, 'Lamp', tags=['lamp'])
+        suggester = TagSuggester()
+        self.assertEqual(suggester.suggest('la'), ['lamp'])
+
+        product.tags = ['light']
+        product.save()
+
+        self.assertEqual(suggester.suggest('la'), [])
+        self.assertEqual(suggester.suggest('li'), ['light'])
+
+    def test_suggest_endpoint_clamps_the_limit(self):
+        make_product(self.seller, 'Lamp', tags=['lamp', 'lantern', 'laptop'])
+        client = APIClient()
+
+        def suggestions(**params):
+            response = client.get('/api/tags/suggest/', {'q': 'la', **params})
+            self.assertEqual(response.status_code, 200)
+            return response.data['suggestions']
+
+        self.assertEqual(suggestions(), ['lamp', 'lantern', 'laptop'])
+        self.assertEqual(suggestions(limit=2), ['lamp', 'lantern'])
+        self.assertEqual(suggestions(limit=0), ['lamp'])
+        self.assertEqual(suggestions(limit=-5), ['lamp'])
+        self.assertEqual(suggestions(limit='many'), ['lamp', 'lantern', 'laptop'])
+
+
+# Precomputed similar products
+class SimilarProductsTests(TestCase):
+    def setUp(self):
+        seller = make_user('seller')
+        self.guitar = make_product(seller, 'Guitar', category='other', tags=['music', 'strings'], price=Decimal('300'))
+        self.violin = make_product(seller, 'Violin', category='other', tags=['music', 'strings'], price=Decimal('350'))
+        self.drum = make_product(seller, 'Drum', category='other', tags=['music'], price=Decimal('200'))
+        self.novel = make_product(seller, 'Novel', category='books_media', tags=['fiction'], price=Decimal('12'))
+
+    def neighbors(self, product):
+        return list(similar_products(product).values_list('title', flat=True))
+
+    def test_top_k_neighbors_rank_by_cosine_and_skip_self(self):
+        matrix = numpy.array([[1, 0], [0.9, 0.1], [0, 1]], dtype=numpy.float32)
+        matrix /= numpy.linalg.norm(matrix, axis=1, keepdims=True)
+
+        (block, neighbors, scores), = top_k_neighbors(matrix, [0, 1, 2], k=2, block_size=8)
+
+        self.assertEqual(block.tolist(), [0, 1, 2])
+        self.assertEqual(neighbors.tolist(), [[1, 2], [0, 2], [1, 0]])
+        self.assertTrue((scores[:, 0] >= scores[:, 1]).all())
+
+    def test_full_run_stores_neighbors_in_similarity_order(self):
+        run = compute_similar_products(k=2)
+
+        self.assertTrue(run.full_rebuild)
+        self.assertEqual(run.products_updated, 4)
+        self.assertEqual(self.neighbors(self.guitar), ['Violin', 'Drum'])
+        self.assertEqual(ProductNeighbor.objects.filter(product=self.novel).count(), 2)
+
+    def test_similar_endpoint_returns_cards(self):
+        compute_similar_products(k=2)
+
+        response = APIClient().get(f'/api/products/{self.violin.pk}/similar/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['title'] for row in response.data], ['Guitar', 'Drum'])
+
+    def test_incremental_run_refreshes_only_affected_products(self):
+        compute_similar_products(k=2)
+        self.assertEqual(compute_similar_products(k=2).products_updated, 0)
+
+        # Now identical to the guitar, so it should top the guitar's list
+        self.novel.tags = ['music', 'strings']
+        self.novel.category = 'other'
+        self.novel.price = Decimal('300')
+        self.novel.save()
+        run = compute_similar_products(k=2)
+
+        self.assertFalse(run.full_rebuild)
+        self.assertGreater(run.products_updated, 0)
+        self.assertEqual(self.neighbors(self.guitar)[0], 'Novel')
+
+    def test_unapproved_products_leave_every_list(self):
+        compute_similar_products(k=2)
+
+        self.violin.status = 'suspended'
+        self.violin.save()
+        compute_similar_products(k=2)
+
+        self.assertFalse(ProductNeighbor.objects.filter(product=self.violin).exists())
+        self.assertFalse(ProductNeighbor.objects.filter(neighbor=self.violin).exists())
+        self.assertEqual(self.neighbors(self.guitar), ['Drum', 'Novel'])
+
+
+# Marketplace facet counts
+class FacetCountTests(TestCase):
+    def setUp(self):
+        self.seller = make_user('seller')
+
+    def cells(self):
+        return {
+            (row.category, row.condition, row.price_bucket, row.featured): row.count
+            for row in ProductFacetCount.objects.filter(count__gt=0)
+        }
+
+    def test_price_buckets_separate_edges_from_ranges(self):
+        self.assertEqual(price_bucket(Decimal('0')), 0)
+        self.assertEqual(price_bucket(Decimal('5')), 1)
+        self.assertEqual(price_bucket(Decimal('10')), 2)
+        self.assertEqual(price_bucket(Decimal('10.01')), 3)
+        self.assertEqual(price_bucket(Decimal('5000')), 15)
+
+    def test_cells_follow_listing_changes(self):
+        lamp = make_product(self.seller, 'Lamp', price=Decimal('30'))
+        make_product(self.seller, 'Draft', status='draft')
+        self.assertEqual(self.cells(), {('electronics', 'new', 5, False): 1})
+
+        lamp.price = Decimal('50')
+        lamp.featured = True
+        lamp.save()
+        self.assertEqual(self.cells(), {('electronics', 'new', 6, True): 1})
+
+        lamp.stock_count = 0
+        lamp.save()
+        self.assertEqual(self.cells(), {})
+
+        lamp.stock_count = 3
+        lamp.save()
+        lamp.delete()
+        self.assertEqual(self.cells(), {})
+
+    def test_rebuild_facet_counts_repairs_drift(self):
+        make_product(self.seller, 'Lamp', price=Decimal('30'))
+        make_product(self.seller, 'Mug', price=Decimal('30'))
+        ProductFacetCount.objects.update(count=7)
+
+        self.assertEqual(rebuild_facet_counts(), 1)
+        self.assertEqual(self.cells(), {('electronics', 'new', 5, False): 2})
+
+    def test_admin_feature_actions_move_cells_and_evict_pages(self):
+        lamp = make_product(self.seller, 'Lamp', price=Decimal('30'))
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass12345'))
+        tag = response_cache.category_tag('electronics')
+        before = get_tag_versions([tag])
+
+        self.client.post('/admin/app/product/', {'action': 'feature_products', '_selected_action': [lamp.pk]})
+        self.assertEqual(self.cells(), {('electronics', 'new', 5, True): 1})
+        self.assertNotEqual(get_tag_versions([tag]), before)
+
+        self.client.post('/admin/app/product/', {'action': 'unfeature_products', '_selected_action': [lamp.pk]})
+        self.assertEqual(self.cells(), {('electronics', 'new', 5, False): 1})
+
+    def test_can_use_counts_only_for_edge_prices_without_search_or_tags(self):
+        self.assertTrue(can_use_counts({'category': 'electronics', 'min_price': '10', 'max_price': '100'}))
+        self.assertFalse(can_use_counts({'min_price': '12'}))
+        self.assertFalse(can_use_counts({'search': 'lamp'}))
+        self.assertFalse(can_use_counts({'tags': 'red'}))
+
+
+@override_settings(ROOT_URLCONF='app.api_urls')
+class MarketplaceFacetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('buyer'))
+        seller = make_user('seller')
+        make_product(seller, 'Lamp', category='electronics', price=Decimal('30'))
+        make_product(seller, 'Radio', category='electronics', price=Decimal('80'), condition='used', featured=True)
+        make_product(seller, 'Novel', category='books_media', price=Decimal('10'))
+        make_product(seller, 'Sold out', category='books_media', price=Decimal('10'), in_stock=False)
+
+    def facets(self, **params):
+        response = self.client.get('/api/products/marketplace/', {'facets': 'true', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_each_facet_ignores_its_own_filter(self):
+        data = self.facets(category='electronics')
+
+        self.assertEqual(data['total'], 2)
+        self.assertEqual((data['facets']['category']['electronics'], data['facets']['category']['books_media']), (2, 1))
+        self.assertEqual(data['facets']['condition'], {'new': 1, 'used': 1, 'refurbished': 0})
+        self.assertEqual((data['facets']['price']['25-50'], data['facets']['price']['50-100']), (1, 1))
+
+    def test_counts_match_live_aggregation(self):
+        for params in [{}, {'category': 'electronics'}, {'condition': 'new', 'min_price': '10', 'max_price': '50'},
+                       {'featured': 'true'}]:
+            from_counts = self.facets(**params)
+            cache.clear()
+            with mock.patch('app.facets.can_use_counts', return_value=False):
+                live = self.facets(**params)
+            cache.clear()
+            self.assertEqual(from_counts, live, params)
+
+    def test_search_falls_back_to_live_aggregation(self):
+        data = self.facets(search='radio')
+
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['facets']['condition']['used'], 1)
+
+
+# Double-entry ledger
+
+
+def ledger_balance(user, currency='USD'):
+    return LedgerAccount.objects.get(key=ledger.account_key(ledger.WALLET, currency, user.pk)).balance
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        ledger.record_transaction(self.alice, 'deposit', Decimal('100'), 'USD')
+
+    def test_deposit_posts_balanced_entries(self):
+        txn = Transaction.objects.get(user=self.alice, transaction_type='deposit')
+
+        amounts = sorted(entry.amount for entry in txn.ledger_entries.all())
+        self.assertEqual(amounts, [Decimal('-100'), Decimal('100')])
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('100'))
+        self.assertEqual(ledger_balance(self.alice), Decimal('100'))
+
+    def test_transfer_with_fee(self):
+        ledger.record_transaction(self.alice, 'transfer', Decimal('30'), 'USD', recipient=self.bob, fee_amount=Decimal('2'))
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('68'))
+        self.assertEqual(ledger.wallet_balance(self.bob, 'USD'), Decimal('30'))
+        fees = LedgerAccount.objects.get(key=ledger.account_key('fees', 'USD'))
+        self.assertEqual(fees.balance, Decimal('2'))
+        self.assertEqual(sum(LedgerEntry.objects.values_list('amount', flat=True)), 0)
+
+    def test_overdraw_rolls_back(self):
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.record_transaction(self.alice, 'purchase', Decimal('150'), 'USD')
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('100'))
+        self.assertFalse(Transaction.objects.filter(transaction_type='purchase').exists())
+
+    def test_frozen_wallet_cannot_be_debited(self):
+        Wallet.objects.filter(user=self.alice).update(is_frozen=True)
+
+        with self.assertRaises(ledger.WalletFrozen):
+            ledger.record_transaction(self.alice, 'purchase', Decimal('10'), 'USD')
+
+        self.assertEqual(ledger_balance(self.alice), Decimal('100'))
+
+    def test_complete_posts_once(self):
+        txn = Transaction.objects.create(
+            user=self.alice, transaction_type='purchase', amount=Decimal('40'), currency='USD', description='Order'
+        )
+
+        ledger.complete_transaction(txn)
+        with self.assertRaises(ledger.LedgerError):
+            ledger.complete_transaction(txn)
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('60'))
+        self.assertEqual(txn.ledger_entries.count(), 2)
+
+    def test_cancel_reverses_completed_transaction(self):
+        txn = ledger.record_transaction(self.alice, 'purchase', Decimal('40'), 'USD')
+
+        ledger.cancel_transaction(txn)
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('100'))
+        self.assertEqual(ledger_balance(self.alice), Decimal('100'))
+        self.assertEqual(txn.ledger_entries.filter(reversal=True).count(), 2)
+        with self.assertRaises(ledger.LedgerError):
+            ledger.cancel_transaction(txn)
+
+    def test_adjustment_is_balanced_against_the_system_account(self):
+        ledger.post_adjustment(self.alice, 'USD', Decimal('-25'), 'Chargeback')
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('75'))
+        self.assertEqual(ledger_balance(self.alice), Decimal('75'))
+        adjustments = LedgerAccount.objects.get(key=ledger.account_key(ledger.ADJUSTMENTS, 'USD'))
+        self.assertEqual(adjustments.balance, Decimal('25'))
+        self.assertEqual(set(LedgerEntry.objects.filter(transaction=None).values_list('memo', flat=True)), {'Chargeback'})
+
+    def test_adjustment_cannot_overdraw(self):
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.post_adjustment(self.alice, 'USD', Decimal('-101'), 'Too much')
+        with self.assertRaises(ledger.LedgerError):
+            ledger.post_adjustment(self.alice, 'USD', Decimal('0'), 'Nothing')
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('100'))
+
+
+class LedgerAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass12345')
+        self.client.force_login(self.admin)
+        self.alice = make_user('alice')
+        ledger.record_transaction(self.alice, 'deposit', Decimal('100'), 'USD')
+        self.wallet = Wallet.objects.get(user=self.alice)
+
+    def change_wallet(self, **fields):
+        data = {
+            'is_frozen': '', 'freeze_reason': '', 'daily_withdrawal_limit': '5000.00',
+            'monthly_withdrawal_limit': '50000.00', 'adjustment_currency': '', 'adjustment_amount': '',
+            'adjustment_memo': '', **fields
+        }
+        return self.client.post(f'/admin/app/wallet/{self.wallet.pk}/change/', data)
+
+    def test_balance_fields_are_read_only(self):
+        response = self.change_wallet(usd_balance='9999.00', freeze_reason='Review')
+
+        self.assertEqual(response.status_code, 302)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.usd_balance, Decimal('100'))
+        self.assertEqual(self.wallet.freeze_reason, 'Review')
+
+    def test_stale_form_does_not_undo_postings(self):
+        # The ledger moves the balance after the form was opened
+        ledger.record_transaction(self.alice, 'deposit', Decimal('50'), 'USD')
+
+        self.change_wallet(freeze_reason='Review')
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('150'))
+
+    def test_adjustment_is_posted_to_the_ledger(self):
+        self.change_wallet(adjustment_currency='USD', adjustment_amount='15', adjustment_memo='Goodwill')
+
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('115'))
+        self.assertEqual(ledger_balance(self.alice), Decimal('115'))
+        entry = LedgerEntry.objects.get(transaction=None, amount=Decimal('15'))
+        self.assertEqual(entry.memo, 'Adjustment by admin: Goodwill')
+
+    def test_adjustment_needs_a_memo(self):
+        response = self.change_wallet(adjustment_currency='USD', adjustment_amount='15')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('100'))
+
+    def test_actions_post_and_reverse(self):
+        txn = Transaction.objects.create(
+            user=self.alice, transaction_type='purchase', amount=Decimal('40'), currency='USD', description='Order'
+        )
+        url = '/admin/app/transaction/'
+
+        self.client.post(url, {'action': 'complete_transactions', '_selected_action': [txn.pk]})
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('60'))
+
+        self.client.post(url, {'action': 'cancel_transactions', '_selected_action': [txn.pk]})
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'cancelled')
+        self.assertEqual(ledger.wallet_balance(self.alice, 'USD'), Decimal('100'))
+        self.assertEqual(ledger_balance(self.alice), Decimal('100'))
+
+
+# Streaming transaction export
+
+def make_transaction(user, amount, created_at=None, **fields):
+    fields = {'transaction_type': 'deposit', 'currency': 'USD', 'status': 'completed', 'description': 'Deposit', **fields}
+    txn = Transaction.objects.create(user=user, amount=Decimal(amount), **fields)
+    if created_at:
+        Transaction.objects.filter(pk=txn.pk).update(created_at=created_at)
+        txn.created_at = created_at
+    return txn
+
+
+class TransactionExportTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        now = timezone.now()
+        self.old = make_transaction(self.user, '10', now - timedelta(days=400))
+        self.recent = make_transaction(self.user, '20', now - timedelta(days=2), transaction_type='withdrawal')
+        make_transaction(make_user('bob'), '99', now - timedelta(days=1))
+        archive_history()
+
+    def export(self, **params):
+        response = self.client.get('/api/transactions/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_merges_hot_and_archived_rows_in_order(self):
+        self.assertTrue(TransactionArchive.objects.filter(pk=self.old.pk).exists())
+
+        rows = list(csv.reader(StringIO(self.export())))
+
+        self.assertEqual(rows[0][:3], ['id', 'created_at', 'completed_at'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.old.pk), str(self.recent.pk)])
+        self.assertEqual([row[6] for row in rows[1:]], ['10.00000000', '20.00000000'])
+
+    def test_ndjson_with_filters(self):
+        body = self.export(file_format='ndjson', transaction_type='withdrawal')
+
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['id'], records[0]['user']), (str(self.recent.pk), 'alice'))
+
+    def test_date_bounds(self):
+        day = timezone.localdate(self.old.created_at).isoformat()
+
+        rows = list(csv.reader(StringIO(self.export(date_from=day, date_to=day))))
+
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.old.pk)])
+
+    def test_staff_can_export_every_user(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        rows = list(csv.reader(StringIO(self.export(user='all'))))
+
+        self.assertEqual(len(rows), 4)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/transactions/export/', {'file_format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/transactions/export/', {'date_from': 'soon'}).status_code, 400)
+
+    def test_merged_rows_are_read_lazily(self):
+        archived = TransactionArchive.objects.filter(user=self.user).order_by('created_at')
+        hot = Transaction.objects.filter(user=self.user).order_by('created_at')
+
+        with self.assertNumQueries(0):
+            rows = merged_export_rows(archived, hot)
+        self.assertEqual([row[0] for row in rows], [self.old.pk, self.recent.pk])
+
+
+# Materialized wallet summary
+
+class WalletSummaryTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        cache.clear()
+
+    def deposit(self, amount, currency='USD'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ledger.record_transaction(self.user, 'deposit', Decimal(amount), currency)
+
+    def tables(self, queries):
+        """Tables other than the cache's read by `queries`"""
+        return [
+            table for table in ('app_walletsummary', 'app_wallet', 'app_transaction')
+            for query in queries.captured_queries if f'FROM "{table}"' in query['sql']
+        ]
+
+    def test_postings_refresh_the_summary(self):
+        self.deposit('100')
+        self.deposit('0.01', 'BTC')
+
+        summary = get_wallet_summary(self.user)
+
+        self.assertEqual(summary['usd_balance'], Decimal('100'))
+        self.assertEqual(summary['btc_balance'], Decimal('0.01'))
+        self.assertEqual(summary['total_transactions'], 2)
+        self.assertEqual(summary['total_balance_usd'], total_usd({'USD': Decimal('100'), 'BTC': Decimal('0.01')}))
+        self.assertEqual(summary['recent_transactions'][0]['currency'], 'BTC')
+
+    def test_reads_are_served_from_the_cache(self):
+        self.deposit('100')
+        get_wallet_summary(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            summary = get_wallet_summary(self.user)
+        self.assertEqual(self.tables(queries), [])
+        self.assertEqual(summary['usd_balance'], Decimal('100'))
+
+    def test_cache_miss_is_one_query(self):
+        self.deposit('100')
+        cache.delete(f'wallet-summary:{self.user.pk}')
+
+        with CaptureQueriesContext(connection) as queries:
+            summary = get_wallet_summary(self.user)
+        self.assertEqual(self.tables(queries), ['app_walletsummary'])
+        self.assertEqual(summary['total_transactions'], 1)
+
+    def test_recent_list_is_capped(self):
+        for _ in range(RECENT_TRANSACTIONS + 2):
+            self.deposit('1')
+
+        summary = get_wallet_summary(self.user)
+
+        self.assertEqual(len(summary['recent_transactions']), RECENT_TRANSACTIONS)
+        self.assertEqual(summary['total_transactions'], RECENT_TRANSACTIONS + 2)
+
+    def test_count_includes_archived_transactions(self):
+        make_transaction(self.user, '5', timezone.now() - timedelta(days=400))
+        archive_history()
+        WalletSummary.objects.filter(user=self.user).delete()
+        cache.clear()
+
+        summary = refresh_wallet_summary(self.user.pk)
+
+        self.assertEqual(summary['total_transactions'], 1)
+
+    def test_deleting_a_transaction_adjusts_the_count(self):
+        txn = make_transaction(self.user, '5')
+        refresh_wallet_summary(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            txn.delete()
+
+        self.assertEqual(get_wallet_summary(self.user)['total_transactions'], 0)
+
+    def test_summary_endpoint(self):
+        self.deposit('40')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get('/api/wallets/summary/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['usd_balance']), Decimal('40'))
+        self.assertEqual(response.data['total_transactions'], 1)
+
+
+# Exchange rates
+
+class StaticRates:
+    def __init__(self, **rates):
+        self.rates = {currency: Decimal(rate) for currency, rate in rates.items()}
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return dict(self.rates, USD=Decimal('1'))
+
+
+class ExchangeRateTests(TestCase):
+    def setUp(self):
+        self.provider = StaticRates(NGN='1500', BTC='0.00002', ETH='0.0004')
+        patcher = mock.patch.object(exchange_rates, 'rates', RateCache(self.provider, ttl=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_conversions(self):
+        self.assertEqual(to_usd('3000', 'NGN'), Decimal('2.00'))
+        self.assertEqual(to_usd('0.001', 'BTC'), Decimal('50.00'))
+        with self.assertRaises(ValueError):
+            to_usd('1', 'EUR')
+
+    def test_total_rounds_only_the_sum(self):
+        # Each is worth 0.004 USD, which would round away on its own
+        balances = {'USD': Decimal('0'), 'NGN': Decimal('6'), 'BTC': Decimal('0.00000008'), 'ETH': Decimal('0.0000016')}
+
+        self.assertEqual(total_usd(balances), Decimal('0.01'))
+
+    def test_rates_are_loaded_once_per_ttl(self):
+        with mock.patch('app.exchange_rates.time.monotonic', return_value=1000.0):
+            for _ in range(3):
+                to_usd('1500', 'NGN')
+        self.assertEqual(self.provider.fetches, 1)
+
+        self.provider.rates['NGN'] = Decimal('1000')
+        with mock.patch('app.exchange_rates.time.monotonic', return_value=1061.0):
+            self.assertEqual(to_usd('1500', 'NGN'), Decimal('1.50'))
+        self.assertEqual(self.provider.fetches, 2)
+
+    def test_wallet_totals(self):
+        wallets = [
+            {'usd_balance': Decimal('10'), 'ngn_balance': Decimal('1500'), 'btc_balance': 0, 'eth_balance': 0},
+            {'usd_balance': 0, 'ngn_balance': 0, 'btc_balance': Decimal('0.0001'), 'eth_balance': Decimal('0.0004')},
+        ]
+
+        totals = wallet_totals_usd(wallets)
+        array = wallet_totals_usd_array([[float(value) for value in row.values()] for row in wallets])
+
+        self.assertEqual(totals, [Decimal('11.00'), Decimal('6.00')])
+        numpy.testing.assert_allclose(array, [11.0, 6.0])
+
+
+class FixtureRateProviderTests(TestCase):
+    def test_system_settings_override_ngn(self):
+        self.assertEqual(FixtureRateProvider().fetch()['BTC'], Decimal('0.0000148'))
+
+        SystemSettings.objects.create(exchange_rate_usd_to_ngn=Decimal('1600'))
+
+        self.assertEqual(FixtureRateProvider().fetch()['NGN'], Decimal('1600'))
+
+    def test_saving_settings_invalidates_the_process_cache(self):
+        with mock.patch.object(exchange_rates.rates, 'invalidate') as invalidate:
+            SystemSettings.objects.create()
+
+        invalidate.assert_called_once_with()
+
+
+# Rolling withdrawal limits
+
+class WithdrawalLimitTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        Wallet.objects.filter(user=self.user).update(
+            daily_withdrawal_limit=Decimal('100'), monthly_withdrawal_limit=Decimal('250')
+        )
+        ledger.record_transaction(self.user, 'deposit', Decimal('1000'), 'USD')
+        exchange_rates.rates.invalidate()
+
+    def withdraw(self, amount, currency='USD'):
+        return ledger.record_transaction(self.user, 'withdrawal', Decimal(amount), currency)
+
+    def test_completed_withdrawals_are_aggregated(self):
+        self.withdraw('30')
+        self.withdraw('20')
+
+        aggregate = WithdrawalAggregate.objects.get(user=self.user, period='day')
+        self.assertEqual((aggregate.total, aggregate.count), (Decimal('50'), 2))
+        self.assertEqual(withdrawn_usd(self.user.pk), (Decimal('50'), Decimal('50')))
+
+    def test_daily_limit_rolls_back_the_posting(self):
+        self.withdraw('80')
+
+        with self.assertRaises(WithdrawalLimitExceeded):
+            self.withdraw('30')
+
+        self.assertEqual(ledger.wallet_balance(self.user, 'USD'), Decimal('920'))
+        self.assertEqual(Transaction.objects.filter(transaction_type='withdrawal').count(), 1)
+
+    def test_monthly_limit_counts_earlier_days(self):
+        month = period_starts()[1]
+        WithdrawalAggregate.objects.create(
+            user=self.user, period='month', period_start=month, currency='USD', total=Decimal('200'), count=3
+        )
+
+        with self.assertRaises(WithdrawalLimitExceeded) as raised:
+            self.withdraw('60')
+        self.assertIn('Monthly', str(raised.exception))
+
+    def test_limits_are_in_usd(self):
+        # 150,000 NGN is 100 USD at the fixture rate
+        ledger.record_transaction(self.user, 'deposit', Decimal('300000'), 'NGN')
+
+        self.withdraw('150000', 'NGN')
+        with self.assertRaises(WithdrawalLimitExceeded):
+            self.withdraw('1', 'USD')
+
+    def test_batch_counts_earlier_withdrawals(self):
+        now = timezone.now()
+        batch = [
+            Transaction(user=self.user, transaction_type='withdrawal', amount=Decimal(amount), currency='USD',
+                        completed_at=now)
+            for amount in ('60', '60')
+        ]
+
+        with self.assertRaises(WithdrawalLimitExceeded):
+            check_batch(batch)
+
+    def test_batch_counts_earlier_withdrawals_in_other_currencies(self):
+        # 90,000 NGN is 60 USD at the fixture rate
+        now = timezone.now()
+        batch = [
+            Transaction(user=self.user, transaction_type='withdrawal', amount=Decimal(amount), currency=currency,
+                        completed_at=now)
+            for amount, currency in (('60', 'USD'), ('90000', 'NGN'))
+        ]
+
+        with self.assertRaises(WithdrawalLimitExceeded):
+            check_batch(batch)
+
+    def test_cancelling_releases_the_limit(self):
+        txn = self.withdraw('90')
+
+        ledger.cancel_transaction(txn)
+        self.withdraw('90')
+
+        self.assertEqual(withdrawn_usd(self.user.pk)[0], Decimal('90'))
+
+    def test_rebuild_repairs_drift(self):
+        self.withdraw('40')
+        WithdrawalAggregate.objects.update(total=Decimal('1'))
+        out = StringIO()
+
+        call_command('rebuild_withdrawal_aggregates', stdout=out)
+
+        self.assertIn('2 aggregate rows had drifted', out.getvalue())
+        self.assertEqual(withdrawn_usd(self.user.pk), (Decimal('40'), Decimal('40')))
+
+
+# Idempotency keys
+
+class IdempotencyKeyTests(TestCase):
+    url = '/api/merchant-applications/'
+
+    def setUp(self):
+        self.user = make_user('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def apply(self, key, name='Alice Store'):
+        return self.client.post(self.url, {'business_name': name, 'business_type': 'electronics'},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.apply('key-1')
+        retry = self.apply('key-1')
+
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(MerchantApplication.objects.filter(user=self.user).count(), 1)
+
+    def test_key_reused_for_a_different_request(self):
+        self.apply('key-1')
+
+        response = self.apply('key-1', name='Other Store')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(MerchantApplication.objects.filter(user=self.user).count(), 1)
+
+    def test_keys_are_scoped_to_the_user(self):
+        self.apply('key-1')
+        self.client.force_authenticate(make_user('bob'))
+
+        response = self.apply('key-1')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(MerchantApplication.objects.count(), 2)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.client.post(self.url, {'business_name': 'A'}, format='json')
+        self.client.post(self.url, {'business_name': 'A'}, format='json')
+
+        self.assertEqual(MerchantApplication.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_request_in_progress_conflicts(self):
+        self.apply('key-1')
+        IdempotencyKey.objects.update(status='processing')
+
+        with mock.patch('app.idempotency.WAIT_TIMEOUT', 0):
+            response = self.apply('key-1')
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_retry_takes_over_a_key_whose_lease_lapsed(self):
+        self.apply('key-1')
+        # The worker that claimed the key died before storing a response
+        IdempotencyKey.objects.update(status='processing', lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.apply('key-1')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        record = IdempotencyKey.objects.get()
+        self.assertEqual((record.status, record.response_body['id']), ('completed', response.data['id']))
+        self.assertEqual(self.apply('key-1')['Idempotent-Replayed'], 'true')
+
+    def test_failed_request_releases_the_key(self):
+        with mock.patch('app.views.MerchantApplicationViewSet.perform_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.apply('key-1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self.apply('key-1').status_code, 201)
+
+    def test_expired_keys_can_be_reused_and_purged(self):
+        first = self.apply('key-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        second = self.apply('key-1')
+        self.assertNotEqual(second.data['id'], first.data['id'])
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.apply('key-2')
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 expired', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-2'])
+
+
+# Leased batch settlement
+
+class FakeGateway:
+    def __init__(self, declined=(), unanswered=()):
+        self.declined = set(declined)
+        self.unanswered = set(unanswered)
+
+    def settle(self, transactions):
+        return {
+            txn.pk: SettlementResult(success=txn.pk not in self.declined, external_reference=f'gw-{txn.pk}')
+            for txn in transactions if txn.pk not in self.unanswered
+        }
+
+
+class SettlementTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        ledger.record_transaction(self.user, 'deposit', Decimal('100'), 'USD')
+
+    def pending(self, amount, transaction_type='purchase'):
+        return make_transaction(self.user, amount, transaction_type=transaction_type, status='pending')
+
+    def test_claimed_rows_are_leased_to_one_worker(self):
+        first, second = self.pending('10'), self.pending('20')
+
+        claimed = claim_batch('worker-a', batch_size=10)
+
+        self.assertEqual({txn.pk for txn in claimed}, {first.pk, second.pk})
+        self.assertTrue(all(txn.status == 'processing' and txn.lease_owner == 'worker-a' for txn in claimed))
+        self.assertEqual(claim_batch('worker-b', batch_size=10), [])
+
+    def test_expired_lease_can_be_taken_over(self):
+        txn = self.pending('10')
+        claimed = claim_batch('worker-a')
+        Transaction.objects.filter(pk=txn.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual([row.pk for row in claim_batch('worker-b')], [txn.pk])
+
+        # worker-a's late results are dropped
+        stats = apply_results('worker-a', claimed, FakeGateway().settle(claimed))
+        self.assertEqual(stats.completed, 0)
+        txn.refresh_from_db()
+        self.assertEqual((txn.status, txn.lease_owner), ('processing', 'worker-b'))
+
+    def test_results_are_posted_and_written_back(self):
+        paid, declined, unanswered = self.pending('30'), self.pending('20'), self.pending('10')
+
+        stats = settle_batch('worker-a', FakeGateway(declined=[declined.pk], unanswered=[unanswered.pk]))
+
+        self.assertEqual((stats.claimed, stats.completed, stats.failed, stats.retried), (3, 1, 1, 1))
+        paid.refresh_from_db()
+        declined.refresh_from_db()
+        unanswered.refresh_from_db()
+        self.assertEqual((paid.status, paid.external_reference, paid.lease_owner), ('completed', f'gw-{paid.pk}', None))
+        self.assertEqual(declined.status, 'failed')
+        self.assertEqual((unanswered.status, unanswered.lease_owner), ('processing', 'worker-a'))
+        self.assertEqual(ledger.wallet_balance(self.user, 'USD'), Decimal('70'))
+        self.assertEqual(paid.ledger_entries.count(), 2)
+
+    def test_ledger_rejection_fails_only_that_transaction(self):
+        affordable, overdraw = self.pending('60'), self.pending('60')
+
+        stats = settle_batch('worker-a', FakeGateway())
+
+        self.assertEqual((stats.completed, stats.failed), (1, 1))
+        affordable.refresh_from_db()
+        overdraw.refresh_from_db()
+        self.assertEqual((affordable.status, overdraw.status), ('completed', 'failed'))
+        self.assertIsNone(overdraw.completed_at)
+        self.assertEqual(ledger.wallet_balance(self.user, 'USD'), Decimal('40'))
+
+    def test_gateway_error_leaves_the_lease_to_expire(self):
+        txn = self.pending('10')
+        gateway = mock.Mock()
+        gateway.settle.side_effect = ConnectionError
+
+        with self.assertLogs('app.settlement', 'ERROR'):
+            stats = settle_batch('worker-a', gateway)
+
+        self.assertEqual((stats.claimed, stats.retried), (1, 1))
+        txn.refresh_from_db()
+        self.assertEqual((txn.status, txn.lease_owner), ('processing', 'worker-a'))
+
+    def test_command_settles_with_the_stub_gateway(self):
+        txn = self.pending('10', transaction_type='deposit')
+        out = StringIO()
+
+        call_command('settle_transactions', '--worker-id', 'cmd', stdout=out)
+
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'completed')
+        self.assertTrue(txn.external_reference.startswith('stub-'))
+        self.assertEqual(ledger.wallet_balance(self.user, 'USD'), Decimal('110'))
+
+
+# Hot/cold history archive
+
+class HistoryArchiveTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.long_ago = timezone.now() - timedelta(days=400)
+
+    def test_only_finished_unlinked_rows_are_archived(self):
+        old = make_transaction(self.user, '1', self.long_ago)
+        old_pending = make_transaction(self.user, '2', self.long_ago, status='pending')
+        linked = make_transaction(self.user, '3', self.long_ago)
+        Notification.objects.create(user=self.user, notification_type='transaction', title='Paid', message='Paid',
+                                    related_transaction=linked)
+        recent = make_transaction(self.user, '4')
+
+        moved = archive_history()
+
+        self.assertEqual(moved['transactions'], 1)
+        self.assertEqual(list(TransactionArchive.objects.values_list('pk', flat=True)), [old.pk])
+        self.assertEqual(set(Transaction.objects.values_list('pk', flat=True)), {old_pending.pk, linked.pk, recent.pk})
+
+    def test_activity_is_archived_first_so_its_transaction_follows(self):
+        txn = make_transaction(self.user, '1', self.long_ago)
+        activity = UserActivity.objects.create(user=self.user, activity_type='login', related_transaction=txn)
+        UserActivity.objects.filter(pk=activity.pk).update(created_at=self.long_ago)
+
+        moved = archive_history()
+
+        self.assertEqual(moved, {'activity': 1, 'transactions': 1})
+        self.assertEqual(UserActivityArchive.objects.get().related_transaction_id, txn.pk)
+
+    def test_ledger_entries_keep_pointing_at_archived_transactions(self):
+        txn = ledger.record_transaction(self.user, 'deposit', Decimal('10'), 'USD')
+        Transaction.objects.filter(pk=txn.pk).update(created_at=self.long_ago)
+
+        archive_history()
+
+        self.assertTrue(TransactionArchive.objects.filter(pk=txn.pk).exists())
+        self.assertEqual(LedgerEntry.objects.filter(transaction_id=txn.pk).count(), 2)
+
+    def test_chunks_are_bounded(self):
+        for _ in range(5):
+            make_transaction(self.user, '1', self.long_ago)
+
+        moved = archive_history(chunk_size=2, max_chunks=2)
+
+        self.assertEqual(moved['transactions'], 4)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_list_pages_through_both_tables(self):
+        now = timezone.now()
+        for month in range(25):
+            make_transaction(self.user, str(month + 1), now - timedelta(days=month * 30))
+        archive_history()
+        self.assertTrue(Transaction.objects.exists() and TransactionArchive.objects.exists())
+
+        first = self.client.get('/api/transactions/')
+        second = self.client.get('/api/transactions/', {'page': 2})
+
+        self.assertEqual(first.data['count'], 25)
+        amounts = [Decimal(row['amount']) for row in first.data['results'] + second.data['results']]
+        self.assertEqual(amounts, [Decimal(month + 1) for month in range(25)])
+
+    def test_ordering_and_filters_apply_to_both_tables(self):
+        make_transaction(self.user, '5', self.long_ago)
+        make_transaction(self.user, '7', self.long_ago, transaction_type='withdrawal')
+        make_transaction(self.user, '6')
+        archive_history()
+
+        response = self.client.get('/api/transactions/', {'ordering': '-amount', 'transaction_type': 'deposit'})
+
+        self.assertEqual([Decimal(row['amount']) for row in response.data['results']], [Decimal('6'), Decimal('5')])
+
+    def test_retrieve_falls_back_to_the_archive(self):
+        txn = make_transaction(self.user, '1', self.long_ago)
+        other = make_transaction(make_user('bob'), '1', self.long_ago)
+        archive_history()
+
+        response = self.client.get(f'/api/transactions/{txn.pk}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], str(txn.pk))
+        self.assertEqual(self.client.get(f'/api/transactions/{other.pk}/').status_code, 404)
+
+    def test_activity_history_merges_the_archive(self):
+        for activity_type in ('login', 'logout'):
+            UserActivity.objects.create(user=self.user, activity_type=activity_type)
+        UserActivity.objects.filter(activity_type='login').update(created_at=self.long_ago)
+        archive_history()
+
+        response = self.client.get('/api/user-activity/')
+
+        self.assertEqual([row['activity_type'] for row in response.data['results']], ['logout', 'login'])
+
+    def test_command(self):
+        make_transaction(self.user, '1', timezone.now() - timedelta(days=40))
+        out = StringIO()
+
+        call_command('archive_history', '--days', '30', stdout=out)
+
+        self.assertIn('Archived 1 transactions', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('archive_history', '--days', '0')
+
+
+# Balance reconciliation
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        ledger.record_transaction(self.alice, 'deposit', Decimal('100'), 'USD')
+        ledger.record_transaction(self.bob, 'deposit', Decimal('0.00000001'), 'BTC')
+
+    def reconcile_all(self, shards=1):
+        results = reconcile(shards)
+        return [row for result in results for row in result['drift']], results
+
+    def test_posted_balances_reconcile(self):
+        ledger.record_transaction(self.alice, 'transfer', Decimal('40'), 'USD', recipient=self.bob)
+
+        drift, results = self.reconcile_all()
+
+        self.assertEqual(drift, [])
+        self.assertEqual(results[0]['scanned']['wallets'], 2)
+        self.assertEqual(results[0]['unposted_count'], 0)
+
+    def test_wallet_column_drift(self):
+        Wallet.objects.filter(user=self.bob).update(btc_balance=Decimal('0.00000002'))
+
+        drift, _ = self.reconcile_all()
+
+        self.assertEqual(drift, [{
+            'user_id': self.bob.pk, 'currency': 'BTC', 'entries_total': '0.00000001',
+            'ledger_balance': '0.00000001', 'wallet_balance': '0.00000002',
+        }])
+
+    def test_account_balance_drift(self):
+        LedgerAccount.objects.filter(key=ledger.account_key(ledger.WALLET, 'USD', self.alice.pk)).update(balance=0)
+
+        drift, _ = self.reconcile_all()
+
+        self.assertEqual([(row['user_id'], row['ledger_balance']) for row in drift], [(self.alice.pk, '0.00000000')])
+
+    def test_unposted_transactions(self):
+        unposted = make_transaction(self.alice, '5')
+        make_transaction(self.alice, '5', status='pending')
+        reversed_txn = ledger.record_transaction(self.alice, 'purchase', Decimal('10'), 'USD')
+        ledger.cancel_transaction(reversed_txn)
+
+        _, results = self.reconcile_all()
+
+        self.assertEqual((results[0]['unposted_count'], results[0]['unposted']), (1, [str(unposted.pk)]))
+
+    def test_transactions_before_opening_balances_are_covered(self):
+        make_transaction(self.alice, '5')
+        opening = LedgerAccount.objects.create(key='system:opening:USD', kind='opening', currency='USD')
+        LedgerEntry.objects.create(account=opening, amount=0)
+
+        self.assertEqual(reconcile(1)[0]['unposted_count'], 0)
+
+    def test_shards_cover_every_user(self):
+        Wallet.objects.filter(user=self.alice).update(usd_balance=1)
+        Wallet.objects.filter(user=self.bob).update(btc_balance=1)
+
+        shards = user_id_shards(2)
+        drift, results = self.reconcile_all(shards=2)
+
+        self.assertEqual((shards[0][0], shards[-1][1]), (self.alice.pk, self.bob.pk + 1))
+        self.assertEqual(len(results), 2)
+        self.assertEqual({row['user_id'] for row in drift}, {self.alice.pk, self.bob.pk})
+
+    def test_command_writes_a_report(self):
+        Wallet.objects.filter(user=self.alice).update(usd_balance=1)
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'report.json')
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_balances', '--workers', '1', '--output', path, '--fail-on-drift', stdout=StringIO())
+
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report['drift_count'], 1)
+        self.assertEqual(report['drift'][0]['wallet_balance'], '1.00000000')
+
+
+# Time-ordered identifiers
+
+class TimeOrderedIdTests(TestCase):
+    def test_uuid7_layout(self):
+        before = time.time_ns() // 1_000_000
+        value = uuid7()
+        after = time.time_ns() // 1_000_000
+
+        self.assertEqual((value.version, value.variant), (7, uuid.RFC_4122))
+        self.assertTrue(before <= uuid7_timestamp_ms(value) <= after)
+
+    def test_uuid7_is_strictly_increasing(self):
+        values = [uuid7() for _ in range(5000)]
+
+        self.assertEqual(values, sorted(set(values)))
+
+    def test_counter_overflow_and_clock_going_back_keep_order(self):
+        with mock.patch('app.ids.time.time_ns', return_value=1_700_000_000_000 * 1_000_000):
+            values = [uuid7() for _ in range(5000)]
+        with mock.patch('app.ids.time.time_ns', return_value=1_600_000_000_000 * 1_000_000):
+            values.append(uuid7())
+
+        self.assertEqual(values, sorted(set(values)))
+
+    def test_base32_round_trip(self):
+        value = uuid7()
+        text = encode_base32(value)
+
+        self.assertEqual(len(text), 26)
+        self.assertEqual(decode_base32(text), value)
+        self.assertEqual(decode_base32(text.lower().replace('0', 'o').replace('1', 'l')), value)
+        for bad in ('', 'U' * 26, '8' + '0' * 25):
+            with self.assertRaises(ValueError):
+                decode_base32(bad)
+
+    def test_references_sort_by_creation(self):
+        references = [new_transaction_reference() for _ in range(100)]
+
+        self.assertTrue(all(reference.startswith('TX-') and len(reference) == 29 for reference in references))
+        self.assertEqual(references, sorted(references))
+
+    def test_models_default_to_uuid7(self):
+        user = make_user('alice')
+        txn = make_transaction(user, '1')
+        product = make_product(user)
+
+        self.assertEqual((txn.pk.version, product.pk.version), (7, 7))
+        self.assertEqual(decode_base32(txn.reference[3:]).version, 7)
+
+    def test_backfilled_references_carry_created_at(self):
+        txn = make_transaction(make_user('alice'), '1', timezone.now() - timedelta(days=30))
+        Transaction.objects.filter(pk=txn.pk).update(reference=None)
+        migration = importlib.import_module('app.migrations.0016_time_ordered_ids')
+
+        migration.backfill_references(django_apps, None)
+
+        reference = Transaction.objects.get(pk=txn.pk).reference
+        self.assertEqual(uuid7_timestamp_ms(decode_base32(reference[3:])), int(txn.created_at.timestamp() * 1000))
+
+
+# Referral qualification
+
+def make_referral(referrer, referee, expires_in=timedelta(days=30)):
+    return Referral.objects.create(
+        referrer=referrer, referee=referee, referral_code=referrer.referral_code, expires_at=timezone.now() + expires_in
+    )
+
+
+class ReferralQualificationTests(TestCase):
+    def setUp(self):
+        self.program = ReferralProgram.objects.create(
+            referrer_bonus_usd=Decimal('10'), referee_bonus_usd=Decimal('5'), minimum_deposit_usd=Decimal('25')
+        )
+        self.referrer = make_user('alice')
+        self.referee = make_user('bob')
+        self.referral = make_referral(self.referrer, self.referee)
+
+    def deposit(self, user, amount, currency='USD'):
+        return ledger.record_transaction(user, 'deposit', Decimal(amount), currency)
+
+    def test_deposits_of_referees_are_queued(self):
+        txn = self.deposit(self.referee, '10')
+        self.deposit(self.referrer, '10')
+
+        evaluation = ReferralEvaluation.objects.get()
+        self.assertEqual((evaluation.referral_id, evaluation.transaction_id), (self.referral.pk, txn.pk))
+        self.assertEqual(evaluation.deposit_usd, Decimal('10.00'))
+
+    def test_deposits_accumulate_until_the_minimum(self):
+        self.deposit(self.referee, '10')
+        self.assertEqual(evaluate_batch().qualified, 0)
+        self.referral.refresh_from_db()
+        self.assertEqual((self.referral.status, self.referral.deposit_amount), ('pending', Decimal('10')))
+
+        # 22,500 NGN is 15 USD at the fixture rate
+        exchange_rates.rates.invalidate()
+        self.deposit(self.referee, '22500', 'NGN')
+        stats = evaluate_batch()
+
+        self.assertEqual((stats.qualified, stats.paid, stats.bonus_transactions), (1, 1, 2))
+        self.referral.refresh_from_db()
+        self.assertEqual(self.referral.status, 'paid')
+        self.assertEqual(self.referral.referrer_transaction.amount, Decimal('10'))
+        self.assertEqual(ledger.wallet_balance(self.referrer, 'USD'), Decimal('10'))
+        self.assertEqual(ledger.wallet_balance(self.referee, 'USD'), Decimal('15'))
+        code = ReferralCode.objects.get(user=self.referrer)
+        self.assertEqual((code.total_uses, code.total_earnings), (1, Decimal('10')))
+        self.assertFalse(ReferralEvaluation.objects.exists())
+
+    def test_deposits_after_expiry_do_not_count(self):
+        Referral.objects.filter(pk=self.referral.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.deposit(self.referee, '100')
+
+        self.assertEqual(evaluate_batch().evaluated, 1)
+
+        self.referral.refresh_from_db()
+        self.assertEqual((self.referral.status, self.referral.deposit_amount), ('pending', Decimal('0')))
+
+    def test_closed_program_counts_but_does_not_qualify(self):
+        ReferralProgram.objects.update(end_date=timezone.now() - timedelta(days=1))
+        self.deposit(self.referee, '100')
+
+        evaluate_batch()
+
+        self.referral.refresh_from_db()
+        self.assertEqual((self.referral.status, self.referral.deposit_amount), ('pending', Decimal('100')))
+
+    def test_qualifications_are_capped_per_code(self):
+        ReferralProgram.objects.update(max_referrals_per_user=1)
+        second = make_referral(self.referrer, make_user('carol'))
+        self.deposit(self.referee, '30')
+        self.deposit(second.referee, '30')
+
+        stats = evaluate_batch()
+
+        self.assertEqual(stats.qualified, 1)
+        self.assertEqual(ReferralCode.objects.get(user=self.referrer).total_uses, 1)
+
+    def test_rejected_bonus_leaves_the_referral_qualified(self):
+        self.deposit(self.referee, '30')
+
+        with mock.patch('app.referrals.post_transactions', side_effect=ledger.LedgerError), \
+                self.assertLogs('app.referrals', 'WARNING'):
+            stats = evaluate_batch()
+
+        self.assertEqual((stats.qualified, stats.paid), (1, 0))
+        self.referral.refresh_from_db()
+        self.assertEqual(self.referral.status, 'qualified')
+        self.assertIsNone(self.referral.referrer_transaction_id)
+        self.assertFalse(Transaction.objects.filter(transaction_type='referral_bonus').exists())
+
+    def test_rejected_bonus_is_paid_on_retry(self):
+        self.deposit(self.referee, '30')
+        with mock.patch('app.referrals.post_transactions', side_effect=ledger.LedgerError), \
+                self.assertLogs('app.referrals', 'WARNING'):
+            evaluate_batch()
+            self.assertEqual(retry_unpaid_bonuses().paid, 0)
+
+        stats = retry_unpaid_bonuses()
+
+        self.assertEqual((stats.paid, stats.bonus_transactions), (1, 2))
+        self.referral.refresh_from_db()
+        self.assertEqual(self.referral.status, 'paid')
+        self.assertEqual(ledger.wallet_balance(self.referrer, 'USD'), Decimal('10'))
+        code = ReferralCode.objects.get(user=self.referrer)
+        self.assertEqual((code.total_uses, code.total_earnings), (1, Decimal('10')))
+        self.assertEqual(retry_unpaid_bonuses().paid, 0)
+
+    def test_command_retries_rejected_bonuses(self):
+        self.deposit(self.referee, '30')
+        with mock.patch('app.referrals.post_transactions', side_effect=ledger.LedgerError), \
+                self.assertLogs('app.referrals', 'WARNING'):
+            evaluate_batch()
+        out = StringIO()
+
+        call_command('process_referrals', stdout=out)
+
+        self.assertIn('retried 1 unpaid referrals', out.getvalue())
+        self.assertEqual(Referral.objects.get(pk=self.referral.pk).status, 'paid')
+
+    def test_command_drains_the_queue(self):
+        self.deposit(self.referee, '30')
+        out = StringIO()
+
+        call_command('process_referrals', stdout=out)
+
+        self.assertIn('1 referrals qualified', out.getvalue())
+        self.assertFalse(ReferralEvaluation.objects.exists())
+
+
+# Referral counters on profiles
+
+class ReferralCounterTests(TestCase):
+    def setUp(self):
+        self.referrer = make_user('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.referrer)
+        for index, status in enumerate(('paid', 'paid', 'qualified', 'pending', 'expired')):
+            referral = make_referral(self.referrer, make_user(f'friend{index}'))
+            Referral.objects.filter(pk=referral.pk).update(
+                status=status, referrer_reward=Decimal('10') if status == 'paid' else 0
+            )
+
+    def code(self):
+        return ReferralCode.objects.get(user=self.referrer)
+
+    def test_rebuild_counts_from_the_referrals(self):
+        checked, drifted = rebuild_referral_counters(chunk_size=2)
+
+        self.assertEqual(checked, ReferralCode.objects.count())
+        self.assertEqual(drifted, 1)
+        code = self.code()
+        self.assertEqual((code.signups, code.total_uses, code.total_earnings), (5, 3, Decimal('20')))
+        self.assertEqual(rebuild_referral_counters(), (checked, 0))
+
+    def test_profile_reads_the_counters(self):
+        rebuild_referral_counters()
+
+        response = self.client.get('/api/profiles/me/')
+
+        self.assertEqual(response.data['referral_code'], self.code().code)
+        self.assertEqual((response.data['total_referrals'], response.data['referral_earnings']), (3, 20.0))
+
+    def test_profile_list_query_count_does_not_grow(self):
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get('/api/profiles/').status_code, 200)
+            return len(queries)
+
+        before = list_queries()
+        for index in range(5):
+            make_user(f'extra{index}')
+
+        self.assertEqual(list_queries(), before)
+
+    def test_migration_backfills_the_counters(self):
+        migration = importlib.import_module('app.migrations.0021_referral_code_counters')
+
+        migration.backfill_counters(django_apps, None)
+
+        self.assertEqual((self.code().total_uses, self.code().total_earnings), (3, Decimal('20')))
+
+    def test_command(self):
+        out = StringIO()
+
+        call_command('rebuild_referral_counters', stdout=out)
+
+        self.assertIn('(1 had drifted)', out.getvalue())
+        self.assertEqual(self.code().signups, 5)
+
+
+# Deterministic referral codes
+
+class ReferralCodeTests(TestCase):
+    def test_permutation_is_a_bijection(self):
+        values = [referral_codes.permute(number) for number in range(20000)]
+        top = [referral_codes.permute(number) for number in range(referral_codes.DOMAIN - 100, referral_codes.DOMAIN)]
+
+        self.assertEqual(len(set(values + top)), 20100)
+        self.assertTrue(all(0 <= value < referral_codes.DOMAIN for value in values + top))
+        with self.assertRaises(ValueError):
+            referral_codes.permute(referral_codes.DOMAIN)
+
+    def test_codes_are_short_base36_and_not_sequential(self):
+        codes = [code_for_user_id(user_id) for user_id in range(1, 6)]
+
+        self.assertTrue(all(len(code) == 8 and set(code) <= set(referral_codes.ALPHABET) for code in codes))
+        # Neighbouring ids do not share a visible prefix
+        self.assertGreater(len({code[:4] for code in codes}), 1)
+
+    def test_codes_depend_on_the_key(self):
+        with mock.patch.object(referral_codes, '_round_key', None), \
+                override_settings(REFERRAL_CODE_KEY='another key'):
+            other = code_for_user_id(1)
+
+        self.assertNotEqual(other, code_for_user_id(1))
+
+    def test_new_users_get_their_derived_code(self):
+        user = make_user('alice')
+
+        self.assertEqual(user.referral_code.code, code_for_user_id(user.pk))
+
+    def test_taken_code_falls_back_to_the_next_variant(self):
+        legacy, user = make_user('alice'), make_user('bob')
+        ReferralCode.objects.filter(user=user).delete()
+        ReferralCode.objects.filter(user=legacy).update(code=code_for_user_id(user.pk))
+
+        code = create_referral_code(user)
+
+        self.assertEqual(code.code, code_for_user_id(user.pk, variant=1))
+
+    def test_no_second_code_per_user(self):
+        user = make_user('alice')
+
+        with self.assertRaises(IntegrityError):
+            create_referral_code(user)
+        self.assertEqual(ReferralCode.objects.filter(user=user).count(), 1)
+
+    def test_gives_up_when_every_variant_is_taken(self):
+        legacy, user = make_user('alice'), make_user('bob')
+        ReferralCode.objects.filter(user=user).delete()
+        ReferralCode.objects.filter(user=legacy).update(code=code_for_user_id(user.pk))
+
+        with mock.patch.object(referral_codes, 'MAX_VARIANTS', 1), self.assertRaises(IntegrityError):
+            create_referral_code(user)
+
+
+# Referral attribution at sign-up
+
+class ReferralAttributionTests(TestCase):
+    def setUp(self):
+        code_cache.invalidate()
+        self.program = ReferralProgram.objects.create(expiry_days=14)
+        self.referrer = make_user('alice')
+        self.code = self.referrer.referral_code.code
+
+    def register(self, username, **fields):
+        data = {
+            'username': username, 'email': f'{username}@example.com', 'password': 'pass12345',
+            'password_confirm': 'pass12345', **fields
+        }
+        with mock.patch('builtins.print'):
+            return self.client.post('/auth/register/', data, content_type='application/json')
+
+    def test_attribution_reserves_a_signup(self):
+        referee = make_user('bob')
+
+        referral = attribute_referral(referee, f' {self.code.lower()} ')
+
+        self.assertEqual((referral.referrer, referral.status), (self.referrer, 'pending'))
+        self.assertAlmostEqual(referral.expires_at, timezone.now() + timedelta(days=14), delta=timedelta(minutes=1))
+        self.assertEqual(ReferralCode.objects.get(user=self.referrer).signups, 1)
+
+    def test_rejected_codes(self):
+        self.assertIsNone(attribute_referral(self.referrer, self.code))
+        self.assertIsNone(attribute_referral(make_user('bob'), 'NOSUCHCD'))
+
+        ReferralCode.objects.filter(user=self.referrer).update(is_active=False)
+        code_cache.invalidate()
+        self.assertIsNone(attribute_referral(make_user('carol'), self.code))
+        self.assertFalse(Referral.objects.exists())
+
+    def test_no_running_program(self):
+        ReferralProgram.objects.update(start_date=timezone.now() + timedelta(days=1))
+
+        self.assertIsNone(attribute_referral(make_user('bob'), self.code))
+
+    def test_signups_are_capped(self):
+        ReferralProgram.objects.update(max_referrals_per_user=1)
+
+        self.assertIsNotNone(attribute_referral(make_user('bob'), self.code))
+        self.assertIsNone(attribute_referral(make_user('carol'), self.code))
+
+        self.assertEqual(ReferralCode.objects.get(user=self.referrer).signups, 1)
+
+    def test_registration_with_a_code(self):
+        response = self.register('bob', referral_code=self.code)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Referral.objects.get().referee.username, 'bob')
+
+    def test_unknown_code_does_not_block_registration(self):
+        response = self.register('bob', referral_code='NOSUCHCD')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.filter(username='bob').exists())
+        self.assertFalse(Referral.objects.exists())
+
+
+class ReferralCodeCacheTests(TestCase):
+    def setUp(self):
+        self.cache = ReferralCodeCache(size=2, ttl=60)
+        self.codes = [make_user(name).referral_code for name in ('alice', 'bob', 'carol')]
+
+    def test_hits_skip_the_database(self):
+        code = self.codes[0]
+        self.assertEqual(self.cache.get(code.code), (code.pk, code.user_id))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(code.code), (code.pk, code.user_id))
+
+    def test_unknown_codes_are_not_cached(self):
+        self.cache.get(self.codes[0].code)
+        self.cache.get('NOSUCHCD')
+
+        with self.assertNumQueries(0):
+            self.cache.get(self.codes[0].code)
+
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = (code.code for code in self.codes)
+        self.cache.get(first)
+        self.cache.get(second)
+        self.cache.get(first)
+
+        self.cache.get(third)
+
+        with self.assertNumQueries(0):
+            self.cache.get(first)
+        with self.assertNumQueries(1):
+            self.cache.get(second)
+
+    def test_entries_expire(self):
+        with mock.patch('app.referrals.time.monotonic', return_value=100.0):
+            self.cache.get(self.codes[0].code)
+        with mock.patch('app.referrals.time.monotonic', return_value=161.0), self.assertNumQueries(1):
+            self.cache.get(self.codes[0].code)
+
+    def test_saving_a_code_drops_it_from_the_process_cache(self):
+        code = self.codes[0]
+        code_cache.get(code.code)
+
+        code.is_active = False
+        code.save()
+
+        self.assertIsNone(code_cache.get(code.code))
+
+
+# Referral expiry
+
+class ReferralExpiryTests(TestCase):
+    def setUp(self):
+        ReferralProgram.objects.create()
+        self.referrer = make_user('alice')
+
+    def due_referrals(self, count):
+        referrals = [make_referral(self.referrer, make_user(f'friend{index}')) for index in range(count)]
+        Referral.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        return referrals
+
+    def test_due_referrals_expire_and_both_users_are_told(self):
+        due, = self.due_referrals(1)
+        current = make_referral(self.referrer, make_user('bob'))
+
+        self.assertEqual(expire_batch(), (1, 2))
+
+        self.assertEqual(Referral.objects.get(pk=due.pk).status, 'expired')
+        self.assertEqual(Referral.objects.get(pk=current.pk).status, 'pending')
+        messages = dict(Notification.objects.values_list('user__username', 'message'))
+        self.assertIn('friend0 did not make a qualifying deposit', messages['alice'])
+        self.assertIn("from alice's referral", messages['friend0'])
+
+    def test_sweeps_run_in_bounded_batches(self):
+        self.due_referrals(5)
+
+        stats = expire_referrals(batch_size=2, max_batches=2)
+        self.assertEqual((stats.batches, stats.expired, stats.notified), (2, 4, 8))
+
+        stats = expire_referrals(batch_size=2)
+        self.assertEqual((stats.batches, stats.expired), (1, 1))
+        self.assertFalse(Referral.objects.filter(status='pending').exists())
+
+    def test_referral_qualified_mid_batch_is_not_notified(self):
+        raced, other = self.due_referrals(2)
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            # The qualification worker commits between the read and the UPDATE
+            if kwargs.get('status') == 'expired':
+                update(Referral.objects.filter(pk=raced.pk), status='qualified')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            expired, notified = expire_batch()
+
+        self.assertEqual((expired, notified), (1, 2))
+        self.assertEqual(Referral.objects.get(pk=raced.pk).status, 'qualified')
+        self.assertEqual(
+            set(Notification.objects.values_list('user_id', flat=True)), {self.referrer.pk, other.referee_id}
+        )
+
+    def test_queued_deposit_is_evaluated_before_expiry(self):
+        referral = make_referral(self.referrer, make_user('bob'))
+        ledger.record_transaction(referral.referee, 'deposit', Decimal('100'), 'USD')
+        # The deadline passes before the evaluation worker picks the deposit up
+        Referral.objects.update(expires_at=timezone.now() + timedelta(seconds=1))
+        later = timezone.now() + timedelta(minutes=1)
+
+        self.assertEqual(expire_batch(later), (0, 0))
+        self.assertEqual(evaluate_batch().qualified, 1)
+        self.assertEqual(expire_batch(later), (0, 0))
+
+        self.assertEqual(Referral.objects.get(pk=referral.pk).status, 'paid')
+        self.assertFalse(Notification.objects.filter(message__contains='did not make').exists())
+
+    def test_command(self):
+        self.due_referrals(2)
+        out = StringIO()
+
+        call_command('expire_referrals', stdout=out)
+
+        self.assertIn('Expired 2 referrals in 1 batches and sent 4 notifications', out.getvalue())
@@ -37,6 +37,7 @@ urlpatterns = [
     path('auth/user/', views.current_user, name='current_user'),
     
     # API endpoints
+    re_path(r'^api/tags/suggest/?$', views.suggest_tags, name='tag_suggest'),
     path('api/', include(router.urls)),
     
     # DRF browsable API (for development)
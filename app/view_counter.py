@@ -0,0 +1,138 @@
+"""
+Buffered product view counting
+Views are coalesced in memory per product and written as a handful of
+batched F() updates, so hot products never serialize writers on their row
+"""
+
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+FLUSH_THRESHOLD = getattr(settings, 'VIEW_COUNT_FLUSH_THRESHOLD', 500)
+TRACK_ACTIVITY = getattr(settings, 'VIEW_COUNT_TRACK_ACTIVITY', True)
+UPDATE_CHUNK_SIZE = 500
+
+
+class ViewCountBuffer:
+    """Per-process buffer of pending product view increments"""
+
+    def __init__(self, interval=FLUSH_INTERVAL, threshold=FLUSH_THRESHOLD, track_activity=TRACK_ACTIVITY):
+        self.interval = interval
+        self.threshold = threshold
+        self.track_activity = track_activity
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = Counter()
+        self._activities = []
+        self._pending = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, product_id, user=None, ip_address=None, user_agent=None):
+        """Count one view; flushes inline once the threshold is reached"""
+        self._ensure_timer()
+        with self._lock:
+            self._counts[product_id] += 1
+            if self.track_activity and user is not None and user.is_authenticated:
+                self._activities.append((user.pk, product_id, ip_address, user_agent))
+            self._pending += 1
+            should_flush = self._pending >= self.threshold
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered increments; returns the number of views written"""
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, Counter()
+                activities, self._activities = self._activities, []
+                self._pending = 0
+            if not counts:
+                return 0
+
+            try:
+                self._write(counts, activities)
+            except Exception:
+                # Put the views back so the next flush retries them
+                logger.exception('Failed to flush product view counts')
+                with self._lock:
+                    self._counts.update(counts)
+                    self._activities[:0] = activities
+                    self._pending += sum(counts.values())
+                return 0
+            return sum(counts.values())
+
+    def _write(self, counts, activities):
+        from .models import Product, UserActivity
+
+        # One UPDATE per distinct increment instead of one per product
+        by_increment = {}
+        for product_id, increment in counts.items():
+            by_increment.setdefault(increment, []).append(product_id)
+
+        with transaction.atomic():
+            for increment, product_ids in by_increment.items():
+                for start in range(0, len(product_ids), UPDATE_CHUNK_SIZE):
+                    Product.objects.filter(
+                        pk__in=product_ids[start:start + UPDATE_CHUNK_SIZE]
+                    ).update(views=F('views') + increment)
+            if activities:
+                existing = set(Product.objects.filter(
+                    pk__in={product_id for _, product_id, _, _ in activities}
+                ).values_list('pk', flat=True))
+                # created_at is the flush time, at most one interval late
+                UserActivity.objects.bulk_create([
+                    UserActivity(
+                        user_id=user_id,
+                        activity_type='product_view',
+                        related_product_id=product_id,
+                        ip_address=ip_address,
+                        user_agent=user_agent,
+                    )
+                    for user_id, product_id, ip_address, user_agent in activities
+                    if product_id in existing
+                ])
+
+    def _ensure_timer(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='view-count-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+
+    def shutdown(self):
+        """Stop the timer and drain whatever is still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+
+buffer = ViewCountBuffer()
+atexit.register(buffer.shutdown)
+
+
+def record_product_view(request, product):
+    """Buffer a view of `product` made by `request`"""
+    buffer.record(
+        product.pk,
+        user=getattr(request, 'user', None),
+        ip_address=request.META.get('REMOTE_ADDR'),
+        user_agent=request.META.get('HTTP_USER_AGENT'),
+    )
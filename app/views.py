@@ -4,10 +4,12 @@ Provides API endpoints for all app models
 """
 
 from django.shortcuts import render
+from django.http import Http404, StreamingHttpResponse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.utils import timezone
 from rest_framework import viewsets, status, permissions
+from rest_framework.generics import get_object_or_404
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -20,7 +22,7 @@ from .models import (
     UserProfile, Wallet, Transaction, ReferralProgram, ReferralCode, Referral,
     MerchantApplication, Product, ProductImage, ProductSubmission,
     Purchase, Review, Notification, Wishlist, UserActivity,
-    MarketplaceSettings, SystemSettings
+    MarketplaceSettings, SystemSettings, TransactionArchive, UserActivityArchive
 )
 from .serializers import (
     UserSerializer, UserProfileSerializer, WalletSerializer, TransactionSerializer,
@@ -30,8 +32,17 @@ from .serializers import (
     NotificationSerializer, WishlistSerializer, UserActivitySerializer,
     MarketplaceSettingsSerializer, SystemSettingsSerializer,
     UserRegistrationSerializer, UserLoginSerializer, ProductCreateSerializer,
-    WalletSummarySerializer
+    WalletSummarySerializer, ProductCardSerializer, product_card_queryset
 )
+from .archive import ArchivedHistory
+from .idempotency import IdempotentCreateMixin
+from .exports import FORMATS as EXPORT_FORMATS, merged_export_rows, parse_bound, render_export
+from .pagination import ProductKeysetPagination
+from .search import ProductSearchFilter
+from .tags import suggester as tag_suggester
+from .similarity import similar_products
+from .view_counter import record_product_view
+from .wallet_summary import get_wallet_summary
 
 
 # Authentication Views (Session-based)
@@ -200,20 +211,22 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    filterset_fields = ['is_verified', 'is_merchant', 'account_type']
+    filterset_fields = ['is_verified']
     search_fields = ['user__username', 'user__email', 'bio', 'location']
     
     def get_queryset(self):
         """Filter profiles based on permissions"""
+        # Referral stats are counters on the code, fetched in the same query
+        queryset = UserProfile.objects.select_related('user', 'user__referral_code')
         if self.action == 'list':
-            return UserProfile.objects.filter(user__is_active=True)
-        return UserProfile.objects.all()
+            return queryset.filter(user__is_active=True)
+        return queryset
     
     @action(detail=False, methods=['get', 'patch'])
     def me(self, request):
         """Get or update current user profile"""
         try:
-            profile = UserProfile.objects.get(user=request.user)
+            profile = UserProfile.objects.select_related('user', 'user__referral_code').get(user=request.user)
         except UserProfile.DoesNotExist:
             profile = UserProfile.objects.create(user=request.user)
         
@@ -238,20 +251,62 @@ class WalletViewSet(viewsets.ReadOnlyModelViewSet):
     
     def get_queryset(self):
         """Users can only access their own wallet"""
-        return Wallet.objects.filter(user_profile__user=self.request.user)
+        return Wallet.objects.filter(user=self.request.user)
     
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        """Get wallet summary for dashboard"""
-        try:
-            wallet = Wallet.objects.get(user_profile__user=request.user)
-            serializer = WalletSummarySerializer(wallet)
-            return Response(serializer.data)
-        except Wallet.DoesNotExist:
+        """Get wallet summary for dashboard (cached, one query on a miss)"""
+        summary = get_wallet_summary(request.user)
+        if summary is None:
             return Response({'error': 'Wallet not found'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = WalletSummarySerializer(summary)
+        return Response(serializer.data)
+
+
+class ArchivedHistoryMixin:
+    """
+    Serve a history from its hot table and its archive as one.
+
+    Filters and ordering apply to both sides; list pages are merged by
+    ArchivedHistory and retrieve falls back to the archive. Subclasses set
+    `archive_model` (with a `user` field) and optionally
+    `archive_select_related`.
+    """
+    archive_model = None
+    archive_select_related = ()
+    
+    def get_archive_queryset(self):
+        """The requesting user's archived rows"""
+        assert self.archive_model is not None, (
+            f"'{self.__class__.__name__}' should include an `archive_model` attribute"
+        )
+        return self.archive_model.objects.filter(user=self.request.user).select_related(
+            *self.archive_select_related
+        )
+    
+    def get_history_ordering(self, queryset):
+        return filters.OrderingFilter().get_ordering(self.request, queryset, self)
+    
+    def list(self, request, *args, **kwargs):
+        hot = self.filter_queryset(self.get_queryset())
+        archived = self.filter_queryset(self.get_archive_queryset())
+        history = ArchivedHistory(hot, archived, self.get_history_ordering(hot))
+        page = self.paginate_queryset(history)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(history[:], many=True).data)
+    
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            return get_object_or_404(
+                self.get_archive_queryset(), **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
 
 
-class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
+class TransactionViewSet(ArchivedHistoryMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for Transaction model (read-only)"""
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
@@ -260,10 +315,58 @@ class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_fields = ['transaction_type', 'currency', 'status']
     ordering_fields = ['created_at', 'amount']
     ordering = ['-created_at']
+    archive_model = TransactionArchive
+    archive_select_related = ['recipient']
     
     def get_queryset(self):
         """Users can only access their own transactions"""
-        return Transaction.objects.filter(wallet__user_profile__user=self.request.user)
+        return Transaction.objects.filter(user=self.request.user).select_related('recipient')
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream transaction history as CSV or NDJSON
+        
+        Query params: file_format (csv|ndjson), date_from, date_to,
+        transaction_type, status, currency. Staff may pass user=<id>, or
+        user=all for every user's transactions.
+        """
+        export_format = request.query_params.get('file_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': f'file_format must be one of {", ".join(EXPORT_FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_from = parse_bound(request.query_params.get('date_from'))
+            date_to = parse_bound(request.query_params.get('date_to'), end=True)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        lookup = {'user': request.user}
+        user_param = request.query_params.get('user')
+        if user_param and request.user.is_staff:
+            if user_param != 'all' and not user_param.isdigit():
+                return Response({'error': 'user must be a user id or "all"'}, status=status.HTTP_400_BAD_REQUEST)
+            lookup = {} if user_param == 'all' else {'user_id': user_param}
+        
+        if date_from:
+            lookup['created_at__gte'] = date_from
+        if date_to:
+            lookup['created_at__lt'] = date_to
+        for field in ('transaction_type', 'status', 'currency'):
+            values = [value for value in request.query_params.get(field, '').split(',') if value]
+            if values:
+                lookup[f'{field}__in'] = values
+        
+        # Each side walks its (user, created_at) index in order, no sort
+        # needed; the two streams are merged as they are read
+        rows = merged_export_rows(
+            TransactionArchive.objects.filter(**lookup).order_by('created_at'),
+            Transaction.objects.filter(**lookup).order_by('created_at'),
+        )
+        lines, content_type = render_export(rows, export_format)
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        filename = f'transactions-{timezone.now():%Y%m%d-%H%M%S}.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
 
 # Referral ViewSets
@@ -282,7 +385,7 @@ class ReferralCodeViewSet(viewsets.ReadOnlyModelViewSet):
     
     def get_queryset(self):
         """Users can only access their own referral codes"""
-        return ReferralCode.objects.filter(user=self.request.user, is_active=True)
+        return ReferralCode.objects.filter(user=self.request.user, is_active=True).select_related('user')
 
 
 class ReferralViewSet(viewsets.ReadOnlyModelViewSet):
@@ -291,18 +394,18 @@ class ReferralViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ReferralSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['is_active']
+    filterset_fields = ['status']
     ordering = ['-created_at']
     
     def get_queryset(self):
         """Users can only access referrals they're involved in"""
         return Referral.objects.filter(
             models.Q(referrer=self.request.user) | models.Q(referee=self.request.user)
-        )
+        ).select_related('referrer', 'referee')
 
 
 # Marketplace ViewSets
-class MerchantApplicationViewSet(viewsets.ModelViewSet):
+class MerchantApplicationViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
     """ViewSet for MerchantApplication model"""
     queryset = MerchantApplication.objects.all()
     serializer_class = MerchantApplicationSerializer
@@ -325,26 +428,50 @@ class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.filter(status='approved')
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]  # Allow anonymous browsing
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
+    pagination_class = ProductKeysetPagination
     filterset_fields = ['category', 'subcategory', 'condition', 'seller_verified', 'featured']
-    search_fields = ['title', 'description', 'tags']
     ordering_fields = ['created_at', 'price', 'rating', 'views']
     ordering = ['-created_at']
     
     def get_permissions(self):
         """Allow anonymous read, require auth for write operations"""
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'similar']:
             permission_classes = [AllowAny]
         else:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
     
     def get_serializer_class(self):
-        """Use different serializer for create"""
+        """Use different serializer for create and for list cards"""
         if self.action == 'create':
             return ProductCreateSerializer
+        if self.action == 'list':
+            return ProductCardSerializer
         return ProductSerializer
     
+    def filter_queryset(self, queryset):
+        """Project list queries down to product card columns"""
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = product_card_queryset(queryset)
+        return queryset
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Return a product and count the view"""
+        product = self.get_object()
+        record_product_view(request, product)
+        serializer = self.get_serializer(product)
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Get precomputed similar products"""
+        product = self.get_object()
+        products = product_card_queryset(similar_products(product))
+        serializer = ProductCardSerializer(products, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+    
     def perform_create(self, serializer):
         """Set the seller when creating a product"""
         serializer.save(seller=self.request.user)
@@ -385,7 +512,7 @@ class ProductImageViewSet(viewsets.ModelViewSet):
 
 
 # Purchase and Review ViewSets
-class PurchaseViewSet(viewsets.ModelViewSet):
+class PurchaseViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
     """ViewSet for Purchase model"""
     queryset = Purchase.objects.all()
     serializer_class = PurchaseSerializer
@@ -471,7 +598,7 @@ class WishlistViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class UserActivityViewSet(viewsets.ReadOnlyModelViewSet):
+class UserActivityViewSet(ArchivedHistoryMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for UserActivity model (read-only)"""
     queryset = UserActivity.objects.all()
     serializer_class = UserActivitySerializer
@@ -479,10 +606,25 @@ class UserActivityViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['activity_type']
     ordering = ['-created_at']
+    archive_model = UserActivityArchive
+    archive_select_related = ['user']
     
     def get_queryset(self):
         """Users can only access their own activity"""
-        return UserActivity.objects.filter(user=self.request.user)
+        return UserActivity.objects.filter(user=self.request.user).select_related('user')
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def suggest_tags(request):
+    """Prefix completions for product tags"""
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+    return Response({
+        'suggestions': tag_suggester.suggest(request.query_params.get('q', ''), limit=limit)
+    })
 
 
 # Settings ViewSets (Admin only)
@@ -0,0 +1,87 @@
+"""
+Materialized wallet summaries for the dashboard
+Each user's balances, USD total, transaction count and last few
+transactions are kept in a WalletSummary row and mirrored into the cache.
+Writes refresh the row after their transaction commits; reads are a cache
+hit, or a single row lookup on a miss.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .exchange_rates import total_usd, wallet_balances
+
+RECENT_TRANSACTIONS = getattr(settings, 'WALLET_SUMMARY_RECENT', 5)
+CACHE_TIMEOUT = getattr(settings, 'WALLET_SUMMARY_CACHE_TIMEOUT', 3600)
+
+SUMMARY_FIELDS = (
+    'usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance', 'total_balance_usd',
+    'total_transactions', 'recent_transactions', 'updated_at',
+)
+
+
+def _cache_key(user_id):
+    return f'wallet-summary:{user_id}'
+
+
+def adjust_transaction_count(user_id, delta):
+    from .models import WalletSummary
+
+    WalletSummary.objects.filter(user_id=user_id).update(total_transactions=F('total_transactions') + delta)
+
+
+def schedule_refresh(user_id):
+    """Refresh `user_id`'s summary once the current transaction commits"""
+    transaction.on_commit(lambda: refresh_wallet_summary(user_id))
+
+
+def refresh_wallet_summary(user_id):
+    """Rebuild the stored summary for `user_id` and replace its cache entry"""
+    from .models import Transaction, TransactionArchive, Wallet, WalletSummary
+    from .serializers import TransactionSerializer
+
+    balances = Wallet.objects.filter(user_id=user_id).values(
+        'usd_balance', 'ngn_balance', 'btc_balance', 'eth_balance'
+    ).first()
+    if balances is None:
+        WalletSummary.objects.filter(user_id=user_id).delete()
+        cache.delete(_cache_key(user_id))
+        return None
+
+    recent = Transaction.objects.filter(user_id=user_id).select_related('recipient').order_by('-created_at')
+    values = dict(
+        balances,
+        total_balance_usd=total_usd(wallet_balances(balances)),
+        recent_transactions=TransactionSerializer(recent[:RECENT_TRANSACTIONS], many=True).data,
+    )
+    updated = WalletSummary.objects.filter(user_id=user_id).update(**values)
+    if not updated:
+        # First refresh: count once, later writes adjust it incrementally.
+        # Archiving moves rows without touching the count.
+        total = (Transaction.objects.filter(user_id=user_id).count()
+                 + TransactionArchive.objects.filter(user_id=user_id).count())
+        WalletSummary.objects.get_or_create(
+            user_id=user_id, defaults=dict(values, total_transactions=total),
+        )
+    summary = WalletSummary.objects.filter(user_id=user_id).values(*SUMMARY_FIELDS).first()
+    cache.set(_cache_key(user_id), summary, timeout=CACHE_TIMEOUT)
+    return summary
+
+
+def get_wallet_summary(user):
+    """Summary dict for `user`: cached, else one query, else built once"""
+    from .models import WalletSummary
+
+    summary = cache.get(_cache_key(user.pk))
+    if summary is None:
+        summary = WalletSummary.objects.filter(user=user).values(*SUMMARY_FIELDS).first()
+        if summary is None:
+            summary = refresh_wallet_summary(user.pk)
+            if summary is None:
+                return None
+        else:
+            cache.set(_cache_key(user.pk), summary, timeout=CACHE_TIMEOUT)
+    # Revalue at current rates; they are cached in-process, so no query
+    return dict(summary, total_balance_usd=total_usd(wallet_balances(summary)))
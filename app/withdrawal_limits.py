@@ -0,0 +1,152 @@
+"""
+Rolling withdrawal limits
+Completed withdrawals are added to per-user day and month aggregates (one
+row per currency) when they are posted and taken back out when they are
+cancelled, so checking Wallet.daily_withdrawal_limit and
+monthly_withdrawal_limit is one lookup on the aggregate's unique index
+instead of a SUM over the transaction history. Limits are in USD.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .exchange_rates import to_usd
+from .ledger import WithdrawalLimitExceeded
+
+
+def period_starts(moment=None):
+    """(day start, month start) dates for `moment` in the current time zone"""
+    day = timezone.localdate(moment) if moment else timezone.localdate()
+    return day, day.replace(day=1)
+
+
+def _apply(user_id, period, start, currency, total, count):
+    from .models import WithdrawalAggregate
+
+    lookup = dict(user_id=user_id, period=period, period_start=start, currency=currency)
+    changes = dict(total=F('total') + total, count=F('count') + count)
+    if WithdrawalAggregate.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            WithdrawalAggregate.objects.create(total=total, count=count, **lookup)
+    except IntegrityError:
+        # Another writer created the row first
+        WithdrawalAggregate.objects.filter(**lookup).update(**changes)
+
+
+def record_withdrawals(transactions, sign=1):
+    """Add (sign=1) or remove (sign=-1) completed withdrawals from the aggregates"""
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for txn in transactions:
+        if txn.transaction_type != 'withdrawal':
+            continue
+        day, month = period_starts(txn.completed_at)
+        for period, start in (('day', day), ('month', month)):
+            delta = deltas[(txn.user_id, period, start, txn.currency)]
+            delta[0] += sign * Decimal(txn.amount)
+            delta[1] += sign
+    for (user_id, period, start, currency), (total, count) in deltas.items():
+        _apply(user_id, period, start, currency, total, count)
+
+
+def withdrawn_usd(user_id, moment=None):
+    """USD withdrawn today and this month, as (day_total, month_total)"""
+    from .models import WithdrawalAggregate
+
+    day, month = period_starts(moment)
+    totals = {'day': Decimal('0'), 'month': Decimal('0')}
+    rows = WithdrawalAggregate.objects.filter(
+        Q(period='day', period_start=day) | Q(period='month', period_start=month),
+        user_id=user_id,
+    ).values_list('period', 'currency', 'total')
+    for period, currency, total in rows:
+        totals[period] += to_usd(total, currency)
+    return totals['day'], totals['month']
+
+
+def check_withdrawal_limits(wallet, amount, currency, moment=None, pending_usd=Decimal('0')):
+    """
+    Raise WithdrawalLimitExceeded if withdrawing `amount` would breach a limit.
+
+    `pending_usd` is the USD value of withdrawals being posted alongside
+    this one that are not in the aggregates yet.
+    """
+    requested = to_usd(amount, currency) + pending_usd
+    day_total, month_total = withdrawn_usd(wallet.user_id, moment)
+    if day_total + requested > wallet.daily_withdrawal_limit:
+        raise WithdrawalLimitExceeded(
+            f'Daily withdrawal limit of {wallet.daily_withdrawal_limit} USD exceeded'
+        )
+    if month_total + requested > wallet.monthly_withdrawal_limit:
+        raise WithdrawalLimitExceeded(
+            f'Monthly withdrawal limit of {wallet.monthly_withdrawal_limit} USD exceeded'
+        )
+
+
+def check_batch(transactions):
+    """
+    Check every withdrawal in `transactions` against its wallet's limits.
+
+    Counts completed withdrawals from the aggregates plus the earlier
+    withdrawals of the batch, in any currency. Withdrawals still pending
+    are not counted: limits apply when a withdrawal is posted, and each is
+    checked then against everything posted before it.
+    """
+    from .models import Wallet
+
+    withdrawals = [txn for txn in transactions if txn.transaction_type == 'withdrawal']
+    if not withdrawals:
+        return
+    wallets = Wallet.objects.in_bulk([txn.user_id for txn in withdrawals], field_name='user_id')
+    pending = defaultdict(Decimal)
+    for txn in withdrawals:
+        wallet = wallets.get(txn.user_id)
+        if wallet is None:
+            continue
+        check_withdrawal_limits(wallet, txn.amount, txn.currency, txn.completed_at, pending_usd=pending[txn.user_id])
+        pending[txn.user_id] += to_usd(txn.amount, txn.currency)
+
+
+def rebuild_withdrawal_aggregates():
+    """
+    Recompute every aggregate from completed withdrawals, hot and archived.
+
+    The stored rows are locked before the scan and replaced in the same
+    transaction, so a withdrawal posted meanwhile waits for the rebuild
+    and is then added on top of it rather than being overwritten. Returns
+    (rows written, rows that differed from the stored counters).
+    """
+    from .models import Transaction, TransactionArchive, WithdrawalAggregate
+
+    with transaction.atomic():
+        stored = {
+            (row.user_id, row.period, row.period_start, row.currency): [row.total, row.count]
+            for row in WithdrawalAggregate.objects.select_for_update().iterator(chunk_size=5000)
+            if row.total or row.count
+        }
+
+        computed = defaultdict(lambda: [Decimal('0'), 0])
+        for model in (Transaction, TransactionArchive):
+            rows = model.objects.filter(
+                transaction_type='withdrawal', status='completed', completed_at__isnull=False
+            ).order_by().values_list('user_id', 'currency', 'completed_at', 'amount')
+            for user_id, currency, completed_at, amount in rows.iterator(chunk_size=5000):
+                day, month = period_starts(completed_at)
+                for period, start in (('day', day), ('month', month)):
+                    entry = computed[(user_id, period, start, currency)]
+                    entry[0] += amount
+                    entry[1] += 1
+
+        drifted = sum(1 for key in stored.keys() | computed.keys() if stored.get(key) != computed.get(key))
+        WithdrawalAggregate.objects.all().delete()
+        WithdrawalAggregate.objects.bulk_create([
+            WithdrawalAggregate(user_id=user_id, period=period, period_start=start,
+                                currency=currency, total=total, count=count)
+            for (user_id, period, start, currency), (total, count) in computed.items()
+        ], batch_size=1000)
+    return len(computed), drifted
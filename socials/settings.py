@@ -87,6 +87,19 @@ DATABASES = {
 }
 
 
+# Cache
+# Response-cache tag versions, the marketplace build locks and wallet
+# summaries must be shared by every worker process, so this cannot be the
+# per-process LocMemCache. The database cache needs no extra service; point
+# this at Redis or Memcached in production.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'app_cache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 